@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from kombu import Exchange, Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Qela.settings')
 
@@ -7,4 +8,60 @@ app = Celery('Qela')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Task classes get their own queues so one kind of backlog (a signup wave of
+# emails, a long reconciliation) cannot delay another. Run one worker pool
+# per queue, e.g. `celery -A Qela worker -Q security -c 2 --prefetch-multiplier=1
+# -n security@%h`; see the celery_* services in docker-compose.yml.
+MAX_PRIORITY = 10
+
+# Unrouted tasks go to 'default'. It replaces Celery's implicit 'celery'
+# queue: RabbitMQ refuses to redeclare an existing queue with new arguments
+# (PRECONDITION_FAILED), and 'celery' already exists without x-max-priority.
+# Once the old producers are gone, drain it with a one-off
+# `celery -A Qela worker -Q celery` and delete it.
+QUEUE_NAMES = ('security', 'email', 'analytics', 'maintenance', 'default')
+
+app.conf.task_queues = [
+    Queue(name, Exchange(name), routing_key=name, queue_arguments={'x-max-priority': MAX_PRIORITY})
+    for name in QUEUE_NAMES
+]
+app.conf.task_default_queue = 'default'
+
+app.conf.task_routes = {
+    'accounts.tasks.auto_blacklist_suspicious_ips': {'queue': 'security'},
+
+    'accounts.tasks.send_account_activation_email': {'queue': 'email'},
+    'accounts.tasks.send_password_reset_email': {'queue': 'email'},
+    'accounts.tasks.send_email_change_verification': {'queue': 'email'},
+    'accounts.tasks.dispatch_email_outbox': {'queue': 'email'},
+
+    'accounts.tasks.refresh_admin_dashboard': {'queue': 'analytics'},
+    'accounts.tasks.flush_activity_heartbeats': {'queue': 'analytics'},
+    'feed.tasks.update_most_liked_posts': {'queue': 'analytics'},
+    'feed.tasks.update_most_active_followers': {'queue': 'analytics'},
+    'feed.tasks.update_metric_rollups': {'queue': 'analytics'},
+
+    'accounts.tasks.delete_deactivated_accounts_after_grace_period': {'queue': 'maintenance'},
+    'accounts.tasks.maintain_table_partitions': {'queue': 'maintenance'},
+    'accounts.tasks.rebuild_missing_availability_filters': {'queue': 'maintenance'},
+    'feed.tasks.reconcile_user_analytics': {'queue': 'maintenance'},
+    'feed.tasks.reconcile_user_analytics_range': {'queue': 'maintenance'},
+    'feed.tasks.summarize_reconciliation': {'queue': 'maintenance'},
+    'feed.tasks.release_reconciliation_lock': {'queue': 'maintenance'},
+}
+
+# Priorities run 0 (lowest) to 9 within a queue. RabbitMQ honours them via
+# x-max-priority; the Redis transport emulates them with per-priority lists.
+app.conf.task_queue_max_priority = MAX_PRIORITY
+app.conf.task_default_priority = 5
+app.conf.broker_transport_options = {
+    'priority_steps': list(range(MAX_PRIORITY)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+
+# Tasks that ack late must not be handed out ahead of time
+app.conf.worker_prefetch_multiplier = 1
+app.conf.task_reject_on_worker_lost = True
+
 app.autodiscover_tasks()
@@ -0,0 +1,133 @@
+import contextvars
+import logging
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Users who wrote recently; their replica-eligible reads stay on the primary
+STICKY_KEY = 'db:sticky:{user_id}'
+
+# Writes to these tables are request bookkeeping done on every request, not
+# changes a user expects to read back, so they do not pin anyone to the primary
+STICKY_EXEMPT_MODELS = {'accounts.ipactivity', 'accounts.usersession', 'sessions.session'}
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+class RoutingState:
+    def __init__(self, request=None):
+        self.request = request
+        self.replica_reads = False
+        self.wrote = False
+        self.sticky = None
+        self.alias = None
+
+    def user_id(self):
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.pk
+        return None
+
+    def is_sticky(self):
+        # Looked up at most once per request, and only when a replica read is due
+        if self.sticky is None:
+            user_id = self.user_id()
+            try:
+                self.sticky = bool(user_id and get_redis_connection('default').exists(STICKY_KEY.format(user_id=user_id)))
+            except RedisError:
+                # Unknown, so stay on the primary
+                self.sticky = True
+        return self.sticky
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+@contextmanager
+def use_replica():
+    '''
+    Lets reads inside the block go to a replica, unless the current user
+    wrote within the last REPLICA_STICKY_SECONDS or the block itself has
+    written. Works as a decorator too.
+    '''
+    state = _state.get()
+    token = None
+    if state is None:
+        token = _state.set(state := RoutingState())
+
+    previous = state.replica_reads
+    state.replica_reads = True
+    try:
+        yield
+    finally:
+        state.replica_reads = previous
+        if token is not None:
+            _state.reset(token)
+
+
+class ReplicaRouter:
+    '''
+    Sends reads made under use_replica() to a replica and everything else
+    to the primary. Without replicas configured every query uses 'default'.
+    '''
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_reads or state.wrote:
+            return None
+
+        replicas = replica_aliases()
+        if not replicas or state.is_sticky():
+            return None
+
+        if state.alias is None:
+            state.alias = random.choice(replicas)
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.label_lower not in STICKY_EXEMPT_MODELS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaStickinessMiddleware:
+    '''
+    Tracks writes made while handling a request. A user who changed
+    something reads from the primary for the next few seconds, so replica
+    lag never hides their own changes from them.
+    '''
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        user_id = state.user_id()
+        if state.wrote and user_id and replica_aliases():
+            try:
+                get_redis_connection('default').set(
+                    STICKY_KEY.format(user_id=user_id), 1, ex=settings.REPLICA_STICKY_SECONDS,
+                )
+            except RedisError:
+                logger.warning('Could not pin user %s to the primary database', user_id, exc_info=True)
+
+        return response
@@ -73,7 +73,6 @@ INSTALLED_APPS = [
     # Third-party
     'rest_framework',
     'rest_framework_simplejwt',
-    'rest_framework_simplejwt.token_blacklist',
     'django_filters',
     'graphene_django',
     'csp',
@@ -99,6 +98,9 @@ AUTH_USER_MODEL = 'accounts.User'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
 
+    # Read-your-writes for replica routing; wraps everything that may write
+    'Qela.db_router.ReplicaStickinessMiddleware',
+
     # BLOCK bad IPs FIRST
     'accounts.middleware.IPBlacklistMiddleware',
 
@@ -251,13 +253,29 @@ DATABASES = {
     },
 }
 
+# Read replicas as a comma-separated list of host[:port], e.g. 'replica-1,replica-2:5433'.
+# Each becomes a 'replicaN' alias that only the reads wrapped in use_replica() touch.
+for index, replica in enumerate(filter(None, config('POSTGRES_REPLICA_HOSTS', default='').split(',')), start=1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['Qela.db_router.ReplicaRouter']
+
+# How long a user's replica-eligible reads stay on the primary after they write
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
 
@@ -305,6 +323,9 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
+
+    # Refresh token revocation is tracked in Redis (accounts/revocation.py)
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.serializers.RevocableTokenRefreshSerializer',
 }
 
 # Cache setup for Django
@@ -314,10 +335,22 @@ CACHES = {
         'LOCATION': config('REDIS_URL'),
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-            'IGNORE_EXCEPTIONS': False,
+            # Connections go through accounts.breaker.redis_breaker, which fails
+            # fast while Redis is down instead of letting every request wait on it
+            'CONNECTION_POOL_CLASS': 'accounts.breaker.BreakerConnectionPool',
+            'SOCKET_CONNECT_TIMEOUT': config('REDIS_CONNECT_TIMEOUT', default=0.5, cast=float),
+            'SOCKET_TIMEOUT': config('REDIS_SOCKET_TIMEOUT', default=1.0, cast=float),
+            # A failed cache read is a miss and a failed write is dropped
+            'IGNORE_EXCEPTIONS': True,
         }
     }
 }
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
+REDIS_BREAKER = {
+    'failure_threshold': config('REDIS_BREAKER_THRESHOLD', default=5, cast=int),
+    'cooldown': config('REDIS_BREAKER_COOLDOWN', default=10, cast=float),
+}
 
 # Celery broker using Redis
 CELERY_BROKER_URL = config('CELERY_BROKER_URL')
@@ -334,18 +367,64 @@ CELERY_BEAT_SCHEDULE = {
     'auto-blacklist-bad-ips': {
         'task': 'accounts.tasks.auto_blacklist_suspicious_ips',
         'schedule': 180,  # every 3 minutes
+        'options': {'expires': 170},  # a late run is superseded by the next one
+    },
+
+    # --- EMAIL TASKS ---
+    'dispatch-email-outbox': {
+        'task': 'accounts.tasks.dispatch_email_outbox',
+        'schedule': 60,  # every minute; picks up retries and anything left queued
+    },
+
+    # --- ADMIN DASHBOARD TASKS ---
+    'refresh-admin-dashboard': {
+        'task': 'accounts.tasks.refresh_admin_dashboard',
+        'schedule': 60,  # every minute
+        'options': {'expires': 55},
     },
 
     # --- ACCOUNT CLEANUP TASKS ---
+    'flush-activity-heartbeats': {
+        'task': 'accounts.tasks.flush_activity_heartbeats',
+        'schedule': 60,  # every minute; bounds last_activity staleness
+        'options': {'expires': 55},
+    },
+
     'delete-old-deactivated-accounts': {
         'task': 'accounts.tasks.delete_deactivated_accounts_after_grace_period',
         'schedule': 3600,  # every 1 hour
     },
 
+    'maintain-table-partitions': {
+        'task': 'accounts.tasks.maintain_table_partitions',
+        'schedule': 86400,  # daily; creates future months, expires old ones
+    },
+
+    'rebuild-missing-availability-filters': {
+        'task': 'accounts.tasks.rebuild_missing_availability_filters',
+        'schedule': 300,  # every 5 minutes; a no-op while the filters are intact
+        'options': {'expires': 290},
+    },
+
     # --- ANALYTICS TASKS ---
     'update-most-liked-posts': {
         'task': 'feed.tasks.update_most_liked_posts',
-        'schedule': 86400,  # every 24 hours
+        'schedule': 900,  # every 15 minutes, dirty authors only
+    },
+
+    'update-most-active-followers': {
+        'task': 'feed.tasks.update_most_active_followers',
+        'schedule': 300,  # every 5 minutes
+    },
+
+    'update-metric-rollups': {
+        'task': 'feed.tasks.update_metric_rollups',
+        'schedule': 300,  # every 5 minutes, changed post-days only
+    },
+
+    'reconcile-user-analytics': {
+        'task': 'feed.tasks.reconcile_user_analytics',
+        'schedule': 86400,  # daily drift repair
     },
 }
 
@@ -408,4 +487,11 @@ FRONTEND_URL = config('FRONTEND_URL')
 
 GRAPHENE = {
     'SCHEMA': 'feed.schema.schema',
+}
+
+# Cost budgets for the GraphQL endpoint (see feed/graphql/cost.py)
+GRAPHQL_COST_RATES = {
+    'user': '600/min',
+    'ip': '1200/min',
+    'anon': '300/min',
 }
\ No newline at end of file
@@ -17,11 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from django.conf.urls import handler404, handler500
 
 from feed.schema import schema
+from feed.views import RateLimitedGraphQLView
 
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -47,7 +47,7 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # GraphQL endpoint
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql/', csrf_exempt(RateLimitedGraphQLView.as_view(graphiql=True, schema=schema))),
 
     # API Documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0)),
@@ -19,9 +19,9 @@ class CustomAuthBackend(BaseBackend):
 
         # Fetch user by email or username
         if '@' in login_value:
-            user = User.objects.filter(email__iexact=login_value).first()
+            user = User.objects.filter_lower('email', login_value).first()
         else:
-            user = User.objects.filter(username__iexact=login_value).first()
+            user = User.objects.filter_lower('username', login_value).first()
 
         # Check password and account status
         if not user or not user.check_password(password):
@@ -0,0 +1,42 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from accounts.cache import get_cached_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+    JWT authentication that:
+    - Validates the token at most once per request
+    - Resolves the user through the L1/L2 user cache instead of a
+      primary-key query on every request
+    '''
+
+    def authenticate(self, request):
+        # DRF wraps the Django request; memoize on the underlying one
+        http_request = getattr(request, '_request', request)
+
+        if not hasattr(http_request, '_jwt_auth_result'):
+            http_request._jwt_auth_result = super().authenticate(request)
+        return http_request._jwt_auth_result
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user.password_digest:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import math
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from accounts.models import User
+
+logger = logging.getLogger(__name__)
+
+# Fields with a Bloom filter of taken values, stored lowercased
+AVAILABILITY_FIELDS = ('username', 'email')
+
+# Scalable Bloom filter: when a layer reaches its capacity a new one is added,
+# GROWTH times larger and with a TIGHTENING times smaller error rate, so the
+# overall false-positive rate stays under ERROR_RATE / (1 - TIGHTENING).
+AVAILABILITY_FILTER = {
+    'capacity': 100_000,
+    'error_rate': 0.001,
+    'growth': 2,
+    'tightening': 0.5,
+    'max_layers': 8,
+    **getattr(settings, 'AVAILABILITY_FILTER', {}),
+}
+
+# bloom:<field>:current holds the live generation; bloom:<field>:building the one
+# a rebuild is filling, so users created meanwhile are added to both
+FILTER_PREFIX = 'bloom:{field}'
+
+# A rebuild that died leaves its generation behind for at most this long
+BUILD_TTL = 60 * 60
+
+# Users whose values stayed in the filter after deletion, until the next rebuild
+STALE_KEY = 'bloom:{field}:stale'
+
+REBUILD_BATCH_SIZE = 5000
+
+_LAYER_LOOKUP = '''
+local function layer_has(key, m, k, h1, h2)
+    for j = 0, k - 1 do
+        if redis.call('GETBIT', key, (h1 + j * h2) % m) == 0 then
+            return false
+        end
+    end
+    return true
+end
+
+local function contains(gen_prefix, h1, h2)
+    local layers = tonumber(redis.call('GET', gen_prefix .. ':layers')) or 1
+    for i = 0, layers - 1 do
+        local m, k = tonumber(ARGV[3 + i * 3]), tonumber(ARGV[4 + i * 3])
+        if layer_has(gen_prefix .. ':' .. i, m, k, h1, h2) then
+            return true
+        end
+    end
+    return false
+end
+'''
+
+# KEYS[1] = filter prefix; ARGV = h1, h2, then (bits, hashes, capacity) per layer.
+# Returns 1 when the value may be present, 0 when it is definitely absent and
+# -1 when no filter has been built yet.
+CONTAINS_SCRIPT = _LAYER_LOOKUP + '''
+local gen = redis.call('GET', KEYS[1] .. ':current')
+if not gen then
+    return -1
+end
+if contains(KEYS[1] .. ':' .. gen, tonumber(ARGV[1]), tonumber(ARGV[2])) then
+    return 1
+end
+return 0
+'''
+
+# Same arguments. Adds the value to the live and the building generation.
+ADD_SCRIPT = _LAYER_LOOKUP + '''
+local h1, h2 = tonumber(ARGV[1]), tonumber(ARGV[2])
+local max_layers = (#ARGV - 2) / 3
+
+for _, pointer in ipairs({':current', ':building'}) do
+    local gen = redis.call('GET', KEYS[1] .. pointer)
+    if gen then
+        local gen_prefix = KEYS[1] .. ':' .. gen
+        if not contains(gen_prefix, h1, h2) then
+            local layer = (tonumber(redis.call('GET', gen_prefix .. ':layers')) or 1) - 1
+            local m, k, capacity = tonumber(ARGV[3 + layer * 3]), tonumber(ARGV[4 + layer * 3]), tonumber(ARGV[5 + layer * 3])
+            for j = 0, k - 1 do
+                redis.call('SETBIT', gen_prefix .. ':' .. layer, (h1 + j * h2) % m, 1)
+            end
+            local count = redis.call('INCR', gen_prefix .. ':' .. layer .. ':count')
+            if count >= capacity and layer + 1 < max_layers then
+                redis.call('SET', gen_prefix .. ':layers', layer + 2)
+            end
+        end
+    end
+end
+return 1
+'''
+
+# KEYS[1] = filter prefix; ARGV[1] = generation. Makes the built generation
+# live, unless the rebuild was invalidated meanwhile (see invalidate_filters),
+# in which case it returns -1. Otherwise returns the replaced generation.
+SWAP_SCRIPT = '''
+if redis.call('GET', KEYS[1] .. ':building') ~= ARGV[1] then
+    return -1
+end
+local old = redis.call('GET', KEYS[1] .. ':current')
+redis.call('SET', KEYS[1] .. ':current', ARGV[1])
+redis.call('DEL', KEYS[1] .. ':building', KEYS[2])
+return old
+'''
+
+_scripts = {}
+
+
+def _script(body):
+    if body not in _scripts:
+        _scripts[body] = get_redis_connection('default').register_script(body)
+    return _scripts[body]
+
+
+def _layer_params():
+    args = []
+    capacity = AVAILABILITY_FILTER['capacity']
+    error_rate = AVAILABILITY_FILTER['error_rate']
+    for _ in range(AVAILABILITY_FILTER['max_layers']):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        args += [bits, hashes, capacity]
+        capacity *= AVAILABILITY_FILTER['growth']
+        error_rate *= AVAILABILITY_FILTER['tightening']
+    return args
+
+
+# (bits, hashes, capacity) of every layer, flattened for the scripts
+LAYER_PARAMS = _layer_params()
+
+
+def _hashes(value):
+    # Double hashing: bit j of a layer is (h1 + j * h2) % bits
+    digest = hashlib.blake2b(value.lower().encode(), digest_size=8).digest()
+    return int.from_bytes(digest[:4], 'big'), int.from_bytes(digest[4:], 'big') | 1
+
+
+def _run(body, field, value, client=None):
+    return _script(body)(
+        keys=[FILTER_PREFIX.format(field=field)],
+        args=[*_hashes(value), *LAYER_PARAMS],
+        client=client,
+    )
+
+
+def might_be_taken(field, value):
+    '''
+    False only when the filter proves nobody has this value, in which case
+    the database lookup can be skipped. Any doubt (a possible match, a
+    missing filter, Redis being unavailable) returns True.
+    '''
+    try:
+        return _run(CONTAINS_SCRIPT, field, value) != 0
+    except RedisError:
+        logger.warning('Availability filter lookup failed for %s', field, exc_info=True)
+        return True
+
+
+def add_taken_values(user, fields=AVAILABILITY_FIELDS):
+    '''
+    Adds the user's values for `fields` to their filters in one round trip.
+    A value that could not be added would make the filter deny it exists,
+    so on failure the filters are invalidated instead of raising.
+    '''
+    try:
+        redis = get_redis_connection('default')
+        pipe = redis.pipeline(transaction=False)
+        for field in fields:
+            _run(ADD_SCRIPT, field, getattr(user, field), client=pipe)
+        pipe.execute()
+    except RedisError:
+        logger.warning('Could not add user %s to the availability filters', user.pk, exc_info=True)
+        invalidate_filters(fields)
+
+
+def invalidate_filters(fields=AVAILABILITY_FIELDS):
+    '''
+    Takes the filters for `fields` out of use, including any rebuild in
+    progress, so lookups go to the database until rebuild_missing_filters()
+    builds them again.
+    '''
+    try:
+        redis = get_redis_connection('default')
+        for field in fields:
+            prefix = FILTER_PREFIX.format(field=field)
+            redis.delete(f'{prefix}:current', f'{prefix}:building')
+    except RedisError:
+        logger.error('Could not invalidate the availability filters %s; rebuild them once Redis is back', fields, exc_info=True)
+
+
+def mark_values_stale(count=1):
+    '''
+    Bloom filters cannot forget values, so a deleted user's username and
+    email keep answering "maybe taken" (and fall through to the database)
+    until the next rebuild. This keeps count of them.
+    '''
+    try:
+        redis = get_redis_connection('default')
+        pipe = redis.pipeline(transaction=False)
+        for field in AVAILABILITY_FIELDS:
+            pipe.incrby(STALE_KEY.format(field=field), count)
+        pipe.execute()
+    except RedisError:
+        # Only a statistic; stale values cost a database lookup, never a wrong answer
+        logger.warning('Could not count released availability values', exc_info=True)
+
+
+def _delete_generation(redis, prefix, gen):
+    keys = [f'{prefix}:{gen}:layers']
+    for layer in range(AVAILABILITY_FILTER['max_layers']):
+        keys += [f'{prefix}:{gen}:{layer}', f'{prefix}:{gen}:{layer}:count']
+    redis.delete(*keys)
+
+
+def rebuild_filter(field, batch_size=REBUILD_BATCH_SIZE):
+    '''
+    Builds a fresh generation of the `field` filter from the users table and
+    swaps it in. The live filter keeps answering throughout, and values
+    written while the rebuild runs go into both. Returns the values added,
+    or None if the filter was invalidated before the rebuild finished.
+    '''
+    redis = get_redis_connection('default')
+    prefix = FILTER_PREFIX.format(field=field)
+    gen = uuid.uuid4().hex[:12]
+    redis.set(f'{prefix}:building', gen, ex=BUILD_TTL)
+
+    added = 0
+    values = User.objects.order_by().values_list(field, flat=True).iterator(chunk_size=batch_size)
+    pipe = redis.pipeline(transaction=False)
+    for value in values:
+        # Values the live generation already holds are skipped there
+        _run(ADD_SCRIPT, field, value, client=pipe)
+        added += 1
+        if added % batch_size == 0:
+            pipe.expire(f'{prefix}:building', BUILD_TTL)
+            pipe.execute()
+    pipe.execute()
+
+    old_gen = _script(SWAP_SCRIPT)(keys=[prefix, STALE_KEY.format(field=field)], args=[gen])
+    if old_gen == -1:
+        _delete_generation(redis, prefix, gen)
+        return None
+    if old_gen:
+        _delete_generation(redis, prefix, old_gen.decode())
+
+    return added
+
+
+def rebuild_availability_filters(batch_size=REBUILD_BATCH_SIZE):
+    return {field: rebuild_filter(field, batch_size) for field in AVAILABILITY_FIELDS}
+
+
+def rebuild_missing_filters(batch_size=REBUILD_BATCH_SIZE):
+    '''
+    Rebuilds the filters that have no live generation, either never built
+    or invalidated after a failed write.
+    '''
+    redis = get_redis_connection('default')
+    missing = [field for field in AVAILABILITY_FIELDS if not redis.exists(f'{FILTER_PREFIX.format(field=field)}:current')]
+    return {field: rebuild_filter(field, batch_size) for field in missing}
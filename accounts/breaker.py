@@ -0,0 +1,175 @@
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from redis import ConnectionPool
+from redis.connection import Connection
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+REDIS_BREAKER = {
+    'failure_threshold': 5,  # consecutive connection failures before opening
+    'cooldown': 10,          # seconds to fail fast before probing again
+    **getattr(settings, 'REDIS_BREAKER', {}),
+}
+
+
+class CircuitOpenError(ConnectionError):
+    '''Raised instead of contacting Redis while the breaker is open.'''
+
+
+class CircuitBreaker:
+    '''
+    Per-process circuit breaker. After `failure_threshold` consecutive
+    failures it opens and calls fail at once for `cooldown` seconds; then a
+    single probe is let through (half-open), whose outcome closes the
+    breaker or opens it for another cooldown.
+    '''
+    def __init__(self, name, failure_threshold, cooldown):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_started_at = 0
+        self.probe_thread = None
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        logger.warning('%s circuit breaker: %s -> %s (%s consecutive failures)', self.name, self.state, state, self.failures)
+        self.state = state
+
+    def before_call(self):
+        if self.state == CLOSED:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.cooldown:
+                self._transition(HALF_OPEN)
+                self._start_probe(now)
+                return
+            if self.state == HALF_OPEN:
+                # The probing thread may connect and send; a probe that never
+                # reported back is replaced after a cooldown
+                if self.probe_thread == threading.get_ident():
+                    return
+                if now - self.probe_started_at >= self.cooldown:
+                    self._start_probe(now)
+                    return
+            if self.state != CLOSED:
+                raise CircuitOpenError(f'{self.name} circuit breaker is {self.state}')
+
+    def _start_probe(self, now):
+        self.probe_started_at = now
+        self.probe_thread = threading.get_ident()
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+                self.probe_thread = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+                self.opened_at = time.monotonic()
+                self.probe_thread = None
+
+    @property
+    def is_closed(self):
+        return self.state == CLOSED
+
+
+redis_breaker = CircuitBreaker('redis', REDIS_BREAKER['failure_threshold'], REDIS_BREAKER['cooldown'])
+
+
+def best_effort(func):
+    '''
+    For Redis writes a request can do without, such as dirty markers and
+    buffered counters: a RedisError is logged and the call returns None, so
+    the database work around it still succeeds.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except RedisError as exc:
+            # An open breaker has already been logged
+            if not isinstance(exc, CircuitOpenError):
+                logger.warning('Skipped %s, Redis is unavailable', func.__qualname__, exc_info=True)
+            return None
+    return wrapper
+
+
+def _record_failure(exc):
+    # A failed connect inside send_packed_command reaches both wrappers
+    if isinstance(exc, CircuitOpenError) or getattr(exc, 'breaker_recorded', False):
+        return
+    exc.breaker_recorded = True
+    redis_breaker.record_failure()
+
+
+class BreakerConnectionMixin:
+    '''
+    Guards every Redis connection (cache, raw clients, scripts, pub/sub) with
+    `redis_breaker`. Only connection errors and timeouts count as failures;
+    command errors such as NOSCRIPT mean Redis is answering.
+    '''
+    def connect(self):
+        redis_breaker.before_call()
+        try:
+            return super().connect()
+        except (ConnectionError, TimeoutError) as exc:
+            _record_failure(exc)
+            raise
+
+    def send_packed_command(self, command, check_health=True):
+        redis_breaker.before_call()
+        try:
+            return super().send_packed_command(command, check_health)
+        except (ConnectionError, TimeoutError) as exc:
+            _record_failure(exc)
+            raise
+
+    def read_response(self, *args, **kwargs):
+        try:
+            response = super().read_response(*args, **kwargs)
+        except (ConnectionError, TimeoutError) as exc:
+            _record_failure(exc)
+            raise
+        redis_breaker.record_success()
+        return response
+
+
+_guarded_classes = {}
+
+
+def guarded_connection_class(connection_class):
+    if connection_class not in _guarded_classes:
+        _guarded_classes[connection_class] = type(
+            f'Breaker{connection_class.__name__}', (BreakerConnectionMixin, connection_class), {},
+        )
+    return _guarded_classes[connection_class]
+
+
+class BreakerConnectionPool(ConnectionPool):
+    '''
+    Connection pool for django-redis (CONNECTION_POOL_CLASS) whose
+    connections, TCP, TLS or unix socket alike, go through the breaker.
+    '''
+    def __init__(self, connection_class=Connection, **kwargs):
+        super().__init__(connection_class=guarded_connection_class(connection_class), **kwargs)
@@ -0,0 +1,64 @@
+from django.db import router
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from accounts.models import User, BlacklistedIP
+from accounts.tiered_cache import TieredCache
+
+# Holds CACHED_USER_FIELDS only, never the password hash or profile data
+user_cache = TieredCache('user', l1_ttl=30, l2_ttl=60, l1_max_size=1024)
+
+# What authentication and permission checks read from request.user. Saves
+# invalidate the entry; the other columns, which .update() calls such as the
+# heartbeat flush also write, are never cached.
+CACHED_USER_FIELDS = ('id', 'is_active', 'is_deactivated', 'is_verified', 'is_staff', 'is_superuser', 'is_platform_admin')
+
+# Checked on every request by IPBlacklistMiddleware; misses are cached too
+blacklist_cache = TieredCache('blacklisted_ip', l1_ttl=30, l2_ttl=300, l1_max_size=4096)
+
+
+def _load_user_fields(user_id):
+    user = User.objects.filter(pk=user_id).only(*CACHED_USER_FIELDS, 'password').first()
+    if user is None:
+        return None
+    fields = {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        # Only the digest the token is checked against
+        fields['password_digest'] = get_md5_hash_password(user.password)
+    return fields
+
+
+def get_cached_user(user_id):
+    '''
+    Resolves a User by primary key through the process-local and Redis
+    tiers before falling back to the database.
+    Returns None if the user does not exist.
+
+    The user is rebuilt from CACHED_USER_FIELDS with every other field
+    deferred. Reading one loads it from the database, and save() without
+    update_fields writes only the loaded fields, so a cached user never
+    writes back a stale column.
+    '''
+    fields = user_cache.get(user_id, lambda: _load_user_fields(user_id))
+    if fields is None:
+        return None
+    # from_db takes the values in model field order
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+    user = User.from_db(router.db_for_write(User), names, [fields[name] for name in names])
+    user.password_digest = fields.get('password_digest')
+    return user
+
+
+def invalidate_cached_user(*user_ids):
+    user_cache.invalidate(*user_ids)
+
+
+def is_ip_blacklisted(ip_address):
+    return blacklist_cache.get(
+        ip_address,
+        lambda: BlacklistedIP.objects.filter(ip_address=ip_address, is_active=True).exists(),
+    )
+
+
+def invalidate_blacklisted_ips(*ip_addresses):
+    blacklist_cache.invalidate(*ip_addresses)
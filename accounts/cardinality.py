@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+# Per-day HyperLogLogs (~12 KB each, ~0.81% standard error)
+ACTIVE_USERS_KEY = 'hll:active_users:{day}'
+DEVICES_KEY = 'hll:devices:{day}'
+
+# Unions over a trailing window, cached briefly between reads
+WINDOW_KEY = '{prefix}:last{days}:{day}'
+WINDOW_TTL = 60
+
+# Day keys must outlive the longest window read from them
+DAY_TTL = 60 * 60 * 24 * 35
+
+WINDOWS = {'daily': 1, 'weekly': 7, 'monthly': 30}
+
+
+def device_fingerprint(ip_address, user_agent):
+    return f'{ip_address}|{user_agent}'
+
+
+def record_activity(user_id, ip_address, user_agent):
+    '''
+    Adds the user and their device to today's HyperLogLogs in one round trip.
+    '''
+    day = timezone.now().date().isoformat()
+    users_key = ACTIVE_USERS_KEY.format(day=day)
+    devices_key = DEVICES_KEY.format(day=day)
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline(transaction=False)
+    pipe.pfadd(users_key, user_id)
+    pipe.pfadd(devices_key, device_fingerprint(ip_address, user_agent))
+    pipe.expire(users_key, DAY_TTL)
+    pipe.expire(devices_key, DAY_TTL)
+    pipe.execute()
+
+
+def _day_keys(key, days, today):
+    return [key.format(day=(today - timedelta(days=offset)).isoformat()) for offset in range(days)]
+
+
+def window_counts(key, today=None):
+    '''
+    Returns {'daily', 'weekly', 'monthly'} estimates for a per-day HLL key.
+    Each window is PFMERGEd from its day keys into a short-lived union key.
+    '''
+    today = today or timezone.now().date()
+    prefix = key.split(':{day}')[0]
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline(transaction=False)
+    for days in WINDOWS.values():
+        union_key = WINDOW_KEY.format(prefix=prefix, days=days, day=today.isoformat())
+        pipe.pfmerge(union_key, *_day_keys(key, days, today))
+        pipe.expire(union_key, WINDOW_TTL)
+        pipe.pfcount(union_key)
+    results = pipe.execute()
+
+    # Every third reply is a PFCOUNT
+    return dict(zip(WINDOWS, results[2::3]))
+
+
+def daily_series(key, days=30, today=None):
+    '''
+    Returns [(day, estimate)] for the last `days` days, oldest first.
+    '''
+    today = today or timezone.now().date()
+    keys = _day_keys(key, days, today)
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline(transaction=False)
+    for day_key in keys:
+        pipe.pfcount(day_key)
+    counts = pipe.execute()
+
+    return [
+        ((today - timedelta(days=offset)).isoformat(), count)
+        for offset, count in reversed(list(enumerate(counts)))
+    ]
+
+
+def active_user_counts(today=None):
+    return window_counts(ACTIVE_USERS_KEY, today)
+
+
+def unique_device_counts(today=None):
+    return window_counts(DEVICES_KEY, today)
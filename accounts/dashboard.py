@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from datetime import timedelta
+from django_countries import countries
+
+from accounts.models import User, UserProfile, UserSession, IPActivity, BlacklistedIP
+from accounts.country import COUNTRY_COORDS
+from accounts.cardinality import active_user_counts, unique_device_counts
+
+DASHBOARD_SNAPSHOT_KEY = 'admin:dashboard:snapshot'
+
+# Outlives a few missed refresh runs; the view rebuilds on a miss
+DASHBOARD_SNAPSHOT_TTL = getattr(settings, 'DASHBOARD_SNAPSHOT_TTL', 60 * 5)
+
+
+def build_dashboard_snapshot():
+    '''
+    Computes every admin dashboard metric with one conditional-aggregation
+    query per table (plus the grouped top-N and per-day/per-country lists).
+    Returns plain data so the snapshot can be cached.
+    '''
+    now = timezone.now()
+    last_7_days = now - timedelta(days=7)
+    fourteen_days_ago = now - timedelta(days=14)
+
+    users = User.objects.aggregate(
+        total=Count('id'),
+        verified=Count('id', filter=Q(is_verified=True)),
+        platform_admins=Count('id', filter=Q(is_platform_admin=True)),
+        deactivated=Count('id', filter=Q(is_deactivated=True)),
+        new_this_week=Count('id', filter=Q(date_joined__gte=last_7_days)),
+        new_prev_week=Count('id', filter=Q(date_joined__gte=fourteen_days_ago, date_joined__lt=last_7_days)),
+    )
+
+    sessions = UserSession.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        inactive=Count('id', filter=Q(is_active=False)),
+    )
+
+    # HyperLogLog estimates instead of DISTINCT scans
+    active_users = active_user_counts()
+    unique_devices = unique_device_counts()
+
+    ip_activity = IPActivity.objects.aggregate(
+        total=Count('id'),
+        suspicious=Count('id', filter=Q(is_suspicious=True)),
+        requests=Sum('request_count'),
+        failed_attempts=Sum('failed_attempts'),
+    )
+
+    blacklist = BlacklistedIP.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+    )
+
+    top_active_ips = list(
+        IPActivity.objects
+        .values('ip_address')
+        .annotate(total=Count('id'))
+        .order_by('-total')[:10]
+    )
+    top_active_users = list(
+        IPActivity.objects
+        .exclude(user__isnull=True)
+        .values('user__email')
+        .annotate(total_requests=Count('id'))
+        .order_by('-total_requests')[:10]
+    )
+
+    # Real per-day signup data
+    signup_data = [
+        {'day': str(item['day']), 'count': item['count']}
+        for item in (
+            User.objects.filter(date_joined__gte=last_7_days)
+            .annotate(day=TruncDate('date_joined'))
+            .values('day')
+            .annotate(count=Count('id'))
+            .order_by('day')
+        )
+    ]
+
+    total_users = users['total']
+    country_names = dict(countries)
+    formatted_countries = [
+        {
+            'code': item['country'],
+            'name': country_names.get(item['country'], 'Unknown') if item['country'] else 'Unknown',
+            'percent': round((item['total'] / total_users) * 100, 1) if total_users else 0,
+            'coords': COUNTRY_COORDS.get(item['country'], [0, 0]),
+        }
+        for item in UserProfile.objects.values('country').annotate(total=Count('id')).order_by('-total')
+    ]
+
+    new_this_week = users['new_this_week']
+    new_prev_week = users['new_prev_week']
+    if new_prev_week > 0:
+        growth_pct = round(((new_this_week - new_prev_week) / new_prev_week) * 100, 1)
+    elif new_this_week > 0:
+        growth_pct = 100.0
+    else:
+        growth_pct = 0
+
+    return {
+        # User metrics
+        'total_users': total_users,
+        'active_users': active_users['weekly'],
+        'daily_active_users': active_users['daily'],
+        'monthly_active_users': active_users['monthly'],
+        'verified_users': users['verified'],
+        'platform_admins': users['platform_admins'],
+        'deactivated_users': users['deactivated'],
+        'new_users_this_week': new_this_week,
+
+        # Session metrics
+        'total_sessions': sessions['total'],
+        'active_sessions': sessions['active'],
+        'inactive_sessions': sessions['inactive'],
+        'unique_devices': unique_devices['monthly'],
+
+        # Security metrics
+        'ip_activity_records': ip_activity['total'],
+        'suspicious_ips': ip_activity['suspicious'],
+        'tracked_requests': ip_activity['requests'] or 0,
+        'failed_attempts': ip_activity['failed_attempts'] or 0,
+        'blacklisted_ips': blacklist['active'],
+        'inactive_blacklisted_ips': blacklist['total'] - blacklist['active'],
+
+        'top_active_ips': top_active_ips,
+        'top_active_users': top_active_users,
+
+        'all_countries': formatted_countries,
+        'top_countries': formatted_countries[:5],
+
+        'signup_data_last_7_days': signup_data,
+
+        'user_growth_percent': growth_pct,
+
+        'generated_at': now,
+    }
+
+
+def refresh_dashboard_snapshot():
+    snapshot = build_dashboard_snapshot()
+    cache.set(DASHBOARD_SNAPSHOT_KEY, snapshot, DASHBOARD_SNAPSHOT_TTL)
+    return snapshot
+
+
+def get_dashboard_snapshot(refresh=False):
+    '''
+    Returns the cached snapshot kept warm by the refresh task, rebuilding
+    it when missing or when an explicit refresh is requested.
+    '''
+    snapshot = None if refresh else cache.get(DASHBOARD_SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = refresh_dashboard_snapshot()
+    return snapshot
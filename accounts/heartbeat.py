@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django_redis import get_redis_connection
+
+from accounts.models import User
+
+# user id -> unix time of their latest request, since the last flush
+HEARTBEAT_KEY = 'heartbeat:last_activity'
+
+# Entries taken by a flush; left behind if that flush fails and merged into the next one
+HEARTBEAT_FLUSHING_KEY = 'heartbeat:last_activity:flushing'
+
+# Rows per UPDATE ... FROM (VALUES ...) statement
+HEARTBEAT_FLUSH_BATCH_SIZE = getattr(settings, 'HEARTBEAT_FLUSH_BATCH_SIZE', 1000)
+
+
+def record_heartbeat(user_id):
+    '''
+    Notes that the user was just active. Repeated requests overwrite the
+    same sorted-set member, so the set holds one entry per active user.
+    '''
+    redis = get_redis_connection('default')
+    redis.zadd(HEARTBEAT_KEY, {user_id: time.time()})
+
+
+def _take_heartbeats(redis):
+    # Moves the pending entries aside atomically; requests arriving during the
+    # flush land in a fresh HEARTBEAT_KEY. Keeps the newest time per user.
+    pipe = redis.pipeline(transaction=True)
+    pipe.zunionstore(HEARTBEAT_FLUSHING_KEY, [HEARTBEAT_FLUSHING_KEY, HEARTBEAT_KEY], aggregate='MAX')
+    pipe.delete(HEARTBEAT_KEY)
+    pipe.execute()
+    return redis.zrange(HEARTBEAT_FLUSHING_KEY, 0, -1, withscores=True)
+
+
+def _update_sql(rows):
+    table = User._meta.db_table
+    values = ', '.join(['(%s::bigint, %s::timestamptz)'] * rows)
+    return f'''
+        UPDATE {table} AS u SET last_activity = v.seen
+        FROM (VALUES {values}) AS v(id, seen)
+        WHERE u.id = v.id AND u.last_activity < v.seen
+    '''
+
+
+def flush_heartbeats(batch_size=HEARTBEAT_FLUSH_BATCH_SIZE):
+    '''
+    Writes the buffered heartbeats to User.last_activity with one bulk
+    UPDATE per batch. Rows are only moved forward in time, and users
+    deleted since their last request are skipped by the join.
+    Returns the number of users updated.
+    '''
+    redis = get_redis_connection('default')
+    entries = _take_heartbeats(redis)
+    if not entries:
+        return 0
+
+    updated = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for index in range(0, len(entries), batch_size):
+            batch = entries[index:index + batch_size]
+            params = []
+            for member, score in batch:
+                params += [int(member), datetime.fromtimestamp(score, dt_timezone.utc)]
+            cursor.execute(_update_sql(len(batch)), params)
+            updated += cursor.rowcount
+
+    redis.delete(HEARTBEAT_FLUSHING_KEY)
+    return updated
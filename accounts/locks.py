@@ -0,0 +1,223 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+import uuid
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'lock:{name}'
+
+# Incremented on every acquisition: a later holder always has a larger fence
+FENCE_KEY = 'lock:{name}:fence'
+
+# Times a run found the lock taken, for spotting tasks that outgrow their interval
+CONTENDED_KEY = 'lock:{name}:contended'
+
+# KEYS: lock, fence. ARGV: token, lease ms. Returns the fence, or nil when held.
+ACQUIRE_SCRIPT = '''
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return nil
+'''
+
+# KEYS: lock. ARGV: token, lease ms. Extends the lease only for its owner.
+RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+# KEYS: lock. ARGV: token. Deletes the lock only for its owner.
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+# KEYS: key, its fence key. ARGV: fence, ttl ms, value (none to delete).
+# Refuses writers whose fence is older than the last one that wrote the key.
+FENCED_WRITE_SCRIPT = '''
+local last = tonumber(redis.call('GET', KEYS[2]))
+if last and last > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+if ARGV[3] then
+    redis.call('SET', KEYS[1], ARGV[3], 'PX', ARGV[2])
+else
+    redis.call('DEL', KEYS[1])
+end
+return 1
+'''
+
+FENCED_KEY_FENCE = '{key}:fence'
+
+_current_lock = contextvars.ContextVar('current_lock', default=None)
+
+
+class LockLost(Exception):
+    '''Raised by LeaseLock.check() once the lease has expired or been taken over.'''
+
+
+class LeaseLock:
+    '''
+    A Redis lock held for `lease` seconds at a time. While held, a background
+    thread renews the lease every third of it, so a long run keeps the lock
+    and a crashed one frees it within one lease. Each acquisition is given a
+    fencing token that increases monotonically per lock name; fenced_write()
+    uses it to refuse writes from a holder that has been superseded.
+    '''
+    def __init__(self, name, lease=60):
+        self.name = name
+        self.lease_ms = int(lease * 1000)
+        self.key = LOCK_KEY.format(name=name)
+        self.token = uuid.uuid4().hex
+        self.fence = None
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self.redis = get_redis_connection('default')
+
+    def acquire(self, heartbeat=True):
+        '''
+        Takes the lock if it is free. Without `heartbeat` nothing renews the
+        lease: the lock can then outlive this process, handed over by token
+        to the tasks that finish the work (see renew_lock and release_lock).
+        '''
+        fence = self.redis.eval(ACQUIRE_SCRIPT, 2, self.key, FENCE_KEY.format(name=self.name), self.token, self.lease_ms)
+        if fence is None:
+            self.redis.incr(CONTENDED_KEY.format(name=self.name))
+            return False
+
+        self.fence = int(fence)
+        if not heartbeat:
+            return True
+        self._heartbeat = threading.Thread(target=self._renew, name=f'lock-heartbeat:{self.name}', daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _renew(self):
+        renewed_at = time.monotonic()
+        while not self._stop.wait(self.lease_ms / 3000):
+            try:
+                renewed = self.redis.eval(RENEW_SCRIPT, 1, self.key, self.token, self.lease_ms)
+            except Exception:
+                logger.warning('Could not renew lock %s', self.name, exc_info=True)
+                # Past a whole lease without renewal another run may hold it
+                if time.monotonic() - renewed_at >= self.lease_ms / 1000:
+                    logger.error('Lock %s (fence %s) expired while it could not be renewed', self.name, self.fence)
+                    self.lost.set()
+                    return
+                continue
+            renewed_at = time.monotonic()
+            if not renewed:
+                logger.error('Lock %s (fence %s) was lost before the task finished', self.name, self.fence)
+                self.lost.set()
+                return
+
+    def check(self):
+        if self.lost.is_set():
+            raise LockLost(f'Lock {self.name} (fence {self.fence}) is no longer held')
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        self.redis.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+
+
+def check_lock():
+    '''
+    Raises LockLost if the single_flight lock of the running task has been
+    lost. Call it between chunks of work that must not overlap another run;
+    outside a single_flight task it does nothing.
+    '''
+    lock = _current_lock.get()
+    if lock is not None:
+        lock.check()
+
+
+def single_flight(lease=60, name=None, on_contention='skip', retry_countdown=30):
+    '''
+    Lets at most one invocation of the decorated task run at a time. Place it
+    under @shared_task. An overlapping invocation is skipped (returning
+    {'skipped': 'locked'}) or, with on_contention='retry' on a bound task,
+    retried after `retry_countdown` seconds.
+    '''
+    def decorator(func):
+        lock_name = name or f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            lock = LeaseLock(lock_name, lease)
+            if not lock.acquire():
+                logger.warning('%s is already running; %s this invocation', lock_name, 'retrying' if on_contention == 'retry' else 'skipping')
+                if on_contention == 'retry':
+                    task = args[0]
+                    raise task.retry(countdown=retry_countdown)
+                return {'skipped': 'locked'}
+
+            token = _current_lock.set(lock)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_lock.reset(token)
+                lock.release()
+
+        return wrapper
+    return decorator
+
+
+def renew_lock(name, token, lease):
+    '''
+    Extends lock `name` by `lease` seconds if `token` still holds it, for a
+    lock taken with acquire(heartbeat=False). Returns whether it is held.
+    '''
+    redis = get_redis_connection('default')
+    return bool(redis.eval(RENEW_SCRIPT, 1, LOCK_KEY.format(name=name), token, int(lease * 1000)))
+
+
+def release_lock(name, token):
+    '''
+    Releases lock `name` if `token` still holds it.
+    '''
+    redis = get_redis_connection('default')
+    redis.eval(RELEASE_SCRIPT, 1, LOCK_KEY.format(name=name), token)
+
+
+def fenced_write(key, value, ttl):
+    '''
+    Sets `key` to the string `value` for `ttl` seconds, or deletes it when
+    value is None, on behalf of the running single_flight task. A write from
+    a run whose lock has since been taken over by a newer one (a larger
+    fence) is refused with LockLost. Outside a single_flight task the write
+    is unconditional.
+    '''
+    redis = get_redis_connection('default')
+    lock = _current_lock.get()
+    if lock is None:
+        if value is None:
+            redis.delete(key)
+        else:
+            redis.set(key, value, ex=ttl)
+        return
+
+    args = [lock.fence, int(ttl * 1000)] + ([] if value is None else [value])
+    if not redis.eval(FENCED_WRITE_SCRIPT, 2, key, FENCED_KEY_FENCE.format(key=key), *args):
+        lock.lost.set()
+        raise LockLost(f'Lock {lock.name} (fence {lock.fence}) was taken over; refusing to write {key}')
+
+
+def lock_contention(name):
+    '''
+    Returns how many invocations of `name` found its lock taken.
+    '''
+    redis = get_redis_connection('default')
+    return int(redis.get(CONTENDED_KEY.format(name=name)) or 0)
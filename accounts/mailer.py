@@ -0,0 +1,330 @@
+import json
+import logging
+import time
+import uuid
+from functools import lru_cache
+from smtplib import SMTPRecipientsRefused, SMTPResponseException
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid
+from django.template.loader import get_template
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Rendered messages waiting to be sent, as JSON
+OUTBOX_KEY = 'mail:outbox'
+
+# Messages whose last attempt failed, scored by when to try again
+RETRY_KEY = 'mail:retry'
+
+# The message a dispatch run is sending sits in that run's processing list
+# until it is sent or scheduled for retry. Runs are registered in
+# PROCESSING_RUNS_KEY, scored by lease expiry; the lists of runs whose lease
+# ran out (killed, OOM, hard time limit) are handed back to the outbox.
+PROCESSING_KEY = 'mail:processing:{run}'
+PROCESSING_RUNS_KEY = 'mail:processing'
+PROCESSING_LEASE = 600  # seconds, renewed per message; well past the task's hard time limit
+
+# Set while a dispatch run is queued, so a signup wave schedules one run, not one per email
+DISPATCH_SCHEDULED_KEY = 'mail:dispatch_scheduled'
+DISPATCH_SCHEDULED_TTL = 60
+
+MAIL_BATCH_SIZE = getattr(settings, 'MAIL_BATCH_SIZE', 100)
+
+# Batches sent per dispatch run before yielding the worker
+MAIL_MAX_BATCHES = getattr(settings, 'MAIL_MAX_BATCHES', 50)
+
+MAIL_MAX_ATTEMPTS = getattr(settings, 'MAIL_MAX_ATTEMPTS', 4)
+MAIL_RETRY_BACKOFF = 30  # seconds, doubled per attempt
+
+# SMTP servers drop idle sessions; reconnect rather than reuse one idle this long
+MAIL_CONNECTION_IDLE = getattr(settings, 'MAIL_CONNECTION_IDLE', 60)
+
+# Errors the server answered with: the message was refused, not delivered.
+# Any other connection error while a message is on the wire may have come
+# after the server accepted it.
+REFUSED_ERRORS = (SMTPResponseException, SMTPRecipientsRefused)
+
+
+@lru_cache(maxsize=None)
+def _template(name):
+    return get_template(name)
+
+
+def render_email(template, context):
+    '''
+    Renders the .txt and .html variants of an email template. Compiled
+    templates are kept for the life of the process.
+    '''
+    return (
+        _template(f'{template}.txt').render(context),
+        _template(f'{template}.html').render(context),
+    )
+
+
+def queue_email(subject, template, context, to):
+    '''
+    Renders a message and adds it to the outbox, scheduling a dispatch run
+    unless one is already pending.
+    '''
+    from accounts.tasks import dispatch_email_outbox
+
+    text_body, html_body = render_email(template, context)
+    message = {
+        'subject': subject, 'to': list(to), 'text': text_body, 'html': html_body, 'attempts': 0,
+        # Kept across attempts, so a resend of a possibly delivered message is a recognisable duplicate
+        'message_id': make_msgid(),
+    }
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline(transaction=False)
+    pipe.rpush(OUTBOX_KEY, json.dumps(message))
+    pipe.set(DISPATCH_SCHEDULED_KEY, 1, nx=True, ex=DISPATCH_SCHEDULED_TTL)
+    scheduled = pipe.execute()[1]
+
+    if scheduled:
+        dispatch_email_outbox.delay()
+
+
+class OutboxEmail(EmailMultiAlternatives):
+    '''
+    Notes when the backend serialises it. Backends send the messages of a
+    send_messages() call in order, serialising each one just before handing
+    it over, so after a failure this tells which ones reached the server.
+    '''
+    handed_over = False
+
+    def message(self, *args, **kwargs):
+        result = super().message(*args, **kwargs)
+        self.handed_over = True
+        return result
+
+
+def build_message(message, connection):
+    email = OutboxEmail(
+        subject=message['subject'],
+        body=message['text'],
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=message['to'],
+        connection=connection,
+        headers={'Message-ID': message['message_id']} if message.get('message_id') else None,
+    )
+    email.attach_alternative(message['html'], 'text/html')
+    return email
+
+
+class PooledConnection:
+    '''
+    One mail backend connection per worker process, opened on first use and
+    kept across batches and dispatch runs until it goes idle or drops.
+    '''
+    def __init__(self):
+        self.connection = None
+        self.last_used = 0
+
+    def get(self):
+        if self.connection is not None and (
+            time.monotonic() - self.last_used > MAIL_CONNECTION_IDLE or not self._alive()
+        ):
+            self.close()
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        self.last_used = time.monotonic()
+        return self.connection
+
+    def _alive(self):
+        # A session the server dropped is found here, before any message is
+        # handed to it, rather than by a send that may or may not have landed
+        session = getattr(self.connection, 'connection', None)
+        if session is None:
+            return True
+        try:
+            return session.noop()[0] == 250
+        except OSError:
+            return False
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+pool = PooledConnection()
+
+
+# KEYS: retry zset, outbox. ARGV: now. Moves the due retries in one step.
+REQUEUE_SCRIPT = '''
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, message in ipairs(due) do
+    redis.call('RPUSH', KEYS[2], message)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+return #due
+'''
+
+# KEYS: runs zset, outbox. ARGV: now, processing key prefix. Puts the messages
+# of every expired run back at the head of the outbox and forgets the run.
+RECOVER_SCRIPT = '''
+local recovered = 0
+for _, run in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])) do
+    local processing = ARGV[2] .. run
+    while redis.call('LMOVE', processing, KEYS[2], 'RIGHT', 'LEFT') do
+        recovered = recovered + 1
+    end
+    redis.call('ZREM', KEYS[1], run)
+end
+return recovered
+'''
+
+
+def _requeue_due_retries(redis, now):
+    return redis.eval(REQUEUE_SCRIPT, 2, RETRY_KEY, OUTBOX_KEY, now)
+
+
+def _recover_abandoned(redis, now):
+    recovered = redis.eval(RECOVER_SCRIPT, 2, PROCESSING_RUNS_KEY, OUTBOX_KEY, now, PROCESSING_KEY.format(run=''))
+    if recovered:
+        logger.warning('Requeued %s emails left unsent by a dispatch run that died', recovered)
+    return recovered
+
+
+def _claim_batch(redis, run, processing, batch_size):
+    # The lease is renewed along with every claim
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(PROCESSING_RUNS_KEY, {run: time.time() + PROCESSING_LEASE})
+    for _ in range(batch_size):
+        pipe.lmove(OUTBOX_KEY, processing, 'LEFT', 'RIGHT')
+    return [raw for raw in pipe.execute()[1:] if raw is not None]
+
+
+def _settle(redis, processing, sent, retry, unsent, now):
+    '''
+    Acknowledges the `sent` raw messages, schedules the (raw, message) pairs
+    in `retry` for another attempt and hands the `unsent` raw messages back
+    to the head of the outbox, all in one transaction. Returns how many
+    retries were scheduled and how many messages were given up on.
+    '''
+    pipe = redis.pipeline(transaction=True)
+    for raw in sent:
+        pipe.lrem(processing, 1, raw)
+
+    retried = failed = 0
+    for raw, message in retry:
+        message['attempts'] += 1
+        if message['attempts'] < MAIL_MAX_ATTEMPTS:
+            due = now + MAIL_RETRY_BACKOFF * 2 ** (message['attempts'] - 1)
+            pipe.zadd(RETRY_KEY, {json.dumps(message): due})
+            retried += 1
+        else:
+            logger.error('Giving up on email %r to %s after %s attempts', message['subject'], message['to'], message['attempts'])
+            failed += 1
+        pipe.lrem(processing, 1, raw)
+
+    for raw in reversed(unsent):
+        pipe.lrem(processing, 1, raw)
+        pipe.lpush(OUTBOX_KEY, raw)
+
+    pipe.execute()
+    return retried, failed
+
+
+def _in_flight(emails, error):
+    '''
+    Returns the index of the email a failed send_messages() call stopped on,
+    or None when it failed before handing any over (e.g. could not connect).
+    Pass error=None for an interruption, which counts against the last email
+    handed over.
+    '''
+    handed_over = sum(email.handed_over for email in emails)
+    if error is None or isinstance(error, OSError):
+        # Raised by the server exchange of the last email handed over
+        return handed_over - 1 if handed_over else None
+    # Raised while preparing the next one
+    return min(handed_over, len(emails) - 1)
+
+
+def dispatch_outbox(batch_size=MAIL_BATCH_SIZE, max_batches=MAIL_MAX_BATCHES):
+    '''
+    Drains up to max_batches batches of batch_size messages, each batch
+    moved into this run's processing list and passed to one send_messages()
+    call on the pooled connection. Messages are only removed once sent, so
+    a run that dies mid-send loses nothing: its list goes back to the
+    outbox once its lease expires.
+
+    When a batch fails, the messages sent before the failure are
+    acknowledged, the failing one is scheduled for retry and the rest go
+    back to the outbox untried. If the connection broke while a message
+    was on the wire, it may have been delivered; it is retried flagged
+    `possibly_sent`, under its original Message-ID, and counted as
+    'uncertain'. Returns {'sent', 'retried', 'failed', 'uncertain', 'pending'}.
+    '''
+    redis = get_redis_connection('default')
+    run = uuid.uuid4().hex
+    processing = PROCESSING_KEY.format(run=run)
+
+    # Arrivals from here on schedule their own run
+    redis.delete(DISPATCH_SCHEDULED_KEY)
+    _recover_abandoned(redis, time.time())
+    _requeue_due_retries(redis, time.time())
+
+    stats = {'sent': 0, 'retried': 0, 'failed': 0, 'uncertain': 0}
+    try:
+        for _ in range(max_batches):
+            raws = _claim_batch(redis, run, processing, batch_size)
+            if not raws:
+                break
+
+            messages = [json.loads(raw) for raw in raws]
+            emails = []
+            try:
+                connection = pool.get()
+                emails = [build_message(message, connection) for message in messages]
+                connection.send_messages(emails)
+            except SoftTimeLimitExceeded:
+                # Settle the batch before the task is stopped; the email on
+                # the wire when the limit hit may or may not have been sent
+                index = _in_flight(emails, None) if emails else None
+                if index is None:
+                    _settle(redis, processing, [], [], raws, time.time())
+                else:
+                    messages[index]['possibly_sent'] = True
+                    _settle(redis, processing, raws[:index], [(raws[index], messages[index])], raws[index + 1:], time.time())
+                raise
+            except Exception as exc:
+                pool.close()
+                index = _in_flight(emails, exc) if emails else None
+                if index is None:
+                    # Nothing reached the server: the whole batch waits for a retry
+                    logger.warning('Could not send a batch of %s emails', len(raws), exc_info=True)
+                    retried, failed = _settle(redis, processing, [], list(zip(raws, messages)), [], time.time())
+                else:
+                    message = messages[index]
+                    if isinstance(exc, OSError) and not isinstance(exc, REFUSED_ERRORS):
+                        message['possibly_sent'] = True
+                        stats['uncertain'] += 1
+                        logger.warning('Email %r to %s may have been sent before the connection failed; it will be retried', message['subject'], message['to'], exc_info=True)
+                    else:
+                        logger.warning('Sending email %r to %s failed', message['subject'], message['to'], exc_info=True)
+                    retried, failed = _settle(
+                        redis, processing, raws[:index], [(raws[index], message)], raws[index + 1:], time.time(),
+                    )
+                    stats['sent'] += index
+                stats['retried'] += retried
+                stats['failed'] += failed
+            else:
+                _settle(redis, processing, raws, [], [], time.time())
+                stats['sent'] += len(raws)
+    finally:
+        # A message left behind (Redis failed mid-run) is recovered when the lease expires
+        if not redis.llen(processing):
+            redis.zrem(PROCESSING_RUNS_KEY, run)
+
+    stats['pending'] = redis.llen(OUTBOX_KEY)
+    return stats
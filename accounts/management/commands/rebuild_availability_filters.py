@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from accounts.availability import rebuild_availability_filters, REBUILD_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Redis Bloom filters of taken usernames and emails from the users table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE, help='Values per Redis pipeline')
+
+    def handle(self, *args, **options):
+        added = rebuild_availability_filters(batch_size=options['batch_size'])
+
+        for field, count in added.items():
+            if count is None:
+                self.stdout.write(self.style.WARNING(f'{field}: invalidated during the rebuild, run again'))
+            else:
+                self.stdout.write(f'{field}: {count} values')
+        self.stdout.write(self.style.SUCCESS('Availability filters rebuilt'))
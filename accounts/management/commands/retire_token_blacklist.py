@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from accounts.revocation import REVOKED_JTI_KEY
+
+# Tables of rest_framework_simplejwt.token_blacklist, no longer installed
+BLACKLISTED_TABLE = 'token_blacklist_blacklistedtoken'
+OUTSTANDING_TABLE = 'token_blacklist_outstandingtoken'
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the unexpired refresh tokens blacklisted by the removed token_blacklist app '
+        'into the Redis revocation keys. Run before migrating accounts to 0008, which drops its tables.'
+    )
+
+    def handle(self, *args, **options):
+        if not {BLACKLISTED_TABLE, OUTSTANDING_TABLE}.issubset(connection.introspection.table_names()):
+            self.stdout.write('No token_blacklist tables, nothing to carry over')
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'''
+                    SELECT b.id, o.jti, o.expires_at FROM {BLACKLISTED_TABLE} b
+                    JOIN {OUTSTANDING_TABLE} o ON o.id = b.token_id
+                    WHERE o.expires_at > %s
+                    FOR UPDATE OF b
+                    ''',
+                    [now],
+                )
+                revoked = cursor.fetchall()
+
+                if revoked:
+                    pipe = get_redis_connection('default').pipeline(transaction=False)
+                    for _, jti, expires_at in revoked:
+                        pipe.set(REVOKED_JTI_KEY.format(jti=jti), 1, ex=max(1, int((expires_at - now).total_seconds())))
+                    pipe.execute()
+
+                    # Marks them carried over; the migration refuses to drop rows that are not
+                    cursor.execute(f'DELETE FROM {BLACKLISTED_TABLE} WHERE id = ANY(%s)', [[row[0] for row in revoked]])
+
+            # Lets the app be installed again later without a fake migration
+            MigrationRecorder.Migration.objects.filter(app='token_blacklist').delete()
+
+        self.stdout.write(self.style.SUCCESS(f'{len(revoked)} revoked refresh tokens carried over to Redis'))
@@ -1,7 +1,16 @@
+import logging
+
 from django.http import JsonResponse
 from django.utils.timezone import now
 from user_agents import parse
-from accounts.models import UserSession, IPActivity, BlacklistedIP
+from accounts.models import UserSession, IPActivity, current_period
+from accounts.cache import is_ip_blacklisted
+from accounts.utils import route_template, UNMATCHED_ENDPOINT
+from accounts.cardinality import record_activity
+from accounts.heartbeat import record_heartbeat
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
 
 class DeviceTrackingMiddleware:
     '''
@@ -43,6 +52,14 @@ class DeviceTrackingMiddleware:
                 }
             )
 
+            # Feeds the DAU/WAU/MAU and unique-device HyperLogLogs, and buffers
+            # last_activity until the next heartbeat flush
+            try:
+                record_activity(request.user.pk, ip, raw_user_agent)
+                record_heartbeat(request.user.pk)
+            except RedisError:
+                logger.warning('Could not record activity for user %s', request.user.pk, exc_info=True)
+
         return response
 
     def get_client_ip(self, request):
@@ -66,20 +83,40 @@ class DeviceTrackingMiddleware:
 
 
 class IPActivityLoggingMiddleware:
+    '''
+    Counts requests per IP, route and method. Endpoints are stored as the
+    matched URL pattern rather than the raw path, so token-bearing URLs share
+    one row per route and the table stays bounded by the number of routes.
+    '''
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
+        request._ip_activity_logged = False
+        response = self.get_response(request)
+
+        # Unresolved paths (404s) and requests answered before URL resolution
+        if not request._ip_activity_logged:
+            self.log_activity(request, UNMATCHED_ENDPOINT)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Log or update activity BEFORE the view runs
+        self.log_activity(request, route_template(request.resolver_match))
+        return None
+
+    def log_activity(self, request, endpoint):
+        request._ip_activity_logged = True
         ip = self.get_client_ip(request)
-        endpoint = request.path
         method = request.method
 
-        # Log or update activity BEFORE response
         try:
             activity, created = IPActivity.objects.get_or_create(
                 ip_address=ip,
                 endpoint=endpoint,
                 method=method,
+                period=current_period(),
                 defaults={
                     'user': request.user if request.user.is_authenticated else None
                 }
@@ -93,9 +130,6 @@ class IPActivityLoggingMiddleware:
         except Exception:
             pass
 
-        response = self.get_response(request)
-        return response
-
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
@@ -111,10 +145,7 @@ class IPBlacklistMiddleware:
     def __call__(self, request):
         ip = self.get_client_ip(request)
 
-        if ip and BlacklistedIP.objects.filter(
-            ip_address = ip,
-            is_active = True
-        ).exists():
+        if ip and is_ip_blacklisted(ip):
             return JsonResponse({'detail': 'Access Denied'}, status=403)
         return self.get_response(request)
             
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:32
+
+import accounts.models
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+from django.db.migrations.exceptions import IrreversibleError
+
+from accounts.migrations._partitioning import convert_to_partitioned, fill_in_batches
+
+
+def set_periods(apps, schema_editor):
+    fill_in_batches(
+        schema_editor, 'accounts_ipactivity',
+        "period = date_trunc('month', first_seen AT TIME ZONE 'UTC')::date",
+    )
+
+
+def partition_tables(apps, schema_editor):
+    convert_to_partitioned(schema_editor, apps.get_model('accounts', 'IPActivity'), 'period')
+    convert_to_partitioned(schema_editor, apps.get_model('accounts', 'UserSession'), 'created_at')
+
+
+def keep_partitioned(apps, schema_editor):
+    raise IrreversibleError('accounts.0006 cannot be unapplied: IPActivity and UserSession stay partitioned')
+
+
+class Migration(migrations.Migration):
+    '''
+    Partitions IPActivity and UserSession by month. Not atomic, so rows are
+    copied in committed batches while both tables stay in use. Expect:
+
+    - writes to IPActivity to block while its new unique index is built;
+    - each table to be locked (reads and writes) only for the final swap,
+      which copies again the rows written during the conversion;
+    - a failed run to leave a *_partitioned shadow table, a *_changes log
+      and its trigger to drop by hand before retrying.
+    '''
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0005_user_lower_email_username_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ipactivity',
+            name='accounts_ip_last_se_41c262_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='usersession',
+            name='accounts_us_last_ac_979385_idx',
+        ),
+        migrations.AddField(
+            model_name='ipactivity',
+            name='period',
+            field=models.DateField(default=accounts.models.current_period),
+        ),
+        migrations.RunPython(set_periods, migrations.RunPython.noop, elidable=False),
+        migrations.AlterUniqueTogether(
+            name='ipactivity',
+            unique_together={('ip_address', 'endpoint', 'method', 'period')},
+        ),
+        migrations.AddIndex(
+            model_name='ipactivity',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['last_seen'], name='accounts_ip_last_se_335e82_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['last_active'], name='accounts_us_last_ac_d16efa_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='accounts_us_created_010328_brin'),
+        ),
+        migrations.RunPython(partition_tables, keep_partitioned, elidable=False),
+    ]
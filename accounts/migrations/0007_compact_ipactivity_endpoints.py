@@ -0,0 +1,61 @@
+from django.db import migrations
+
+from accounts.utils import endpoint_for_path
+
+# Raw endpoints rewritten per statement
+BATCH_SIZE = 500
+
+
+def compact_endpoints(apps, schema_editor):
+    '''
+    Rewrites raw request paths stored before IPActivity kept route templates
+    and merges the rows that collapse onto the same (ip, route, method, period).
+    '''
+    IPActivity = apps.get_model('accounts', 'IPActivity')
+    table = IPActivity._meta.db_table
+
+    paths = IPActivity.objects.order_by().values_list('endpoint', flat=True).distinct()
+    mapping = [(path, endpoint) for path in paths.iterator() if (endpoint := endpoint_for_path(path)) != path]
+
+    sql = f'''
+        WITH mapping AS (
+            SELECT * FROM unnest(%s::text[], %s::text[]) AS m(path, endpoint)
+        ),
+        removed AS (
+            DELETE FROM {table} a USING mapping m
+            WHERE a.endpoint = m.path
+            RETURNING a.*, m.endpoint AS route
+        )
+        INSERT INTO {table} AS t (
+            ip_address, user_id, endpoint, method, request_count, failed_attempts,
+            last_seen, first_seen, is_suspicious, period
+        )
+        SELECT ip_address, (array_agg(user_id) FILTER (WHERE user_id IS NOT NULL))[1], route, method,
+               SUM(request_count), SUM(failed_attempts), MAX(last_seen), MIN(first_seen),
+               bool_or(is_suspicious), period
+        FROM removed
+        GROUP BY ip_address, route, method, period
+        ON CONFLICT (ip_address, endpoint, method, period) DO UPDATE SET
+            user_id = COALESCE(t.user_id, EXCLUDED.user_id),
+            request_count = t.request_count + EXCLUDED.request_count,
+            failed_attempts = t.failed_attempts + EXCLUDED.failed_attempts,
+            last_seen = GREATEST(t.last_seen, EXCLUDED.last_seen),
+            first_seen = LEAST(t.first_seen, EXCLUDED.first_seen),
+            is_suspicious = t.is_suspicious OR EXCLUDED.is_suspicious
+    '''
+
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(0, len(mapping), BATCH_SIZE):
+            batch = mapping[start:start + BATCH_SIZE]
+            cursor.execute(sql, [[path for path, _ in batch], [endpoint for _, endpoint in batch]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_partition_activity_and_sessions'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_endpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# Tables of rest_framework_simplejwt.token_blacklist, no longer installed.
+# Their foreign keys to accounts_user would block every user delete.
+TOKEN_BLACKLIST_TABLES = ('token_blacklist_blacklistedtoken', 'token_blacklist_outstandingtoken')
+
+
+def drop_token_blacklist(apps, schema_editor):
+    '''
+    Drops the tables once `manage.py retire_token_blacklist` has copied the
+    still-unexpired blacklisted refresh tokens to the Redis revocation keys
+    (accounts/revocation.py). The command removes the rows it carried over,
+    so any unexpired row left means it has not run, and dropping would
+    quietly make those tokens valid again.
+    '''
+    existing = set(schema_editor.connection.introspection.table_names())
+    if not existing.intersection(TOKEN_BLACKLIST_TABLES):
+        return
+
+    if existing.issuperset(TOKEN_BLACKLIST_TABLES):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT COUNT(*) FROM token_blacklist_blacklistedtoken b
+                JOIN token_blacklist_outstandingtoken o ON o.id = b.token_id
+                WHERE o.expires_at > now()
+                '''
+            )
+            (pending,) = cursor.fetchone()
+        if pending:
+            raise RuntimeError(
+                f'{pending} blacklisted refresh tokens have not expired yet. '
+                'Run `python manage.py retire_token_blacklist` before this migration.'
+            )
+
+    schema_editor.execute(f'DROP TABLE IF EXISTS {", ".join(TOKEN_BLACKLIST_TABLES)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_compact_ipactivity_endpoints'),
+    ]
+
+    operations = [
+        # Irreversible: the revocation state now lives in Redis
+        migrations.RunPython(drop_token_blacklist),
+    ]
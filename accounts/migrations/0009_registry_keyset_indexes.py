@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_drop_token_blacklist_tables'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ipactivity',
+            index=models.Index(fields=['last_seen', 'id'], name='accounts_ip_last_se_9b5f0b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='accounts_us_date_jo_f42ef8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['last_active', 'id'], name='accounts_us_last_ac_784628_idx'),
+        ),
+    ]
@@ -0,0 +1,219 @@
+'''
+Frozen copy of the monthly range-partitioning DDL used by the migrations
+that partition existing tables (accounts 0006, feed 0005 and 0006).
+Migrations must keep doing what they did when they were written, so this
+module does not follow later changes to accounts/partitions.py. The
+leading underscore keeps the migration loader from treating it as a
+migration.
+'''
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+# Rows copied per transaction while the original table stays online
+BATCH_SIZE = 10000
+
+# Future partitions created along with the table
+PREMAKE_MONTHS = 3
+
+INDEX_DEFINITION = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )\S+( ON (?:ONLY )?)\S+( USING )')
+
+
+def month_start(day):
+    if isinstance(day, datetime):
+        day = day.astimezone(dt_timezone.utc).date()
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def create_partition_sql(table, parent, field, month):
+    # Timestamp partitions are cut at UTC midnight, matching the stored values
+    def bound(month):
+        if field.get_internal_type() == 'DateField':
+            return f"'{month.isoformat()}'"
+        return f"'{month.isoformat()} 00:00:00+00'"
+
+    return (
+        f'CREATE TABLE IF NOT EXISTS {table}_p{month:%Y%m} PARTITION OF {parent} '
+        f'FOR VALUES FROM ({bound(month)}) TO ({bound(add_months(month, 1))})'
+    )
+
+
+def create_partitions(cursor, model, field_name, first, last):
+    '''
+    Creates the monthly partitions of `model` covering days first..last.
+    '''
+    table = model._meta.db_table
+    field = model._meta.get_field(field_name)
+    for month in months_between(first, last):
+        cursor.execute(create_partition_sql(table, table, field, month))
+
+
+def _describe(cursor, table):
+    cursor.execute(
+        '''
+        SELECT conname, contype, pg_get_constraintdef(oid), ARRAY(
+            SELECT attname FROM pg_attribute WHERE attrelid = conrelid AND attnum = ANY(conkey)
+        )
+        FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        ''',
+        [table],
+    )
+    constraints = cursor.fetchall()
+
+    cursor.execute(
+        '''
+        SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+        ''',
+        [table],
+    )
+    return constraints, cursor.fetchall()
+
+
+def convert_to_partitioned(schema_editor, model, field_name):
+    '''
+    Rebuilds the table of `model` as a table range-partitioned by month on
+    `field_name`, keeping columns, data, checks, indexes and foreign keys.
+    Postgres requires the partition column in every unique key, so it is
+    appended to the primary key and to unique constraints lacking it.
+
+    Runs in stages so the table stays in use while its rows are copied:
+
+    1. a partitioned shadow table is created, and a trigger starts logging
+       the ids of the rows written to the original;
+    2. the existing rows are copied over in batches of BATCH_SIZE, each in
+       its own transaction, then the shadow's indexes are built;
+    3. under ACCESS EXCLUSIVE, the logged rows are copied again and the
+       shadow replaces the original.
+
+    Only stage 3 blocks the table, for as long as copying the rows written
+    during stages 1-2 takes. Must run in a non-atomic migration.
+    '''
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    field = model._meta.get_field(field_name)
+    column = field.column
+    shadow = f'{table}_partitioned'
+    changes = f'{table}_changes'
+    log_changes = f'{table}_log_changes'
+
+    # Stage 1: the empty shadow table, with its keys, and the change log
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        constraints, indexes = _describe(cursor, table)
+        cursor.execute(f'SELECT MIN({column}), MAX({column}), MAX(id) FROM {table}')
+        low, high, last_id = cursor.fetchone()
+
+        today = timezone.now().date()
+        first = min(month_start(low), today) if low else today
+        last = max(month_start(high), today) if high else today
+
+        statements = [
+            f'CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({column})',
+        ]
+        statements += [
+            create_partition_sql(table, shadow, field, month)
+            for month in months_between(first, add_months(month_start(last), PREMAKE_MONTHS))
+        ]
+
+        # Index-backed keys get a temporary name while the original holds theirs
+        renames = []
+        for position, (name, kind, definition, columns) in enumerate(constraints):
+            if kind == 'f':
+                statements.append(f'ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition}')
+                continue
+            if column not in columns:
+                keys = ', '.join([*columns, column])
+                definition = f"{'PRIMARY KEY' if kind == 'p' else 'UNIQUE'} ({keys})"
+            temporary = f'{shadow}_k{position}'
+            statements.append(f'ALTER TABLE {shadow} ADD CONSTRAINT {temporary} {definition}')
+            renames.append(f'ALTER TABLE {table} RENAME CONSTRAINT {temporary} TO {name}')
+
+        statements += [
+            f'CREATE TABLE {changes} (id bigint NOT NULL)',
+            f'''
+            CREATE FUNCTION {log_changes}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO {changes} VALUES (OLD.id);
+                ELSE
+                    INSERT INTO {changes} VALUES (NEW.id);
+                END IF;
+                RETURN NULL;
+            END
+            $$
+            ''',
+            f'CREATE TRIGGER {log_changes} AFTER INSERT OR UPDATE OR DELETE ON {table} '
+            f'FOR EACH ROW EXECUTE FUNCTION {log_changes}()',
+        ]
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    # Stage 2: the rows that existed when logging started, batch by batch.
+    # A row changed after its batch was copied is in the log.
+    for start in range(0, last_id or 0, BATCH_SIZE):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {shadow} SELECT * FROM {table} WHERE id > %s AND id <= %s',
+                [start, start + BATCH_SIZE],
+            )
+
+    for position, (name, definition) in enumerate(indexes):
+        temporary = f'{shadow}_i{position}'
+        schema_editor.execute(INDEX_DEFINITION.sub(rf'\g<1>{temporary}\g<2>{shadow}\g<3>', definition))
+        renames.append(f'ALTER INDEX {temporary} RENAME TO {name}')
+
+    # Stage 3: replay the log and swap the tables
+    sequence = f'{table}_id_seq'
+    statements = [
+        f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE',
+        # Deferred foreign key checks would otherwise block the renames
+        'SET CONSTRAINTS ALL IMMEDIATE',
+        f'DELETE FROM {shadow} WHERE id IN (SELECT id FROM {changes})',
+        f'INSERT INTO {shadow} SELECT * FROM {table} WHERE id IN (SELECT DISTINCT id FROM {changes})',
+        f'DROP TABLE {table}',
+        f'DROP TABLE {changes}',
+        f'DROP FUNCTION {log_changes}()',
+        f'ALTER TABLE {shadow} RENAME TO {table}',
+        f'CREATE SEQUENCE {sequence} OWNED BY {table}.id',
+        f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')",
+        f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)",
+        *renames,
+    ]
+    with transaction.atomic(using=connection.alias):
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def fill_in_batches(schema_editor, table, assignment):
+    '''
+    Runs `UPDATE table SET assignment` over all rows, one id range of
+    BATCH_SIZE per transaction, so no row stays locked for the whole table.
+    '''
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MAX(id) FROM {table}')
+        (last_id,) = cursor.fetchone()
+
+    for start in range(0, last_id or 0, BATCH_SIZE):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET {assignment} WHERE id > %s AND id <= %s',
+                [start, start + BATCH_SIZE],
+            )
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.contrib.postgres.indexes import BrinIndex
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
 from datetime import timedelta
@@ -31,6 +33,13 @@ class UsersManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def filter_lower(self, field, value):
+        '''
+        Case-insensitive exact match on `field`. Compiles to
+        LOWER("field") = value, which the functional indexes on User serve.
+        '''
+        return self.alias(**{f'{field}_lower': Lower(field)}).filter(**{f'{field}_lower': value.lower()})
+
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -109,6 +118,12 @@ class User(AbstractBaseUser, PermissionsMixin):
             models.Index(fields=['email']),
             models.Index(fields=['username']),
             models.Index(fields=['is_platform_admin']),
+            # Admin registry keyset (accounts/registries.py)
+            models.Index(fields=['date_joined', 'id']),
+
+            # Case-insensitive login and lookup path
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            models.Index(Lower('username'), name='user_username_lower_idx'),
         ]
 
 
@@ -141,6 +156,13 @@ class UserProfile(models.Model):
         return f'{self.user.username} Profile'
     
 
+def current_period():
+    '''
+    First day of the current month; IPActivity counters restart every month.
+    '''
+    return timezone.now().date().replace(day=1)
+
+
 class UserSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sessions')
     ip_address = models.GenericIPAddressField(db_index=True)
@@ -159,7 +181,12 @@ class UserSession(models.Model):
         indexes = [
             models.Index(fields=['user', 'is_active']),
             models.Index(fields=['ip_address']),
-            models.Index(fields=["last_active"]),
+            # Admin registry keyset (accounts/registries.py)
+            models.Index(fields=['last_active', 'id']),
+            # Partitioned monthly by created_at (accounts/partitions.py);
+            # BRIN stays tiny on append-mostly timestamps
+            BrinIndex(fields=['last_active']),
+            BrinIndex(fields=['created_at']),
         ]
         ordering = ['-last_active']
 
@@ -182,12 +209,17 @@ class IPActivity(models.Model):
 
     is_suspicious = models.BooleanField(default=False)
 
+    # Month the counters belong to; also the partition key
+    period = models.DateField(default=current_period)
+
     class Meta:
-        unique_together = ('ip_address', 'endpoint', 'method')
+        unique_together = ('ip_address', 'endpoint', 'method', 'period')
         indexes = [
             models.Index(fields=['ip_address']),
             models.Index(fields=['is_suspicious']),
-            models.Index(fields=['last_seen']),
+            # Admin registry keyset (accounts/registries.py)
+            models.Index(fields=['last_seen', 'id']),
+            BrinIndex(fields=['last_seen']),
         ]
 
 
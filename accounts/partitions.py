@@ -0,0 +1,156 @@
+import logging
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Monthly range-partitioned tables: model label -> partition column
+PARTITIONED_TABLES = {
+    'accounts.IPActivity': 'period',
+    'accounts.UserSession': 'created_at',
+    'feed.PostDailyMetrics': 'date',
+}
+
+# Months kept per table (None keeps everything). Expired partitions are
+# dropped, or detached and left in place for offloading when `archive` is set.
+# With `keep_while_active`, a partition is kept as long as any of its rows
+# has that field inside the retention window: sessions are partitioned by
+# creation but stay alive as long as they are used.
+PARTITION_RETENTION = getattr(settings, 'PARTITION_RETENTION', {
+    'accounts.IPActivity': {'months': 3, 'archive': False},
+    'accounts.UserSession': {'months': 12, 'archive': False, 'keep_while_active': 'last_active'},
+    'feed.PostDailyMetrics': {'months': None, 'archive': True},
+})
+
+# Future partitions kept ready so inserts never miss one
+PARTITION_PREMAKE_MONTHS = getattr(settings, 'PARTITION_PREMAKE_MONTHS', 3)
+
+PARTITION_SUFFIX = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last):
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def _bound(month, field):
+    # Timestamp partitions are cut at UTC midnight, matching the stored values
+    if field.get_internal_type() == 'DateField':
+        return f"'{month.isoformat()}'"
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def create_partition_sql(model, month):
+    table = model._meta.db_table
+    field = model._meta.get_field(PARTITIONED_TABLES[model._meta.label])
+    return (
+        f'CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} '
+        f'FOR VALUES FROM ({_bound(month, field)}) TO ({_bound(add_months(month, 1), field)})'
+    )
+
+
+def ensure_partitions(model, first, last, cursor=None):
+    '''
+    Creates the monthly partitions of `model` covering days first..last.
+    '''
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return ensure_partitions(model, first, last, cursor)
+
+    for month in months_between(first, last):
+        cursor.execute(create_partition_sql(model, month))
+
+
+def existing_partitions(model, cursor):
+    '''
+    Returns {month: partition table name} for the attached partitions of `model`.
+    '''
+    cursor.execute(
+        '''
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        ''',
+        [model._meta.db_table],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def _has_recent_rows(model, partition, field_name, cutoff, cursor):
+    column = model._meta.get_field(field_name).column
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {partition} WHERE {column} >= %s)',
+        [datetime(cutoff.year, cutoff.month, cutoff.day, tzinfo=dt_timezone.utc)],
+    )
+    return cursor.fetchone()[0]
+
+
+def maintain_partitions(today=None):
+    '''
+    Creates the partitions for the coming months and removes the ones past
+    retention. Dropping or detaching a partition is a catalog change, so
+    expiring a month of rows costs the same however many rows it holds.
+    '''
+    current = month_start(today or timezone.now().date())
+    result = {'created': [], 'dropped': [], 'archived': [], 'kept': []}
+
+    for label in PARTITIONED_TABLES:
+        model = apps.get_model(label)
+        table = model._meta.db_table
+        policy = PARTITION_RETENTION.get(label) or {}
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            before = existing_partitions(model, cursor)
+            ensure_partitions(model, current, add_months(current, PARTITION_PREMAKE_MONTHS), cursor)
+            result['created'] += [
+                partition_name(table, month)
+                for month in months_between(current, add_months(current, PARTITION_PREMAKE_MONTHS))
+                if month not in before
+            ]
+
+            if not policy.get('months'):
+                continue
+
+            cutoff = add_months(current, -policy['months'])
+            for month, name in sorted(before.items()):
+                if month >= cutoff:
+                    continue
+                if policy.get('keep_while_active') and _has_recent_rows(model, name, policy['keep_while_active'], cutoff, cursor):
+                    result['kept'].append(name)
+                    continue
+                if policy.get('archive'):
+                    cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                    result['archived'].append(name)
+                else:
+                    cursor.execute(f'DROP TABLE {name}')
+                    result['dropped'].append(name)
+
+    logger.info('Partition maintenance: %s', result)
+    return result
+
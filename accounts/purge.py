@@ -0,0 +1,199 @@
+import json
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CASCADE, SET_NULL, ManyToOneRel
+from django_redis import get_redis_connection
+
+from accounts.models import User
+from accounts.cache import invalidate_cached_user
+from accounts.locks import check_lock, fenced_write
+
+logger = logging.getLogger(__name__)
+
+# Users purged together; every dependent table is emptied for the whole batch
+PURGE_USER_BATCH_SIZE = getattr(settings, 'PURGE_USER_BATCH_SIZE', 100)
+
+# Maximum rows deleted or updated per statement (and per transaction)
+PURGE_ROW_BATCH_SIZE = getattr(settings, 'PURGE_ROW_BATCH_SIZE', 5000)
+
+PURGE_CHECKPOINT_KEY = 'purge:deactivated_accounts:checkpoint'
+PURGE_CHECKPOINT_TTL = 60 * 60 * 24
+
+# Nested cascades deeper than this are not expected in this schema
+MAX_PLAN_DEPTH = 5
+
+# Tables of apps no longer in INSTALLED_APPS that still reference accounts_user.
+# Django cannot cascade into them, so they are purged with plain SQL.
+LEGACY_PURGE_STATEMENTS = [
+    (
+        'token_blacklist_blacklistedtoken',
+        'DELETE FROM token_blacklist_blacklistedtoken WHERE id IN ('
+        'SELECT b.id FROM token_blacklist_blacklistedtoken b '
+        'JOIN token_blacklist_outstandingtoken o ON o.id = b.token_id '
+        'WHERE o.user_id = ANY(%s) LIMIT %s)',
+    ),
+    (
+        'token_blacklist_outstandingtoken',
+        'DELETE FROM token_blacklist_outstandingtoken WHERE id IN ('
+        'SELECT id FROM token_blacklist_outstandingtoken WHERE user_id = ANY(%s) LIMIT %s)',
+    ),
+]
+
+
+def build_purge_plan(model=User, lookup='', depth=0):
+    '''
+    Walks the reverse foreign keys of `model` and returns the ordered steps
+    needed to remove its dependent rows, children before parents:
+    - ('delete', Model, lookup, None) for CASCADE relations
+    - ('set_null', Model, lookup, field) for SET_NULL relations
+    `lookup` is the ORM path from the dependent model back to the user.
+    '''
+    if depth > MAX_PLAN_DEPTH:
+        raise RuntimeError(f'Cascade from {model._meta.label} is too deep to purge safely')
+
+    steps = []
+    for rel in model._meta.get_fields(include_hidden=True):
+        if not isinstance(rel, ManyToOneRel):
+            continue
+
+        field_name = rel.field.name
+        path = f'{field_name}__{lookup}' if lookup else field_name
+
+        if rel.on_delete is CASCADE:
+            steps += build_purge_plan(rel.related_model, path, depth + 1)
+            steps.append(('delete', rel.related_model, path, None))
+        elif rel.on_delete is SET_NULL:
+            steps.append(('set_null', rel.related_model, path, field_name))
+
+    if depth == 0:
+        existing_tables = set(connection.introspection.table_names())
+        for table, sql in LEGACY_PURGE_STATEMENTS:
+            if table in existing_tables:
+                steps.append(('sql', table, sql, None))
+
+    return steps
+
+
+def _save_checkpoint(user_ids, step):
+    # Fenced: a run that lost its lock cannot overwrite its successor's progress
+    fenced_write(PURGE_CHECKPOINT_KEY, json.dumps({'user_ids': user_ids, 'step': step}), PURGE_CHECKPOINT_TTL)
+
+
+def purge_deactivated_accounts(cutoff, user_batch_size=PURGE_USER_BATCH_SIZE, row_batch_size=PURGE_ROW_BATCH_SIZE):
+    '''
+    Permanently deletes accounts deactivated on or before `cutoff`.
+
+    Users are processed in batches. For each batch every dependent table is
+    emptied with chunked set-based statements, each committed on its own, so
+    no transaction holds locks for long. The current batch and step are
+    checkpointed in Redis, fenced by the task lock; a retried run resumes
+    where the last one stopped.
+    '''
+    started = time.monotonic()
+    plan = build_purge_plan()
+    metrics = {'users_purged': 0, 'batches': 0, 'chunks': 0, 'rows_deleted': Counter(), 'rows_nulled': Counter()}
+
+    checkpoint = get_redis_connection('default').get(PURGE_CHECKPOINT_KEY)
+    checkpoint = json.loads(checkpoint) if checkpoint else None
+    if checkpoint:
+        logger.info('Resuming account purge at step %s for %s users', checkpoint['step'], len(checkpoint['user_ids']))
+
+    while True:
+        # Stop before the next batch if another run has taken over
+        check_lock()
+        if checkpoint:
+            user_ids, start = checkpoint['user_ids'], checkpoint['step']
+            checkpoint = None
+        else:
+            user_ids = list(
+                User.objects
+                .filter(is_deactivated=True, deactivated_at__lte=cutoff)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:user_batch_size]
+            )
+            start = 0
+
+        if not user_ids:
+            break
+
+        for index in range(start, len(plan)):
+            _save_checkpoint(user_ids, index)
+            _run_step(plan[index], user_ids, row_batch_size, metrics)
+
+        _save_checkpoint(user_ids, len(plan))
+        deleted = _delete_in_chunks(User._base_manager.filter(pk__in=user_ids), row_batch_size, metrics)
+        metrics['rows_deleted'][User._meta.db_table] += deleted
+        metrics['users_purged'] += deleted
+        metrics['batches'] += 1
+        fenced_write(PURGE_CHECKPOINT_KEY, None, PURGE_CHECKPOINT_TTL)
+
+        # Raw deletes bypass the post_delete signal
+        invalidate_cached_user(*user_ids)
+
+    result = {
+        'users_purged': metrics['users_purged'],
+        'batches': metrics['batches'],
+        'chunks': metrics['chunks'],
+        'rows_deleted': dict(metrics['rows_deleted']),
+        'rows_nulled': dict(metrics['rows_nulled']),
+        'duration_seconds': round(time.monotonic() - started, 2),
+    }
+    logger.info('Account purge finished: %s', result)
+    return result
+
+
+def _run_step(step, user_ids, row_batch_size, metrics):
+    action, target, lookup, field = step
+
+    if action == 'sql':
+        metrics['rows_deleted'][target] += _execute_in_chunks(lookup, user_ids, row_batch_size, metrics)
+        return
+
+    queryset = target._base_manager.filter(**{f'{lookup}__in': user_ids})
+    table = target._meta.db_table
+
+    if action == 'delete':
+        metrics['rows_deleted'][table] += _delete_in_chunks(queryset, row_batch_size, metrics)
+    elif action == 'set_null':
+        metrics['rows_nulled'][table] += _update_in_chunks(queryset, {field: None}, row_batch_size, metrics)
+
+
+def _delete_in_chunks(queryset, batch_size, metrics):
+    model = queryset.model
+    total = 0
+    while True:
+        with transaction.atomic():
+            chunk = model._base_manager.filter(pk__in=queryset.order_by().values('pk')[:batch_size])
+            deleted = chunk._raw_delete(chunk.db)
+        metrics['chunks'] += 1
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def _update_in_chunks(queryset, values, batch_size, metrics):
+    model = queryset.model
+    total = 0
+    while True:
+        with transaction.atomic():
+            updated = model._base_manager.filter(pk__in=queryset.order_by().values('pk')[:batch_size]).update(**values)
+        metrics['chunks'] += 1
+        total += updated
+        if updated < batch_size:
+            return total
+
+
+def _execute_in_chunks(sql, user_ids, batch_size, metrics):
+    total = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [list(user_ids), batch_size])
+            affected = cursor.rowcount
+        metrics['chunks'] += 1
+        total += affected
+        if affected < batch_size:
+            return total
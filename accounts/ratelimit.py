@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from accounts.breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# GCRA (generic cell rate algorithm): one key per limited subject holding its
+# "theoretical arrival time" (TAT) in microseconds. `limit` requests may burst
+# at once, after which they are spaced by period / limit. The check and the
+# update happen in one script, so concurrent requests cannot both slip past.
+#
+# KEYS[1] = limiter key
+# ARGV[1] = emission interval in microseconds (period / limit)
+# ARGV[2] = limit (burst size)
+# ARGV[3] = cost of this request
+# Returns {allowed, remaining, retry_after_us, reset_after_us}
+GCRA_SCRIPT = '''
+local interval = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * cost
+local allow_at = new_tat - interval * limit
+
+if now < allow_at then
+    return {0, 0, allow_at - now, tat - now}
+end
+
+redis.call('SET', KEYS[1], string.format('%d', new_tat), 'PX', math.ceil((new_tat - now) / 1000))
+return {1, math.floor((now - allow_at) / interval), 0, new_tat - now}
+'''
+
+KEY_FORMAT = 'ratelimit:{scope}:{ident}'
+
+# While Redis is unreachable each process enforces the limits on its own,
+# keeping the TATs of at most this many subjects
+LOCAL_MAX_KEYS = 10000
+
+_script = None
+_local_tats = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _gcra():
+    global _script
+    if _script is None:
+        # Script objects run EVALSHA and reload the body only on NOSCRIPT
+        _script = get_redis_connection('default').register_script(GCRA_SCRIPT)
+    return _script
+
+
+def rate_limit(scope, ident, limit, period, cost=1):
+    '''
+    Charges `cost` against the `limit` per `period` seconds budget of
+    (scope, ident) in one atomic round trip.
+    Returns (allowed, remaining, retry_after, reset_after), times in seconds.
+    '''
+    interval = int(period * 1_000_000 / limit)
+    key = KEY_FORMAT.format(scope=scope, ident=ident)
+    try:
+        allowed, remaining, retry_after, reset_after = _gcra()(keys=[key], args=[interval, limit, cost])
+    except RedisError as exc:
+        # An open breaker has already been logged
+        if not isinstance(exc, CircuitOpenError):
+            logger.warning('Rate limiting %s in-process, Redis is unavailable', scope, exc_info=True)
+        allowed, remaining, retry_after, reset_after = _local_gcra(key, interval, limit, cost)
+    return bool(allowed), int(remaining), retry_after / 1_000_000, reset_after / 1_000_000
+
+
+def _local_gcra(key, interval, limit, cost):
+    '''
+    GCRA_SCRIPT over a bounded in-process LRU. The budget is per process,
+    so the effective limit is looser, but never unlimited.
+    '''
+    now = int(time.monotonic() * 1_000_000)
+    with _local_lock:
+        tat = max(_local_tats.get(key, now), now)
+        new_tat = tat + interval * cost
+        allow_at = new_tat - interval * limit
+
+        if now < allow_at:
+            return 0, 0, allow_at - now, tat - now
+
+        _local_tats[key] = new_tat
+        _local_tats.move_to_end(key)
+        while len(_local_tats) > LOCAL_MAX_KEYS:
+            _local_tats.popitem(last=False)
+        return 1, (now - allow_at) // interval, 0, new_tat - now
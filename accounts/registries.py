@@ -0,0 +1,203 @@
+import base64
+import binascii
+import csv
+import json
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Exists, OuterRef
+
+from accounts.models import User, UserSession, IPActivity, BlacklistedIP
+
+# Rows per admin registry page
+REGISTRY_PAGE_SIZE = 50
+
+# Rows fetched per server-side cursor round trip while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+# Query parameters that are not filters ('format' is reserved by DRF)
+PAGING_PARAMS = ('cursor', 'output')
+
+# Registries list the newest rows first by this column, ties broken by id.
+# Each has a matching (column, id) index. Models not listed go by id alone.
+REGISTRY_ORDERING = {
+    'accounts.User': 'date_joined',
+    'accounts.UserSession': 'last_active',
+    'accounts.IPActivity': 'last_seen',
+}
+
+
+def filter_users(params):
+    query = User.objects.select_related('profile')
+
+    # Search functionality
+    search = params.get('search')
+    if search:
+        query = query.filter(
+            Q(username__icontains=search) |
+            Q(name__icontains=search) |
+            Q(email__icontains=search)
+        )
+
+    # Status Filtration
+    status = params.get('status')
+    if status == 'active':
+        query = query.filter(is_active=True, is_deactivated=False)
+    elif status == 'unverified':
+        query = query.filter(is_verified=False)
+    elif status == 'suspended':
+        # Account is disabled by admin but not deleted by user
+        query = query.filter(is_active=False, is_deactivated=False)
+    elif status == 'deactivated':
+        # User-initiated account closure
+        query = query.filter(is_deactivated=True)
+
+    # Role Filtration
+    role = params.get('role')
+    if role == 'admin':
+        query = query.filter(is_platform_admin=True)
+    elif role == 'member':
+        query = query.filter(is_platform_admin=False)
+
+    return query
+
+
+def filter_sessions(params):
+    sessions = UserSession.objects.select_related('user')
+
+    if params.get('status') == 'active':
+        sessions = sessions.filter(is_active=True)
+
+    search = params.get('search')
+    if search:
+        sessions = sessions.filter(
+            Q(user__email__icontains=search) |
+            Q(ip_address__icontains=search) |
+            Q(browser__icontains=search)
+        )
+
+    return sessions
+
+
+def filter_ip_activity(params):
+    # A subquery that checks if the IP exists in the BlacklistedIP table
+    blacklisted_subquery = BlacklistedIP.objects.filter(
+        ip_address=OuterRef('ip_address'),
+        is_active=True
+    )
+
+    logs = IPActivity.objects.select_related('user').annotate(
+        is_currently_blacklisted=Exists(blacklisted_subquery)
+    )
+
+    if params.get('filter') == 'suspicious':
+        logs = logs.filter(is_suspicious=True)
+
+    search = params.get('search')
+    if search:
+        logs = logs.filter(ip_address__icontains=search)
+
+    return logs
+
+
+def filter_blacklist(params):
+    return BlacklistedIP.objects.all()
+
+
+# Registry name -> (filtered queryset builder, exported columns)
+REGISTRIES = {
+    'users': (filter_users, (
+        'id', 'username', 'email', 'name', 'is_active', 'is_verified', 'is_deactivated',
+        'is_platform_admin', 'date_joined', 'last_activity',
+    )),
+    'sessions': (filter_sessions, (
+        'id', 'user__email', 'ip_address', 'device_type', 'os', 'browser', 'is_active',
+        'created_at', 'last_active',
+    )),
+    'ip-activity': (filter_ip_activity, (
+        'id', 'ip_address', 'user__email', 'endpoint', 'method', 'request_count',
+        'failed_attempts', 'is_suspicious', 'is_currently_blacklisted', 'period', 'first_seen', 'last_seen',
+    )),
+    'blacklist': (filter_blacklist, (
+        'id', 'ip_address', 'reason', 'is_active', 'created_at',
+    )),
+}
+
+
+def registry_ordering(model):
+    field = REGISTRY_ORDERING.get(model._meta.label)
+    return (f'-{field}', '-pk') if field else ('-pk',)
+
+
+def encode_cursor(row, field=None):
+    # Full precision: a truncated timestamp would skip or repeat rows
+    key = [getattr(row, field).isoformat(), row.pk] if field else row.pk
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor, field=None):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if field:
+            value, pk = key
+            return datetime.fromisoformat(value), int(pk)
+        return int(key)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, page_size=REGISTRY_PAGE_SIZE):
+    '''
+    Returns (rows, next_cursor) for the page after `cursor`, newest first by
+    the model's REGISTRY_ORDERING column. Pages are keyed on (column, id)
+    rather than an offset, so every page is an index range scan no matter
+    how deep the admin pages.
+    '''
+    field = REGISTRY_ORDERING.get(queryset.model._meta.label)
+    key = decode_cursor(cursor, field) if cursor else None
+    if key is not None and field:
+        value, pk = key
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+    elif key is not None:
+        queryset = queryset.filter(pk__lt=key)
+
+    rows = list(queryset.order_by(*registry_ordering(queryset.model))[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1], field) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def filter_query(params):
+    '''
+    The request's filter parameters, without paging/export ones, as a query string.
+    '''
+    params = params.copy()
+    for name in PAGING_PARAMS:
+        params.pop(name, None)
+    return params.urlencode()
+
+
+class Echo:
+    '''
+    File-like object whose write() hands the value back, letting csv.writer
+    produce rows for a streaming response without buffering them.
+    '''
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, fields, export_format):
+    '''
+    Yields the export line by line. Rows are read through a server-side
+    cursor in fixed-size chunks, so memory use does not grow with the export.
+    '''
+    rows = queryset.order_by(*registry_ordering(queryset.model)).values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    if export_format == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+        return
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
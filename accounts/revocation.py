@@ -0,0 +1,92 @@
+import time
+
+from django.utils.translation import gettext_lazy as _
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# "Tokens issued at or before T are invalid" for a user, T in epoch milliseconds
+REVOKED_BEFORE_KEY = 'jwt:revoked_before:{user_id}'
+
+# Issue time in epoch milliseconds. "iat" has whole-second resolution, which
+# would also revoke a token issued right after, within the same second (a
+# login straight after a password change).
+ISSUED_AT_MS_CLAIM = 'iat_ms'
+
+# Individually revoked refresh tokens (logout, rotation)
+REVOKED_JTI_KEY = 'jwt:revoked_jti:{jti}'
+
+
+def revoke_all_user_tokens(user_id):
+    '''
+    Invalidates every refresh token issued to a user so far with a single
+    write. The watermark only needs to outlive the longest-lived token.
+    '''
+    ttl = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    redis = get_redis_connection('default')
+    redis.set(REVOKED_BEFORE_KEY.format(user_id=user_id), int(time.time() * 1000), ex=ttl)
+
+
+def revoke_token(payload):
+    '''
+    Adds a single refresh token to the deny-set until it would have expired anyway.
+    '''
+    ttl = int(payload['exp'] - time.time())
+    if ttl <= 0:
+        return
+
+    redis = get_redis_connection('default')
+    redis.set(REVOKED_JTI_KEY.format(jti=payload[api_settings.JTI_CLAIM]), 1, ex=ttl)
+
+
+def is_token_revoked(payload):
+    '''
+    Checks the user watermark and the jti deny-set in one round trip.
+    '''
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline()
+    pipe.get(REVOKED_BEFORE_KEY.format(user_id=payload.get(api_settings.USER_ID_CLAIM)))
+    pipe.exists(REVOKED_JTI_KEY.format(jti=payload.get(api_settings.JTI_CLAIM)))
+    revoked_before, jti_revoked = pipe.execute()
+
+    if jti_revoked:
+        return True
+    if revoked_before is None:
+        return False
+
+    revoked_before = int(revoked_before)
+    if revoked_before < 10 ** 12:
+        # Watermark written in seconds, before millisecond precision
+        revoked_before = revoked_before * 1000 + 999
+    # Tokens without the claim predate it; their issue second is all we know
+    issued_at = payload.get(ISSUED_AT_MS_CLAIM, payload.get('iat', 0) * 1000)
+    return issued_at <= revoked_before
+
+
+class RevocableRefreshToken(RefreshToken):
+    '''
+    Refresh token whose revocation state lives in Redis instead of the
+    simplejwt OutstandingToken/BlacklistedToken tables.
+    '''
+    no_copy_claims = (*RefreshToken.no_copy_claims, ISSUED_AT_MS_CLAIM)
+
+    def set_iat(self, claim='iat', at_time=None):
+        super().set_iat(claim, at_time)
+        if claim == 'iat':
+            self.payload[ISSUED_AT_MS_CLAIM] = int((at_time or self.current_time).timestamp() * 1000)
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+
+        try:
+            revoked = is_token_revoked(self.payload)
+        except RedisError:
+            # Fail closed: an unverifiable token is refused, not honoured
+            raise TokenError(_('Token revocation status is unavailable'))
+        if revoked:
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        revoke_token(self.payload)
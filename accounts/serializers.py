@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.exceptions import TokenError, AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from dj_rest_auth.registration.serializers import SocialLoginSerializer
 
@@ -9,12 +10,16 @@ from django.contrib.auth import authenticate
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.utils import timezone
+from django.db import IntegrityError, transaction
 from django_countries import countries
 
 from accounts.models import User, UserProfile
 from accounts.tokens import account_activation_token, password_reset_token
 from accounts.tasks import send_account_activation_email, send_password_reset_email, send_email_change_verification
 from accounts.utils import check_resend_limit, blacklist_all_user_tokens, can_update_account
+from accounts.revocation import RevocableRefreshToken
+from accounts.cache import get_cached_user
+from accounts.availability import might_be_taken
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -70,16 +75,22 @@ class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['name', 'username', 'email', 'password1', 'password2']
+        # Uniqueness is checked in validate_username/validate_email, behind the Bloom filter
+        extra_kwargs = {
+            'username': {'validators': []},
+            'email': {'validators': []},
+        }
 
     def validate_username(self, value):
         value = value.lower()
-        if User.objects.filter(username__iexact=value).exists():
+        # The Bloom filter settles most free names without touching the database
+        if might_be_taken('username', value) and User.objects.filter_lower('username', value).exists():
             raise serializers.ValidationError('Username already taken.')
         return value
 
     def validate_email(self, value):
         value = value.lower()
-        if User.objects.filter(email__iexact=value).exists():
+        if might_be_taken('email', value) and User.objects.filter_lower('email', value).exists():
             raise serializers.ValidationError('Email already in use.')
         return value
 
@@ -93,7 +104,17 @@ class RegisterSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password1')
         validated_data.pop('password2', None)
 
-        user = User.objects.create_user(password=password, **validated_data)
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(password=password, **validated_data)
+        except IntegrityError:
+            # The database constraints are the final check: the filter can miss
+            # values it was never told about, and concurrent signups race
+            if User.objects.filter(username=validated_data['username']).exists():
+                raise serializers.ValidationError({'username': 'Username already taken.'})
+            if User.objects.filter(email=validated_data['email']).exists():
+                raise serializers.ValidationError({'email': 'Email already in use.'})
+            raise
 
         # Async email sending
         send_account_activation_email.delay(user.id)
@@ -126,7 +147,7 @@ class LoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Account is not verified. Check your email.')
 
         # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = RevocableRefreshToken.for_user(user)
         attrs['access'] = str(refresh.access_token)
         attrs['refresh'] = str(refresh)
         attrs['user'] = user
@@ -139,18 +160,49 @@ class LogoutSerializer(serializers.Serializer):
 
     def save(self):
         try:
-            token = RefreshToken(self.validated_data['refresh'])
+            token = RevocableRefreshToken(self.validated_data['refresh'])
             token.blacklist()
         except TokenError:
             pass
 
 
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    '''
+    Token refresh backed by Redis revocation and the user cache,
+    so a refresh needs no Postgres round trip.
+    '''
+    token_class = RevocableRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM, None)
+        if user_id:
+            user = get_cached_user(user_id)
+            if not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        return data
+
+
 class PasswordResetRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, email):
         try:
-            self.user = User.objects.get(email__iexact=email)
+            self.user = User.objects.filter_lower('email', email).get()
         except User.DoesNotExist:
             self.user = None
         return email
@@ -258,7 +310,7 @@ class ResendEmailVerificationSerializer(serializers.Serializer):
 
     def validate_email(self, email):
         try:
-            user = User.objects.get(email__iexact=email)
+            user = User.objects.filter_lower('email', email).get()
         except User.DoesNotExist:
             raise serializers.ValidationError('User with this email does not exist.')
 
@@ -322,7 +374,7 @@ class GoogleLoginSerializer(serializers.Serializer):
             user.save(update_fields=['is_verified', 'is_active'])
 
         # Issue JWT tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = RevocableRefreshToken.for_user(user)
 
         return {
             'refresh': str(refresh),
@@ -1,8 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from allauth.socialaccount.signals import social_account_added
 
-from .models import User, UserProfile
+from .models import User, UserProfile, BlacklistedIP
+from .cache import invalidate_cached_user, invalidate_blacklisted_ips
+from .availability import AVAILABILITY_FIELDS, add_taken_values, mark_values_stale
 from feed.models import UserAnalytics
 
 @receiver(post_save, sender=User)
@@ -20,4 +22,31 @@ def create_profile_for_google_user(request, sociallogin, **kwargs):
 @receiver(post_save, sender=User)
 def create_user_analytics(sender, instance, created, **kwargs):
     if created:
-        UserAnalytics.objects.create(user=instance)
\ No newline at end of file
+        UserAnalytics.objects.create(user=instance)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    # Saves cover deactivation, suspension and password changes
+    invalidate_cached_user(instance.pk)
+
+@receiver(post_save, sender=User)
+def record_taken_values(sender, instance, created, update_fields=None, **kwargs):
+    # Keeps the username/email availability filters in step with new and changed values
+    if created or update_fields is None:
+        add_taken_values(instance)
+    else:
+        changed = [field for field in AVAILABILITY_FIELDS if field in update_fields]
+        if changed:
+            add_taken_values(instance, changed)
+
+
+@receiver(post_delete, sender=User)
+def record_released_values(sender, instance, **kwargs):
+    mark_values_stale()
+
+
+@receiver(post_save, sender=BlacklistedIP)
+@receiver(post_delete, sender=BlacklistedIP)
+def invalidate_blacklist_cache(sender, instance, **kwargs):
+    invalidate_blacklisted_ips(instance.ip_address)
@@ -1,21 +1,38 @@
+import logging
+
 from celery import shared_task
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import timedelta
 from django.db import transaction
-from django.db.models import Count, OuterRef, Subquery
 
 from accounts.models import User, IPActivity, BlacklistedIP
-from feed.models import Post, UserAnalytics
 from accounts.tokens import account_activation_token, password_reset_token, email_verification_token
+from accounts.purge import purge_deactivated_accounts
+from accounts.partitions import month_start, maintain_partitions
+from accounts.dashboard import refresh_dashboard_snapshot
+from accounts.cache import invalidate_blacklisted_ips
+from accounts.heartbeat import flush_heartbeats
+from accounts.availability import rebuild_missing_filters
+from accounts.mailer import queue_email, dispatch_outbox
+from accounts.locks import single_flight, check_lock
+from Qela.db_router import use_replica
+
+logger = logging.getLogger(__name__)
+
+# Maximum rows touched per statement by the auto-blacklist task
+AUTO_BLACKLIST_BATCH_SIZE = getattr(settings, 'AUTO_BLACKLIST_BATCH_SIZE', 1000)
+
+# Queues and routing live in Qela/celery.py. Idempotent tasks ack late so a
+# lost worker's run is redelivered; the email producers ack early because a
+# redelivery would send the message twice. Beat tasks are @single_flight, so a
+# run that outlasts its interval is never joined by the next one.
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3})
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3}, priority=8, soft_time_limit=30, time_limit=60)
 def send_account_activation_email(self, user_id):
     user = User.objects.get(id=user_id)
 
@@ -31,21 +48,10 @@ def send_account_activation_email(self, user_id):
 
     subject = 'Activate Your QELA Account'
 
-    text_body = render_to_string('emails/account_activation_email.txt', context)
-    html_body = render_to_string('emails/account_activation_email.html', context)
+    queue_email(subject, 'emails/account_activation_email', context, to=[user.email])
 
-    email = EmailMultiAlternatives(
-        subject=subject,
-        body=text_body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email],
-    )
-
-    email.attach_alternative(html_body, 'text/html')
-    email.send()
 
-
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3},)
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3}, priority=8, soft_time_limit=30, time_limit=60)
 def send_password_reset_email(self, user_id):
     user = User.objects.get(id=user_id)
 
@@ -61,21 +67,10 @@ def send_password_reset_email(self, user_id):
 
     subject = 'Reset Your QELA Password'
 
-    text_body = render_to_string('emails/password_reset_email.txt', context)
-    html_body = render_to_string('emails/password_reset_email.html', context)
-
-    email = EmailMultiAlternatives(
-        subject=subject,
-        body=text_body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[user.email],
-    )
-
-    email.attach_alternative(html_body, 'text/html')
-    email.send()
+    queue_email(subject, 'emails/password_reset_email', context, to=[user.email])
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3})
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=5, retry_kwargs={'max_retries': 3}, priority=8, soft_time_limit=30, time_limit=60)
 def send_email_change_verification(self, user_id, new_email):
     user = User.objects.get(id=user_id)
 
@@ -92,86 +87,149 @@ def send_email_change_verification(self, user_id, new_email):
 
     subject = 'Confirm Your QELA New Email Address'
 
-    text_body = render_to_string('emails/email_change_verification.txt', context)
-    html_body = render_to_string('emails/email_change_verification.html', context)
+    queue_email(subject, 'emails/email_change_verification', context, to=[new_email])
 
-    email = EmailMultiAlternatives(
-        subject=subject,
-        body=text_body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[new_email],
-    )
 
-    email.attach_alternative(html_body, 'text/html')
-    email.send()
+@shared_task(soft_time_limit=270, time_limit=300)
+def dispatch_email_outbox():
+    '''
+    Sends queued emails in batches over a reused connection; see accounts/mailer.py.
+    Reschedules itself while a backlog remains.
+    '''
+    stats = dispatch_outbox()
+    if stats['pending']:
+        dispatch_email_outbox.delay()
+    return stats
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3}, acks_late=True, soft_time_limit=1800, time_limit=2100)
+@single_flight(lease=120)
 def delete_deactivated_accounts_after_grace_period(self):
     '''
     Permanently deletes user accounts that were explicitly deactivated
     and have remained inactive for 30 days.
+    Dependent rows are purged in committed chunks; see accounts/purge.py.
     '''
     grace_period = timezone.now() - timedelta(days=30)
-    users_to_delete = User.objects.filter(is_deactivated=True, deactivated_at__lte=grace_period)
-    
-    with transaction.atomic():
-        for user in users_to_delete:
-            user.delete()
+    return purge_deactivated_accounts(grace_period)
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3}, acks_late=True, priority=9, soft_time_limit=120, time_limit=150)
+@single_flight(lease=60)
 def auto_blacklist_suspicious_ips(self):
     '''
     Two-stage protection:
     1) 75 requests in 2 minutes - mark suspicious (warning only)
     2) 100 requests in 3 minutes - blacklist IP
+
+    Both stages are set-based: suspicious flags are raised with one UPDATE
+    per chunk and new blacklist entries are written with one bulk INSERT per
+    chunk, so the number of round trips depends on the chunk size rather
+    than on the number of offending rows.
     '''
-    window_2_min = datetime.now() - timedelta(minutes=2)
-    window_3_min = datetime.now() - timedelta(minutes=3)
+    batch_size = AUTO_BLACKLIST_BATCH_SIZE
+    now = timezone.now()
+    window_2_min = now - timedelta(minutes=2)
+    window_3_min = now - timedelta(minutes=3)
 
     # ---- STAGE 1: FLAG SUSPICIOUS (WARNING ONLY) ----
-    suspicious_ips = IPActivity.objects.filter(
+    # Rows only see requests from their own month, so older partitions are skipped
+    suspicious_ids = IPActivity.objects.filter(
+        period__gte=month_start(window_2_min),
         last_seen__gte=window_2_min,
         request_count__gte=75,
         is_suspicious=False
-    )
+    ).values_list('id', flat=True)
+
+    flagged = 0
+    while True:
+        check_lock()
+        # Flagged rows drop out of the filter, so each pass picks up the next chunk
+        with transaction.atomic():
+            updated = IPActivity.objects.filter(
+                id__in=suspicious_ids[:batch_size]
+            ).update(is_suspicious=True)
+        flagged += updated
+        if updated < batch_size:
+            break
 
     # ---- STAGE 2: ACTUAL BLACKLISTING ----
-    abusive_ips = IPActivity.objects.filter(
-        last_seen__gte=window_3_min,
-        request_count__gte=100,
+    abusive_ips = (
+        IPActivity.objects
+        .filter(period__gte=month_start(window_3_min), last_seen__gte=window_3_min, request_count__gte=100)
+        .exclude(ip_address__in=BlacklistedIP.objects.values('ip_address'))
+        .values_list('ip_address', flat=True)
+        .order_by('ip_address')
+        .distinct()
     )
 
-    with transaction.atomic():
-        for activity in suspicious_ips:
-            activity.is_suspicious = True
-            activity.save(update_fields=['is_suspicious'])
-
-        for activity in abusive_ips:
-            BlacklistedIP.objects.get_or_create(
-                ip_address=activity.ip_address,
-                defaults={'reason': 'Too many requests in short time'}
+    blacklisted = 0
+    last_ip = None
+    while True:
+        check_lock()
+        chunk = abusive_ips if last_ip is None else abusive_ips.filter(ip_address__gt=last_ip)
+        ips = list(chunk[:batch_size])
+        if not ips:
+            break
+
+        with transaction.atomic():
+            # ignore_conflicts returns every object passed in, so count the new ones first
+            existing = set(BlacklistedIP.objects.filter(ip_address__in=ips).values_list('ip_address', flat=True))
+            new_ips = [ip for ip in ips if ip not in existing]
+            BlacklistedIP.objects.bulk_create(
+                [BlacklistedIP(ip_address=ip, reason='Too many requests in short time') for ip in new_ips],
+                ignore_conflicts=True,
             )
+        # bulk_create skips the signal that clears cached "not blacklisted" answers
+        invalidate_blacklisted_ips(*new_ips)
+        blacklisted += len(new_ips)
+        last_ip = ips[-1]
 
+        if len(ips) < batch_size:
+            break
+
+    logger.info('Auto-blacklist run: %s IPs flagged suspicious, %s IPs blacklisted', flagged, blacklisted)
+    return {'flagged_suspicious': flagged, 'blacklisted': blacklisted}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=60, retry_kwargs={'max_retries': 3}, acks_late=True, soft_time_limit=600, time_limit=900)
+@single_flight(lease=120)
+def maintain_table_partitions(self):
+    '''
+    Keeps future monthly partitions of IPActivity, UserSession and
+    PostDailyMetrics ready and drops or detaches those past retention.
+    See accounts/partitions.py.
+    '''
+    return maintain_partitions()
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
-def update_most_liked_posts():
-    # Get the most liked post per user
-    top_post_subquery = (
-        Post.objects
-        .filter(author=OuterRef('user_id'))
-        .annotate(likes_count=Count('likes'))
-        .order_by('-likes_count', '-created_at')
-        .values('id')[:1]
-    )
 
-    # Update UserAnalytics in bulk
-    analytics_to_update = []
-    for analytics in UserAnalytics.objects.all():
-        top_post_id = top_post_subquery.filter(author_id=analytics.user_id).first()
-        analytics.most_liked_post_id = top_post_id['id'] if top_post_id else None
-        analytics_to_update.append(analytics)
+@shared_task(acks_late=True, soft_time_limit=50, time_limit=60)
+@single_flight(lease=30)
+def refresh_admin_dashboard():
+    '''
+    Materializes the admin dashboard metrics into the cache so the view
+    never aggregates on request.
+    '''
+    with use_replica():
+        snapshot = refresh_dashboard_snapshot()
+    return {'generated_at': snapshot['generated_at'].isoformat()}
 
-    if analytics_to_update:
-        UserAnalytics.objects.bulk_update(analytics_to_update, ['most_liked_post'])
\ No newline at end of file
+
+@shared_task(acks_late=True, soft_time_limit=50, time_limit=60)
+@single_flight(lease=30)
+def flush_activity_heartbeats():
+    '''
+    Copies the last request time of every user seen since the previous run
+    into User.last_activity. See accounts/heartbeat.py.
+    '''
+    return {'updated': flush_heartbeats()}
+
+
+@shared_task(acks_late=True, soft_time_limit=540, time_limit=600)
+@single_flight(lease=60)
+def rebuild_missing_availability_filters():
+    '''
+    Rebuilds username/email availability filters that were never built or
+    were invalidated after a failed write. See accounts/availability.py.
+    '''
+    return rebuild_missing_filters()
@@ -1,3 +1,387 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from smtplib import SMTPServerDisconnected
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.mail.message import make_msgid
+from django.db import connection
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, override_settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.exceptions import ValidationError
+
+from accounts.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, best_effort
+from accounts.locks import LOCK_KEY, LeaseLock, LockLost, fenced_write, lock_contention, single_flight
+from accounts import purge
+from accounts.availability import might_be_taken, rebuild_availability_filters, rebuild_missing_filters
+from accounts.mailer import OUTBOX_KEY, PROCESSING_KEY, PROCESSING_RUNS_KEY, RETRY_KEY, dispatch_outbox, pool
+from accounts.models import User, UserSession
+from accounts.partitions import add_months, ensure_partitions, maintain_partitions, month_start, partition_name
+from accounts.serializers import RegisterSerializer
+from accounts.tiered_cache import TieredCache
+
+FAKE_REDIS_SERVER = fakeredis.FakeServer()
+
+# Redis replaced by an in-process fake. The breaker pool is left out: its
+# guarded connection class cannot be mixed into fakeredis' connection.
+FAKE_REDIS_CACHES = {
+    'default': {
+        **settings.CACHES['default'],
+        'LOCATION': 'redis://fakeredis:6379/0',
+        'OPTIONS': {
+            **settings.CACHES['default']['OPTIONS'],
+            'CONNECTION_POOL_CLASS': 'redis.ConnectionPool',
+            'CONNECTION_POOL_KWARGS': {
+                'connection_class': fakeredis.FakeConnection,
+                'server': FAKE_REDIS_SERVER,
+            },
+        },
+    },
+}
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class RedisTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis = get_redis_connection('default')
+        self.redis.flushall()
+
+
+class LeaseLockTests(RedisTestCase):
+    def test_contended_lock_is_refused_and_counted(self):
+        held = LeaseLock('tests.lock')
+        self.assertTrue(held.acquire(heartbeat=False))
+
+        self.assertFalse(LeaseLock('tests.lock').acquire(heartbeat=False))
+        self.assertEqual(lock_contention('tests.lock'), 1)
+
+        held.release()
+        self.assertTrue(LeaseLock('tests.lock').acquire(heartbeat=False))
+
+    def test_single_flight_skips_overlapping_runs(self):
+        @single_flight(name='tests.lock')
+        def task():
+            return task_again()
+
+        @single_flight(name='tests.lock')
+        def task_again():
+            return 'ran'
+
+        self.assertEqual(task(), {'skipped': 'locked'})
+        self.assertIsNone(self.redis.get(LOCK_KEY.format(name='tests.lock')))
+
+    def test_heartbeat_notices_lost_lease(self):
+        lock = LeaseLock('tests.lock', lease=0.3)
+        self.assertTrue(lock.acquire())
+        try:
+            # The lease expired, or another run took the lock over
+            self.redis.delete(lock.key)
+            self.assertTrue(lock.lost.wait(2))
+            with self.assertRaises(LockLost):
+                lock.check()
+        finally:
+            lock.release()
+
+    def test_superseded_holder_cannot_write(self):
+        @single_flight(name='tests.lock')
+        def stale_run():
+            # This run's lease ran out and a newer run wrote the key
+            self.redis.delete(LOCK_KEY.format(name='tests.lock'))
+            newer_run()
+            fenced_write('tests:key', 'stale', 60)
+
+        @single_flight(name='tests.lock')
+        def newer_run():
+            fenced_write('tests:key', 'newer', 60)
+
+        with self.assertRaises(LockLost):
+            stale_run()
+        self.assertEqual(self.redis.get('tests:key'), b'newer')
+
+
+class TieredCacheTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tiered = TieredCache('tests', l1_ttl=60, l2_ttl=60)
+
+    def test_fill_racing_an_invalidation_is_not_cached(self):
+        def loader():
+            # The value changes, and is invalidated, while it is being read
+            self.tiered.invalidate('key')
+            return 'before'
+
+        self.assertEqual(self.tiered.get('key', loader), 'before')
+        self.assertIsNone(cache.get(self.tiered.cache_key('key')))
+
+        self.assertEqual(self.tiered.get('key', lambda: 'after'), 'after')
+        self.assertEqual(cache.get(self.tiered.cache_key('key')), 'after')
+
+    def test_invalidate_clears_both_tiers(self):
+        self.assertEqual(self.tiered.get('key', lambda: 'before'), 'before')
+        self.tiered.invalidate('key')
+        self.assertEqual(self.tiered.get('key', lambda: 'after'), 'after')
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('tests', failure_threshold=2, cooldown=10)
+
+    def open_breaker(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def end_cooldown(self):
+        self.breaker.opened_at -= self.breaker.cooldown
+
+    def call_from_another_thread(self):
+        errors = []
+
+        def call():
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=call)
+        thread.start()
+        thread.join()
+        return errors
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_half_open_lets_one_probe_through(self):
+        self.open_breaker()
+        self.end_cooldown()
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(len(self.call_from_another_thread()), 1)
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.call_from_another_thread(), [])
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.end_cooldown()
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_best_effort_swallows_redis_errors(self):
+        @best_effort
+        def mark_dirty():
+            raise CircuitOpenError('redis circuit breaker is open')
+
+        self.assertIsNone(mark_dirty())
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(
+        email=f'{username}@example.com', password='x', username=username, name=username.title(), **fields,
+    )
+
+
+def outbox_message(subject):
+    return {
+        'subject': subject, 'to': ['user@example.com'], 'text': subject, 'html': f'<p>{subject}</p>',
+        'attempts': 0, 'message_id': make_msgid(),
+    }
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        pool.close()
+        self.messages = [outbox_message(f'Email {index}') for index in range(3)]
+        self.redis.rpush(OUTBOX_KEY, *[json.dumps(message) for message in self.messages])
+
+    def sent_message_ids(self):
+        return [email.extra_headers['Message-ID'] for email in mail.outbox]
+
+    def test_sends_every_message_once(self):
+        stats = dispatch_outbox(batch_size=2)
+
+        self.assertEqual(stats, {'sent': 3, 'retried': 0, 'failed': 0, 'uncertain': 0, 'pending': 0})
+        self.assertEqual(self.sent_message_ids(), [message['message_id'] for message in self.messages])
+
+    def test_disconnect_retries_the_message_in_flight_only(self):
+        def disconnect_on_second(backend, emails):
+            for index, email in enumerate(emails):
+                email.message()
+                if index == 1:
+                    raise SMTPServerDisconnected('Connection unexpectedly closed')
+                mail.outbox.append(email)
+            return len(emails)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', disconnect_on_second):
+            stats = dispatch_outbox(batch_size=3, max_batches=1)
+
+        self.assertEqual(stats, {'sent': 1, 'retried': 1, 'failed': 0, 'uncertain': 1, 'pending': 1})
+        (retry,) = [json.loads(raw) for raw in self.redis.zrange(RETRY_KEY, 0, -1)]
+        self.assertTrue(retry['possibly_sent'])
+        self.assertEqual(retry['message_id'], self.messages[1]['message_id'])
+
+        # Once the retry is due, the rest go out and nothing is sent twice
+        self.redis.zadd(RETRY_KEY, {self.redis.zrange(RETRY_KEY, 0, -1)[0]: 0})
+        stats = dispatch_outbox(batch_size=3)
+
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(sorted(self.sent_message_ids()), sorted(message['message_id'] for message in self.messages))
+
+    def test_expired_run_is_recovered_and_live_run_left_alone(self):
+        dead, live = outbox_message('Dead run'), outbox_message('Live run')
+        self.redis.rpush(PROCESSING_KEY.format(run='dead'), json.dumps(dead))
+        self.redis.rpush(PROCESSING_KEY.format(run='live'), json.dumps(live))
+        self.redis.zadd(PROCESSING_RUNS_KEY, {'dead': time.time() - 1, 'live': time.time() + 60})
+
+        stats = dispatch_outbox()
+
+        self.assertEqual(stats['sent'], 4)
+        self.assertIn(dead['message_id'], self.sent_message_ids())
+        self.assertNotIn(live['message_id'], self.sent_message_ids())
+        self.assertEqual(self.redis.llen(PROCESSING_KEY.format(run='dead')), 0)
+        self.assertEqual(self.redis.zrange(PROCESSING_RUNS_KEY, 0, -1), [b'live'])
+
+
+class PurgeTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.keeper = create_user('keeper')
+        self.doomed = [create_user('doomed1'), create_user('doomed2')]
+        User.objects.filter(pk__in=[user.pk for user in self.doomed]).update(
+            is_deactivated=True, deactivated_at=timezone.now() - timedelta(days=60),
+        )
+        for user in self.doomed + [self.keeper]:
+            UserSession.objects.create(user=user, ip_address='10.0.0.1', user_agent='tests')
+        self.cutoff = timezone.now() - timedelta(days=30)
+        self.plan = purge.build_purge_plan()
+
+    def checkpoint(self):
+        raw = self.redis.get(purge.PURGE_CHECKPOINT_KEY)
+        return json.loads(raw) if raw else None
+
+    def test_interrupted_purge_resumes_from_its_checkpoint(self):
+        run_step = purge._run_step
+        steps = []
+
+        def crash_on_third_step(step, *args):
+            if len(steps) == 2:
+                raise RuntimeError('worker lost')
+            steps.append(step)
+            run_step(step, *args)
+
+        with mock.patch('accounts.purge._run_step', side_effect=crash_on_third_step):
+            with self.assertRaises(RuntimeError):
+                purge.purge_deactivated_accounts(self.cutoff)
+        self.assertEqual(self.checkpoint(), {'user_ids': [user.pk for user in self.doomed], 'step': 2})
+
+        resumed = []
+
+        def record_step(step, *args):
+            resumed.append(step)
+            run_step(step, *args)
+
+        with mock.patch('accounts.purge._run_step', side_effect=record_step):
+            result = purge.purge_deactivated_accounts(self.cutoff)
+
+        self.assertEqual(resumed, self.plan[2:])
+        self.assertEqual(result['users_purged'], 2)
+        self.assertEqual(list(User.objects.values_list('pk', flat=True)), [self.keeper.pk])
+        self.assertEqual(list(UserSession.objects.values_list('user_id', flat=True)), [self.keeper.pk])
+        self.assertIsNone(self.checkpoint())
+
+
+class AvailabilityFilterTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('taken')
+        rebuild_availability_filters()
+
+    def test_filter_knows_existing_and_new_values(self):
+        self.assertTrue(might_be_taken('username', 'Taken'))
+        self.assertTrue(might_be_taken('email', 'taken@example.com'))
+        self.assertFalse(might_be_taken('username', 'free'))
+
+        create_user('newcomer')
+        self.assertTrue(might_be_taken('username', 'newcomer'))
+
+    def test_failed_add_never_reports_a_taken_value_free(self):
+        with mock.patch('accounts.availability._run', side_effect=RedisError):
+            create_user('unlisted')
+
+        # The filters were taken out of use rather than left missing the value
+        self.assertTrue(might_be_taken('username', 'unlisted'))
+        self.assertTrue(might_be_taken('username', 'free'))
+
+        rebuild_missing_filters()
+        self.assertTrue(might_be_taken('username', 'unlisted'))
+        self.assertFalse(might_be_taken('username', 'free'))
+
+    def test_signup_missed_by_filter_fails_on_the_constraint(self):
+        serializer = RegisterSerializer(data={
+            'name': 'Someone', 'username': 'TAKEN', 'email': 'someone@example.com',
+            'password1': 'Correct-Horse-42', 'password2': 'Correct-Horse-42',
+        })
+        with mock.patch('accounts.serializers.might_be_taken', return_value=False):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with self.assertRaises(ValidationError) as raised:
+                serializer.save()
+
+        self.assertIn('username', raised.exception.detail)
+        self.assertEqual(User.objects.filter(username='taken').count(), 1)
+        self.assertTrue(might_be_taken('username', 'taken'))
+
+
+class PartitionRetentionTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('member')
+        self.today = timezone.now().date()
+        # Both months are past the 12 months sessions are kept
+        self.active_month = add_months(month_start(self.today), -14)
+        self.idle_month = add_months(month_start(self.today), -13)
+        ensure_partitions(UserSession, self.active_month, self.idle_month)
+
+    def create_session(self, created_month, last_active):
+        session = UserSession.objects.create(user=self.user, ip_address='10.0.0.1', user_agent='tests')
+        created_at = datetime(created_month.year, created_month.month, 2, tzinfo=dt_timezone.utc)
+        UserSession.objects.filter(pk=session.pk).update(created_at=created_at, last_active=last_active)
+        return session
+
+    def test_expired_session_partitions_are_kept_while_in_use(self):
+        active = self.create_session(self.active_month, timezone.now())
+        idle = self.create_session(self.idle_month, timezone.now() - timedelta(days=400))
+        with connection.cursor() as cursor:
+            # Dropping a partition with foreign key checks still queued fails
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+        result = maintain_partitions(self.today)
+
+        table = UserSession._meta.db_table
+        self.assertIn(partition_name(table, self.active_month), result['kept'])
+        self.assertIn(partition_name(table, self.idle_month), result['dropped'])
+        self.assertTrue(UserSession.objects.filter(pk=active.pk).exists())
+        self.assertFalse(UserSession.objects.filter(pk=idle.pk).exists())
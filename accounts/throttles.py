@@ -1,36 +1,68 @@
 from rest_framework.throttling import ScopedRateThrottle
 
-class LoginThrottle(ScopedRateThrottle):
+from accounts.ratelimit import rate_limit
+
+
+class RedisScopedRateThrottle(ScopedRateThrottle):
+    '''
+    Scoped throttle backed by the atomic GCRA limiter in accounts/ratelimit.py:
+    one script call per check instead of reading and rewriting a cached list
+    of request timestamps. The scope comes from the view's `throttle_scope`
+    or, failing that, from the subclass.
+    '''
+    retry_after = None
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None) or self.scope
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+
+        allowed, _, self.retry_after, _ = rate_limit(self.scope, ident, self.num_requests, self.duration)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class LoginThrottle(RedisScopedRateThrottle):
     scope = 'login'
 
 
-class RegisterThrottle(ScopedRateThrottle):
+class RegisterThrottle(RedisScopedRateThrottle):
     scope = 'register'
 
 
-class EmailVerificationThrottle(ScopedRateThrottle):
+class EmailVerificationThrottle(RedisScopedRateThrottle):
     scope = 'verify_email'
 
 
-class ResendEmailVerificationThrottle(ScopedRateThrottle):
+class ResendEmailVerificationThrottle(RedisScopedRateThrottle):
     scope = 'resend_verification'
 
 
-class PasswordResetThrottle(ScopedRateThrottle):
+class PasswordResetThrottle(RedisScopedRateThrottle):
     scope = 'password_reset'
 
 
-class ChangePasswordThrottle(ScopedRateThrottle):
+class ChangePasswordThrottle(RedisScopedRateThrottle):
     scope = 'change_password'
 
 
-class AccountUpdateThrottle(ScopedRateThrottle):
+class AccountUpdateThrottle(RedisScopedRateThrottle):
     scope = 'account_update'
 
 
-class GoogleLoginThrottle(ScopedRateThrottle):
+class GoogleLoginThrottle(RedisScopedRateThrottle):
     scope = 'google_login'
 
 
-class AccountDeactivationThrottle(ScopedRateThrottle):
+class AccountDeactivationThrottle(RedisScopedRateThrottle):
     scope = 'account_deactivate'
\ No newline at end of file
@@ -0,0 +1,291 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from accounts.breaker import CircuitOpenError, redis_breaker
+
+logger = logging.getLogger(__name__)
+
+# Every invalidation is published here as '<namespace>:<key>'
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+# Hit/miss counters per namespace, summed over all processes
+STATS_KEY = 'cache:stats:{namespace}'
+STATS_FLUSH_INTERVAL = 10
+
+# Bumped by every set() and invalidate() of a key. A loaded value is only
+# written to L2 if the generation is the one read before loading, so a load
+# that raced an invalidation cannot cache what it read before the change.
+GENERATION_KEY = 'cache:gen:{namespace}:{key}'
+GENERATION_TTL = 60 * 60  # far longer than any loader runs
+
+# KEYS: cache key, generation key. ARGV: generation ('' for none), value, ttl.
+SET_IF_GENERATION_SCRIPT = '''
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+'''
+
+_MISSING = object()
+
+# namespace -> TieredCache, for the stats view and the invalidation listener
+namespaces = {}
+
+
+class _InvalidationListener:
+    '''
+    One pub/sub subscriber thread per process. L1 entries are only trusted
+    while it is connected: until then, and after any disconnect (when
+    messages may have been missed), reads skip L1 and it is cleared.
+    The exception is a Redis outage (breaker not closed), when L1 is all
+    there is and its TTL bounds the staleness.
+    '''
+    def __init__(self):
+        self.pid = None
+        self.thread = None
+        self.connected = threading.Event()
+
+    def ensure_running(self):
+        # Started lazily, and again in each forked worker
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        self.pid = os.getpid()
+        self.connected.clear()
+        self.thread = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+        self.thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for tiered in list(namespaces.values()):
+                    tiered.clear_local()
+                self.connected.set()
+
+                while True:
+                    # Polled rather than listen(), which would hit the socket
+                    # timeout on an idle channel
+                    message = pubsub.get_message(timeout=1)
+                    if message is None:
+                        continue
+                    namespace, _, key = message['data'].decode().partition(':')
+                    tiered = namespaces.get(namespace)
+                    if tiered is not None:
+                        tiered.drop_local(key)
+            except CircuitOpenError:
+                pass
+            except Exception:
+                logger.warning('Cache invalidation listener disconnected', exc_info=True)
+            self.connected.clear()
+            time.sleep(1)
+
+    def trust_local(self):
+        return self.connected.is_set() or not redis_breaker.is_closed
+
+
+listener = _InvalidationListener()
+
+
+class TieredCache:
+    '''
+    A namespace of small, hot values read through a bounded in-process LRU
+    (L1) and the shared Redis cache (L2), falling back to a loader.
+    invalidate() clears both tiers everywhere, L1s included, via pub/sub.
+
+        users = TieredCache('user', l1_ttl=5, l2_ttl=60)
+        user = users.get(user_id, lambda: User.objects.filter(pk=user_id).first())
+
+    Loaders returning None are not cached. With copy_values, each read gets
+    its own shallow copy so callers can mutate it.
+    '''
+    def __init__(self, namespace, l1_ttl=5, l2_ttl=60, l1_max_size=1024, copy_values=False):
+        self.namespace = namespace
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.l1_max_size = l1_max_size
+        self.copy_values = copy_values
+
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        # Counts L1 drops, so a read started before one does not refill L1
+        self._epoch = 0
+        self._counts = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+        self._flushed_at = time.monotonic()
+
+        namespaces[namespace] = self
+
+    def cache_key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def generation_key(self, key):
+        return GENERATION_KEY.format(namespace=self.namespace, key=key)
+
+    def _out(self, value):
+        return copy.copy(value) if self.copy_values else value
+
+    def get(self, key, loader=None):
+        listener.ensure_running()
+        key = str(key)
+        now = time.monotonic()
+        epoch = self._epoch
+
+        if listener.trust_local():
+            with self._lock:
+                entry = self._local.get(key)
+                if entry and entry[0] > now:
+                    self._local.move_to_end(key)
+                else:
+                    entry = None
+            if entry:
+                self._count('l1_hits')
+                return self._out(entry[1])
+
+        value = cache.get(self.cache_key(key), _MISSING)
+        if value is not _MISSING:
+            self._count('l2_hits')
+        else:
+            self._count('misses')
+            if loader is None:
+                return None
+            generation = self._generation(key)
+            value = loader()
+            if value is None:
+                return None
+            if not self._store_if_current(key, value, generation):
+                # Invalidated while loading; this value may predate the change
+                return self._out(value)
+
+        self._store_local(key, value, now, epoch)
+        return self._out(value)
+
+    def _generation(self, key):
+        try:
+            return (get_redis_connection('default').get(self.generation_key(key)) or b'').decode()
+        except RedisError:
+            return None
+
+    def _store_if_current(self, key, value, generation):
+        if generation is None:
+            # Redis is unavailable: nothing to store in L2, L1 is all there is
+            return True
+        try:
+            return bool(get_redis_connection('default').eval(
+                SET_IF_GENERATION_SCRIPT, 2,
+                cache.client.make_key(self.cache_key(key)), self.generation_key(key),
+                generation, cache.client.encode(value), self.l2_ttl,
+            ))
+        except RedisError:
+            logger.warning('Could not cache %s %s', self.namespace, key, exc_info=True)
+            return True
+
+    def _bump_generations(self, pipe, keys):
+        for key in keys:
+            pipe.incr(self.generation_key(key))
+            pipe.expire(self.generation_key(key), GENERATION_TTL)
+
+    def set(self, key, value):
+        key = str(key)
+        try:
+            pipe = get_redis_connection('default').pipeline(transaction=False)
+            self._bump_generations(pipe, [key])
+            pipe.set(cache.client.make_key(self.cache_key(key)), cache.client.encode(value), ex=self.l2_ttl)
+            pipe.execute()
+        except RedisError:
+            logger.warning('Could not cache %s %s', self.namespace, key, exc_info=True)
+        self._publish([key])
+        self._store_local(key, value, time.monotonic())
+
+    def invalidate(self, *keys):
+        keys = [str(key) for key in keys]
+        if not keys:
+            return
+        for key in keys:
+            self.drop_local(key)
+        try:
+            # Bumped before the delete, so no load in flight can write back an old value
+            pipe = get_redis_connection('default').pipeline(transaction=False)
+            self._bump_generations(pipe, keys)
+            pipe.delete(*[cache.client.make_key(self.cache_key(key)) for key in keys])
+            pipe.execute()
+        except RedisError:
+            logger.warning('Could not invalidate %s %s in Redis', self.namespace, keys, exc_info=True)
+        self._publish(keys)
+
+    def _publish(self, keys):
+        try:
+            redis = get_redis_connection('default')
+            pipe = redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.publish(INVALIDATION_CHANNEL, self.cache_key(key))
+            pipe.execute()
+        except RedisError:
+            # Other processes serve their L1 copies until the L1 TTL runs out
+            logger.warning('Could not publish invalidation of %s %s', self.namespace, keys, exc_info=True)
+
+    def _store_local(self, key, value, now, epoch=None):
+        if not listener.trust_local():
+            return
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            self._local[key] = (now + self.l1_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.l1_max_size:
+                self._local.popitem(last=False)
+
+    def drop_local(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+            self._epoch += 1
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+            self._epoch += 1
+
+    def _count(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+            if time.monotonic() - self._flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            counts, self._counts = self._counts, dict.fromkeys(self._counts, 0)
+            self._flushed_at = time.monotonic()
+
+        try:
+            redis = get_redis_connection('default')
+            pipe = redis.pipeline(transaction=False)
+            for field, count in counts.items():
+                if count:
+                    pipe.hincrby(STATS_KEY.format(namespace=self.namespace), field, count)
+            pipe.execute()
+        except Exception:
+            logger.warning('Could not record cache stats for %s', self.namespace, exc_info=True)
+
+
+def cache_stats():
+    '''
+    Returns {namespace: {'l1_hits', 'l2_hits', 'misses', 'hit_ratio'}} summed
+    across processes (up to STATS_FLUSH_INTERVAL behind).
+    '''
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline(transaction=False)
+    for namespace in namespaces:
+        pipe.hgetall(STATS_KEY.format(namespace=namespace))
+
+    stats = {}
+    for namespace, raw in zip(namespaces, pipe.execute()):
+        counts = {field: int(raw.get(field.encode(), 0)) for field in ('l1_hits', 'l2_hits', 'misses')}
+        total = sum(counts.values())
+        counts['hit_ratio'] = round((counts['l1_hits'] + counts['l2_hits']) / total, 4) if total else None
+        stats[namespace] = counts
+    return stats
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from accounts.views import RegisterView, LoginView, LogoutView, VerifyEmailView, ResendEmailVerificationView, PasswordResetRequestView, PasswordResetConfirmView, ChangePasswordView, UserAccountView, UserProfileView, GoogleLoginView, DeactivateAccountView, AdminDashboardView, AdminUserListView, AdminProfileListView, AdminSessionListView, AdminIPActivityView, AdminBlacklistView
+from accounts.views import RegisterView, LoginView, LogoutView, VerifyEmailView, ResendEmailVerificationView, PasswordResetRequestView, PasswordResetConfirmView, ChangePasswordView, UserAccountView, UserProfileView, GoogleLoginView, DeactivateAccountView, AdminDashboardView, AdminActivityMetricsView, AdminCacheStatsView, AdminUserListView, AdminProfileListView, AdminSessionListView, AdminIPActivityView, AdminBlacklistView, AdminRegistryExportView
 
 urlpatterns = [
     # -------------------------
@@ -43,9 +43,12 @@ urlpatterns = [
     # Super admin dashboard & analytics
     # -------------------------
     path('super-admin-dashboard/', AdminDashboardView.as_view(), name='admin-dashboard'),
+    path('activity-metrics/', AdminActivityMetricsView.as_view(), name='admin-activity-metrics'),
+    path('cache-stats/', AdminCacheStatsView.as_view(), name='admin-cache-stats'),
     path('users/', AdminUserListView.as_view(), name='admin-users'),
     path('users/<str:username>/profile/', AdminProfileListView.as_view(), name='admin-profiles'),
     path('sessions/', AdminSessionListView.as_view(), name='admin-sessions'),
     path('ip-activity/', AdminIPActivityView.as_view(), name='admin-ip-activity'),
     path('blacklist/', AdminBlacklistView.as_view(), name='admin-blacklist'),
+    path('export/<str:registry>/', AdminRegistryExportView.as_view(), name='admin-registry-export'),
 ]
\ No newline at end of file
@@ -1,28 +1,51 @@
-from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+import math
+
 from rest_framework.permissions import BasePermission
 
+from django.urls import resolve, Resolver404
 from django.utils import timezone
 from datetime import timedelta
-from django_redis import get_redis_connection
 
+from accounts.revocation import revoke_all_user_tokens
+from accounts.ratelimit import rate_limit
+
+
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+# IPActivity endpoint for requests that match no URL pattern
+UNMATCHED_ENDPOINT = '<unmatched>'
 
-def check_resend_limit(user_id):
-    RESEND_LIMIT = 5
-    RESEND_TTL = 60 * 60
 
-    redis = get_redis_connection('default')
-    key = f'resend_verification:{user_id}'
+def route_template(resolver_match):
+    '''
+    Returns the URL pattern a request matched, e.g.
+    '/api/account/auth/verify-email/<uidb64>/<token>/', so activity is
+    grouped per route instead of per concrete (token-bearing) path.
+    '''
+    if resolver_match.route:
+        return f'/{resolver_match.route}'
+    return resolver_match.view_name or UNMATCHED_ENDPOINT
+
+
+def endpoint_for_path(path):
+    try:
+        return route_template(resolve(path))
+    except Resolver404:
+        return UNMATCHED_ENDPOINT
 
-    current_count = redis.get(key)
 
-    if current_count and int(current_count) >= RESEND_LIMIT:
-        ttl = redis.ttl(key)
-        return False, ttl
+def check_resend_limit(user_id):
+    RESEND_LIMIT = 5
+    RESEND_TTL = 60 * 60
 
-    pipe = redis.pipeline()
-    pipe.incr(key, 1)
-    pipe.expire(key, RESEND_TTL)
-    pipe.execute()
+    allowed, _, retry_after, _ = rate_limit('resend_verification_email', user_id, RESEND_LIMIT, RESEND_TTL)
+    if not allowed:
+        return False, math.ceil(retry_after)
 
     return True, None
 
@@ -32,10 +55,7 @@ def blacklist_all_user_tokens(user):
     Invalidates all refresh tokens for a user.
     Access tokens will naturally expire.
     '''
-    tokens = OutstandingToken.objects.filter(user=user)
-
-    for token in tokens:
-        BlacklistedToken.objects.get_or_create(token=token)
+    revoke_all_user_tokens(user.pk)
 
 
 ACCOUNT_UPDATE_COOLDOWN_DAYS = 90
@@ -1,9 +1,10 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, StreamingHttpResponse
 from django.contrib import messages
-from django.utils.timezone import now, timedelta
+from django.utils.timezone import now
 from django.utils import timezone
-from django.db.models import Count, Q, Exists, OuterRef
-from django.db.models.functions import TruncDate
+from django.db import router
+from django.db.models import Count, Q
 from django_countries import countries
 
 from rest_framework import generics, status
@@ -13,9 +14,13 @@ from rest_framework.views import APIView
 
 from accounts.serializers import UserProfileSerializer, UserAccountSerializer, RegisterSerializer, LoginSerializer, LogoutSerializer, PasswordResetRequestSerializer, PasswordResetConfirmSerializer, ChangePasswordSerializer, EmailVerificationSerializer, ResendEmailVerificationSerializer, GoogleLoginSerializer, DeactivateAccountSerializer
 from accounts.throttles import AccountUpdateThrottle, RegisterThrottle, LoginThrottle, PasswordResetThrottle, ChangePasswordThrottle, EmailVerificationThrottle, ResendEmailVerificationThrottle, GoogleLoginThrottle, AccountDeactivationThrottle
-from accounts.models import User, UserProfile, UserSession, IPActivity, BlacklistedIP
+from accounts.models import User, UserProfile, BlacklistedIP
 from accounts.utils import IsPlatformAdmin
-from accounts.country import COUNTRY_COORDS
+from accounts.dashboard import get_dashboard_snapshot
+from accounts.cardinality import ACTIVE_USERS_KEY, DEVICES_KEY, window_counts, daily_series
+from accounts.tiered_cache import cache_stats
+from Qela.db_router import use_replica
+from accounts.registries import REGISTRIES, filter_users, filter_sessions, filter_ip_activity, filter_blacklist, filter_query, keyset_page, export_rows
 
 
 class UserProfileView(generics.RetrieveUpdateAPIView):
@@ -32,7 +37,8 @@ class UserAccountView(generics.RetrieveUpdateAPIView):
     throttle_classes = [AccountUpdateThrottle]
 
     def get_object(self):
-        return self.request.user
+        # request.user only carries the cached auth fields; the form needs the whole row
+        return User.objects.get(pk=self.request.user.pk)
 
 
 class RegisterView(generics.CreateAPIView):
@@ -167,163 +173,84 @@ class DeactivateAccountView(generics.GenericAPIView):
 class AdminDashboardView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request):
-        total_users = User.objects.count()
-        now = timezone.now()
-        last_7_days = now - timedelta(days=7)
-        fourteen_days_ago = now - timedelta(days=14)
-
-        # Real per-day signup data
-        daily_signups = (
-            User.objects.filter(date_joined__gte=last_7_days)
-            .annotate(day=TruncDate('date_joined'))
-            .values('day')
-            .annotate(count=Count('id'))
-            .order_by('day')
-        )
-
-        # Convert queryset to list for JSON
-        signup_data = [
-            {'day': str(item['day']), 'count': item['count']}
-            for item in daily_signups
-        ]
-
-        country_stats = (
-            UserProfile.objects.values('country')
-            .annotate(total=Count('id'))
-            .order_by('-total')
-        )
-
-        formatted_countries = []
-
-        for item in country_stats:
-            country_code = item['country']
-            #if not country_code:
-                #continue
-
-            country_name = dict(countries).get(country_code, 'Unknown') if country_code else 'Unknown'
-
-            percent = round((item['total'] / total_users) * 100, 1) if total_users else 0
-
-            formatted_countries.append({
-                'code': country_code,
-                'name': country_name,
-                'percent': percent,
-                'coords': COUNTRY_COORDS.get(country_code, [0, 0])
-            })
-        top_countries = formatted_countries[:5]
-
-        new_users_this_week = User.objects.filter(date_joined__gte=last_7_days).count()
-        
-        new_users_prev_week = User.objects.filter(date_joined__gte=fourteen_days_ago, date_joined__lt=last_7_days).count()
-
-        if new_users_prev_week > 0:
-            growth_pct = round(((new_users_this_week - new_users_prev_week) / new_users_prev_week) * 100, 1)
-        elif new_users_this_week > 0:
-            growth_pct = 100.0
-        else:
-            growth_pct = 0
+        # Served from the snapshot refreshed every minute; ?refresh=1 rebuilds it now
+        snapshot = get_dashboard_snapshot(refresh=request.GET.get('refresh') == '1')
 
         context = {
-            # User metrics
-            'total_users': total_users,
-            'active_users': User.objects.filter(is_active=True, last_activity__gte=last_7_days).count(),
-            'verified_users': User.objects.filter(is_verified=True).count(),
-            'platform_admins': User.objects.filter(is_platform_admin=True).count(),
-            'deactivated_users': User.objects.filter(is_deactivated=True).count(),
-            'new_users_this_week': new_users_this_week,
-
-            # Session metrics
-            'total_sessions': UserSession.objects.count(),
-            'active_sessions': UserSession.objects.filter(is_active=True).count(),
-            'inactive_sessions': UserSession.objects.filter(is_active=False).count(),
-            'unique_devices': UserSession.objects.values('ip_address').distinct().count(),
-
-            # Security metrics
-            'suspicious_ips': IPActivity.objects.filter(is_suspicious=True).count(),
-            'blacklisted_ips': BlacklistedIP.objects.filter(is_active=True).count(),
-
-            'top_active_ips': (
-                IPActivity.objects
-                .values('ip_address')
-                .annotate(total=Count('id'))
-                .order_by('-total')[:10]
-            ),
-            
-            'top_active_users': (
-                IPActivity.objects
-                .exclude(user__isnull=True)
-                .values('user__email')
-                .annotate(total_requests=Count('id'))
-                .order_by('-total_requests')[:10]
-            ),
-
-            'all_countries': formatted_countries,
-            'top_countries': top_countries,
-
-            'signup_data_last_7_days': signup_data,
-
-            'user_growth_percent': growth_pct,
-
+            **snapshot,
             'title': 'QELA | Admin Dashboard',
         }
 
         return render(request, 'admin-analytics/dashboard.html', context)
 
 
+class AdminActivityMetricsView(APIView):
+    '''
+    Active users (DAU/WAU/MAU) and unique devices, estimated from the
+    per-day HyperLogLogs with about 1% error.
+    '''
+    permission_classes = [IsAuthenticated, IsPlatformAdmin]
+
+    def get(self, request):
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 30)
+        except ValueError:
+            days = 30
+
+        users = daily_series(ACTIVE_USERS_KEY, days)
+        devices = daily_series(DEVICES_KEY, days)
+
+        return Response({
+            'active_users': window_counts(ACTIVE_USERS_KEY),
+            'unique_devices': window_counts(DEVICES_KEY),
+            'daily': [
+                {'day': day, 'active_users': user_count, 'unique_devices': device_count}
+                for (day, user_count), (_, device_count) in zip(users, devices)
+            ],
+        }, status=status.HTTP_200_OK)
+
+
+class AdminCacheStatsView(APIView):
+    '''
+    Hit ratios of the two-tier caches per namespace, summed over all processes.
+    '''
+    permission_classes = [IsAuthenticated, IsPlatformAdmin]
+
+    def get(self, request):
+        return Response(cache_stats(), status=status.HTTP_200_OK)
+
+
 class AdminUserListView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request):
-        # Handle Filtration
-        query = User.objects.select_related('profile').all().order_by('-date_joined')
-        
-        # Search functionality
-        search = request.GET.get('search')
-        if search:
-            query = query.filter(
-                Q(username__icontains=search) | 
-                Q(name__icontains=search) | 
-                Q(email__icontains=search)
-            )
-
-        # Status Filtration
-        status = request.GET.get('status')
-        if status == 'active':
-            query = query.filter(is_active=True, is_deactivated=False)
-        elif status == 'unverified':
-            query = query.filter(is_verified=False)
-        elif status == 'suspended':
-            # Account is disabled by admin but not deleted by user
-            query = query.filter(is_active=False, is_deactivated=False)
-        elif status == 'deactivated':
-            # User-initiated account closure
-            query = query.filter(is_deactivated=True)
-
-        # Role Filtration
-        role = request.GET.get('role')
-        if role == 'admin':
-            query = query.filter(is_platform_admin=True)
-        elif role == 'member':
-            query = query.filter(is_platform_admin=False)
+        # 1. Filtration, one keyset page at a time
+        users, next_cursor = keyset_page(filter_users(request.GET), request.GET.get('cursor'))
 
         # 2. Analytics Calculations
-        total_users = User.objects.count()
-        total_active = User.objects.filter(is_active=True, is_deactivated=False).count()
-        total_deactivated = User.objects.filter(is_deactivated=True).count()
-        total_inactive = User.objects.filter(is_active=False, is_deactivated=False).count()
-        total_verified = User.objects.filter(is_verified=True).count()
-        
+        stats = User.objects.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_active=True, is_deactivated=False)),
+            deactivated=Count('id', filter=Q(is_deactivated=True)),
+            inactive=Count('id', filter=Q(is_active=False, is_deactivated=False)),
+            verified=Count('id', filter=Q(is_verified=True)),
+        )
+        total_users = stats['total']
+
         top_country_query = (
             UserProfile.objects.values('country')
             .annotate(total=Count('id'))
             .order_by('-total')[:5]
         )
 
+        country_names = dict(countries)
         formatted_countries = []
         for item in top_country_query:
             country_code = item['country']
-            country_name = dict(countries).get(country_code, 'Unknown') if country_code else 'Unknown'
+            country_name = country_names.get(country_code, 'Unknown') if country_code else 'Unknown'
             percent = round((item['total'] / total_users) * 100, 1) if total_users else 0
 
             formatted_countries.append({
@@ -332,15 +259,12 @@ class AdminUserListView(APIView):
             })
 
         context = {
-            'users': query,
+            'users': users,
             'top_countries': formatted_countries,
-            'stats': {
-                'total': total_users,
-                'active': total_active,
-                'deactivated': total_deactivated,
-                'inactive': total_inactive,
-                'verified': total_verified,
-            },
+            'stats': stats,
+            'registry': 'users',
+            'next_cursor': next_cursor,
+            'filter_query': filter_query(request.GET),
             'title': 'QELA | Admin User Registry',
         }
         
@@ -368,9 +292,10 @@ class AdminUserListView(APIView):
 class AdminProfileListView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request, username):
         # Fetch user or 404
-        user_obj = get_object_or_404(User.objects.select_related('profile'), username__iexact=username)
+        user_obj = get_object_or_404(User.objects.filter_lower('username', username).select_related('profile'))
         
         # Calculate account age
         account_age = (timezone.now() - user_obj.date_joined).days
@@ -387,23 +312,15 @@ class AdminProfileListView(APIView):
 class AdminSessionListView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request):
-        sessions = UserSession.objects.select_related('user').all()
-        
-        status = request.GET.get('status')
-        if status == 'active':
-            sessions = sessions.filter(is_active=True)
-
-        search = request.GET.get('search')
-        if search:
-            sessions = sessions.filter(
-                Q(user__email__icontains=search) | 
-                Q(ip_address__icontains=search) |
-                Q(browser__icontains=search)
-            )
+        sessions, next_cursor = keyset_page(filter_sessions(request.GET), request.GET.get('cursor'))
 
         context = {
-            'sessions': sessions
+            'sessions': sessions,
+            'registry': 'sessions',
+            'next_cursor': next_cursor,
+            'filter_query': filter_query(request.GET),
         }
         return render(request, 'admin-analytics/sessions.html', context)
 
@@ -411,29 +328,15 @@ class AdminSessionListView(APIView):
 class AdminIPActivityView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request):
-        # A subquery that checks if the IP exists in the BlacklistedIP table
-        blacklisted_subquery = BlacklistedIP.objects.filter(
-            ip_address=OuterRef('ip_address'),
-            is_active=True
-        )
-
-        logs = IPActivity.objects.select_related('user').annotate(
-            is_currently_blacklisted=Exists(blacklisted_subquery)
-        ).order_by('-last_seen')
-        
-        # Filter Logic
-        filter_type = request.GET.get('filter')
-        if filter_type == 'suspicious':
-            logs = logs.filter(is_suspicious=True)
-
-        # Search Logic
-        search = request.GET.get('search')
-        if search:
-            logs = logs.filter(ip_address__icontains=search)
+        logs, next_cursor = keyset_page(filter_ip_activity(request.GET), request.GET.get('cursor'))
 
         context = {
-            'logs': logs
+            'logs': logs,
+            'registry': 'ip-activity',
+            'next_cursor': next_cursor,
+            'filter_query': filter_query(request.GET),
         }
         return render(request, 'admin-analytics/ip_activity.html', context)
 
@@ -441,10 +344,14 @@ class AdminIPActivityView(APIView):
 class AdminBlacklistView(APIView):
     permission_classes = [IsAuthenticated, IsPlatformAdmin]
 
+    @use_replica()
     def get(self, request):
-        ips = BlacklistedIP.objects.all()
+        ips, next_cursor = keyset_page(filter_blacklist(request.GET), request.GET.get('cursor'))
         context = {
-            'ips': ips
+            'ips': ips,
+            'registry': 'blacklist',
+            'next_cursor': next_cursor,
+            'filter_query': filter_query(request.GET),
         }
         return render(request, 'admin-analytics/blacklist.html', context)
 
@@ -463,3 +370,30 @@ class AdminBlacklistView(APIView):
         )
 
         return redirect('admin-blacklist')
+
+
+class AdminRegistryExportView(APIView):
+    '''
+    Streams a whole admin registry (with the page's filters) as CSV or NDJSON.
+    '''
+    permission_classes = [IsAuthenticated, IsPlatformAdmin]
+
+    @use_replica()
+    def get(self, request, registry):
+        if registry not in REGISTRIES:
+            raise Http404
+
+        export_format = 'ndjson' if request.GET.get('output') == 'ndjson' else 'csv'
+        build_queryset, fields = REGISTRIES[registry]
+
+        # The rows are read after this method returns, so the database is bound now
+        queryset = build_queryset(request.GET)
+        queryset = queryset.using(router.db_for_read(queryset.model))
+
+        response = StreamingHttpResponse(
+            export_rows(queryset, fields, export_format),
+            content_type='application/x-ndjson' if export_format == 'ndjson' else 'text/csv',
+        )
+        filename = f'{registry}-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Post, Comment, Like, Bookmark, Follow, Share, UserAnalytics, PostDailyMetrics
+from .models import (
+    Post, Comment, Like, Bookmark, Follow, Share, UserAnalytics, PostDailyMetrics, FollowerAffinity,
+    PostWeeklyMetrics, PostMonthlyMetrics, AuthorDailyMetrics, AuthorWeeklyMetrics, AuthorMonthlyMetrics,
+)
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -53,3 +56,19 @@ class UserAnalyticsAdmin(admin.ModelAdmin):
 class PostDailyMetricsAdmin(admin.ModelAdmin):
     list_display = ("post", "date", "likes", "comments", "shares")
     list_filter = ("date",)
+
+@admin.register(PostWeeklyMetrics, PostMonthlyMetrics)
+class PostRollupMetricsAdmin(admin.ModelAdmin):
+    list_display = ("post", "date", "likes", "comments", "shares")
+    list_filter = ("date",)
+
+@admin.register(AuthorDailyMetrics, AuthorWeeklyMetrics, AuthorMonthlyMetrics)
+class AuthorRollupMetricsAdmin(admin.ModelAdmin):
+    list_display = ("author", "date", "likes", "comments", "shares")
+    list_filter = ("date",)
+    search_fields = ("author__username",)
+
+@admin.register(FollowerAffinity)
+class FollowerAffinityAdmin(admin.ModelAdmin):
+    list_display = ("author", "follower", "likes", "comments", "shares", "score", "updated_at")
+    search_fields = ("author__username", "follower__username")
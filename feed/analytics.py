@@ -0,0 +1,274 @@
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from accounts.breaker import best_effort
+from feed.models import Post, Like, Follow, UserAnalytics, FollowerAffinity, AffinityFlush
+
+# Authors whose likes changed since the last most-liked-post recompute
+MOST_LIKED_DIRTY_KEY = 'analytics:dirty:most_liked_post'
+
+# Authors whose follower affinities changed since the last most-active-follower recompute
+MOST_ACTIVE_DIRTY_KEY = 'analytics:dirty:most_active_follower'
+
+# Members a run has claimed from a dirty set stay in '<set>:processing' until
+# their recompute commits, as the mail outbox does. Runs are single_flight,
+# so whatever a run finds there at start was left by one that died.
+DIRTY_PROCESSING_KEY = '{key}:processing'
+
+# KEYS: dirty set, processing set. ARGV: count. Moves up to count members.
+CLAIM_DIRTY_SCRIPT = '''
+local members = redis.call('SPOP', KEYS[1], ARGV[1])
+if #members > 0 then
+    redis.call('SADD', KEYS[2], unpack(members))
+end
+return members
+'''
+
+# Buffered affinity increments: field '<author>:<follower>:<kind>' -> delta
+AFFINITY_PENDING_KEY = 'analytics:affinity:pending'
+AFFINITY_FLUSHING_KEY = 'analytics:affinity:flushing'
+
+# Field of the flushing hash naming the snapshot; see AffinityFlush
+AFFINITY_SNAPSHOT_FIELD = 'snapshot'
+
+# Applied snapshot ids are kept this long, far beyond any retry of a flush
+AFFINITY_FLUSH_RETENTION = timedelta(days=7)
+
+AFFINITY_KINDS = ('likes', 'comments', 'shares')
+AFFINITY_WEIGHTS = getattr(settings, 'AFFINITY_WEIGHTS', {'likes': 1, 'comments': 2, 'shares': 3})
+
+# Rows upserted per statement when flushing affinities
+AFFINITY_FLUSH_BATCH_SIZE = 5000
+
+
+def _mark_dirty(key, *author_ids):
+    redis = get_redis_connection('default')
+    redis.sadd(key, *author_ids)
+
+
+def claim_dirty(key, count):
+    '''
+    Moves up to `count` members of dirty set `key` into its processing set
+    and returns them. Call ack_dirty() once they are recomputed.
+    '''
+    redis = get_redis_connection('default')
+    return redis.eval(CLAIM_DIRTY_SCRIPT, 2, key, DIRTY_PROCESSING_KEY.format(key=key), count)
+
+
+def ack_dirty(key, members):
+    if members:
+        redis = get_redis_connection('default')
+        redis.srem(DIRTY_PROCESSING_KEY.format(key=key), *members)
+
+
+def recover_dirty(key):
+    '''
+    Hands the members a dead run left in the processing set back to `key`.
+    '''
+    redis = get_redis_connection('default')
+    processing = DIRTY_PROCESSING_KEY.format(key=key)
+    pipe = redis.pipeline(transaction=True)
+    pipe.sunionstore(key, [key, processing])
+    pipe.delete(processing)
+    pipe.execute()
+
+
+@best_effort
+def mark_most_liked_dirty(*author_ids):
+    _mark_dirty(MOST_LIKED_DIRTY_KEY, *author_ids)
+
+
+def claim_most_liked_dirty(count):
+    return [int(author_id) for author_id in claim_dirty(MOST_LIKED_DIRTY_KEY, count)]
+
+
+def ack_most_liked_dirty(author_ids):
+    ack_dirty(MOST_LIKED_DIRTY_KEY, author_ids)
+
+
+@best_effort
+def mark_most_active_dirty(*author_ids):
+    _mark_dirty(MOST_ACTIVE_DIRTY_KEY, *author_ids)
+
+
+def claim_most_active_dirty(count):
+    return [int(author_id) for author_id in claim_dirty(MOST_ACTIVE_DIRTY_KEY, count)]
+
+
+def ack_most_active_dirty(author_ids):
+    ack_dirty(MOST_ACTIVE_DIRTY_KEY, author_ids)
+
+
+def recompute_most_liked_posts(author_ids):
+    '''
+    Sets UserAnalytics.most_liked_post for the given authors in one statement.
+    DISTINCT ON picks each author's post with the most likes (newest first on ties);
+    authors without posts are reset to NULL.
+    '''
+    if not author_ids:
+        return 0
+
+    sql = f'''
+        WITH authors AS (
+            SELECT DISTINCT unnest(%s::bigint[]) AS author_id
+        ),
+        top_posts AS (
+            SELECT DISTINCT ON (p.author_id) p.author_id, p.id AS post_id
+            FROM {Post._meta.db_table} p
+            LEFT JOIN {Like._meta.db_table} l ON l.post_id = p.id
+            WHERE p.author_id IN (SELECT author_id FROM authors)
+            GROUP BY p.id
+            ORDER BY p.author_id, COUNT(l.id) DESC, p.created_at DESC
+        )
+        UPDATE {UserAnalytics._meta.db_table} ua
+        SET most_liked_post_id = top_posts.post_id, updated_at = NOW()
+        FROM authors
+        LEFT JOIN top_posts ON top_posts.author_id = authors.author_id
+        WHERE ua.user_id = authors.author_id
+          AND ua.most_liked_post_id IS DISTINCT FROM top_posts.post_id
+    '''
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [list(author_ids)])
+        return cursor.rowcount
+
+
+@best_effort
+def record_affinity(author_id, follower_id, kind, delta=1):
+    '''
+    Buffers a change to how often `follower_id` engages with `author_id`'s posts.
+    Increments are coalesced in Redis and written by flush_affinity().
+    '''
+    if author_id == follower_id:
+        return
+
+    redis = get_redis_connection('default')
+    redis.hincrby(AFFINITY_PENDING_KEY, f'{author_id}:{follower_id}:{kind}', delta)
+
+
+def flush_affinity(batch_size=AFFINITY_FLUSH_BATCH_SIZE):
+    '''
+    Moves buffered affinity increments into FollowerAffinity with bulk upserts
+    and marks the affected authors dirty. Each snapshot is applied at most
+    once, however often the flush is retried. Returns the number of pairs written.
+    '''
+    redis = get_redis_connection('default')
+
+    # A snapshot left behind by a failed flush is written before taking a new one
+    if not redis.exists(AFFINITY_FLUSHING_KEY):
+        if not redis.exists(AFFINITY_PENDING_KEY):
+            return 0
+        try:
+            redis.rename(AFFINITY_PENDING_KEY, AFFINITY_FLUSHING_KEY)
+        except ResponseError:
+            return 0  # taken by a concurrent flush
+
+    # Kept if already set, so a retried snapshot keeps its id
+    redis.hsetnx(AFFINITY_FLUSHING_KEY, AFFINITY_SNAPSHOT_FIELD, uuid.uuid4().hex)
+
+    snapshot_id = None
+    deltas = defaultdict(lambda: dict.fromkeys(AFFINITY_KINDS, 0))
+    for field, value in redis.hgetall(AFFINITY_FLUSHING_KEY).items():
+        field = field.decode()
+        if field == AFFINITY_SNAPSHOT_FIELD:
+            snapshot_id = value.decode()
+            continue
+        author_id, follower_id, kind = field.split(':')
+        if kind in AFFINITY_KINDS:
+            deltas[(int(author_id), int(follower_id))][kind] += int(value)
+
+    pairs = [(pair, counts) for pair, counts in deltas.items() if any(counts.values())]
+
+    with transaction.atomic():
+        _, first_time = AffinityFlush.objects.get_or_create(snapshot_id=snapshot_id)
+        if first_time:
+            for start in range(0, len(pairs), batch_size):
+                _upsert_affinity(pairs[start:start + batch_size])
+        AffinityFlush.objects.filter(applied_at__lt=timezone.now() - AFFINITY_FLUSH_RETENTION).delete()
+
+    if pairs:
+        mark_most_active_dirty(*{author_id for (author_id, _), _ in pairs})
+    redis.delete(AFFINITY_FLUSHING_KEY)
+
+    return len(pairs) if first_time else 0
+
+
+def _upsert_affinity(pairs):
+    table = FollowerAffinity._meta.db_table
+    user_table = FollowerAffinity._meta.get_field('author').related_model._meta.db_table
+    w = AFFINITY_WEIGHTS
+
+    sql = f'''
+        INSERT INTO {table} (author_id, follower_id, likes, comments, shares, score, updated_at)
+        SELECT t.author_id, t.follower_id,
+               GREATEST(0, t.likes), GREATEST(0, t.comments), GREATEST(0, t.shares),
+               GREATEST(0, t.likes) * {w['likes']:d}
+                 + GREATEST(0, t.comments) * {w['comments']:d}
+                 + GREATEST(0, t.shares) * {w['shares']:d},
+               NOW()
+        FROM unnest(%s::bigint[], %s::bigint[], %s::int[], %s::int[], %s::int[])
+             AS t(author_id, follower_id, likes, comments, shares)
+        -- Skip users purged since the increment was buffered
+        JOIN {user_table} a ON a.id = t.author_id
+        JOIN {user_table} f ON f.id = t.follower_id
+        ON CONFLICT (author_id, follower_id) DO UPDATE SET
+            likes = GREATEST(0, {table}.likes + EXCLUDED.likes),
+            comments = GREATEST(0, {table}.comments + EXCLUDED.comments),
+            shares = GREATEST(0, {table}.shares + EXCLUDED.shares),
+            score = GREATEST(0, {table}.likes + EXCLUDED.likes) * {w['likes']:d}
+                  + GREATEST(0, {table}.comments + EXCLUDED.comments) * {w['comments']:d}
+                  + GREATEST(0, {table}.shares + EXCLUDED.shares) * {w['shares']:d},
+            updated_at = NOW()
+    '''
+
+    params = [
+        [author_id for (author_id, _), _ in pairs],
+        [follower_id for (_, follower_id), _ in pairs],
+        [counts['likes'] for _, counts in pairs],
+        [counts['comments'] for _, counts in pairs],
+        [counts['shares'] for _, counts in pairs],
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def recompute_most_active_followers(author_ids):
+    '''
+    Sets UserAnalytics.most_active_follower for the given authors from the
+    highest-scoring FollowerAffinity row of a current follower, read through
+    the (author, -score) index. Authors without one are reset to NULL.
+    '''
+    if not author_ids:
+        return 0
+
+    sql = f'''
+        WITH authors AS (
+            SELECT DISTINCT unnest(%s::bigint[]) AS author_id
+        ),
+        top_followers AS (
+            SELECT DISTINCT ON (fa.author_id) fa.author_id, fa.follower_id
+            FROM {FollowerAffinity._meta.db_table} fa
+            JOIN {Follow._meta.db_table} f
+              ON f.following_id = fa.author_id AND f.follower_id = fa.follower_id
+            WHERE fa.author_id IN (SELECT author_id FROM authors) AND fa.score > 0
+            ORDER BY fa.author_id, fa.score DESC, fa.updated_at DESC
+        )
+        UPDATE {UserAnalytics._meta.db_table} ua
+        SET most_active_follower_id = top_followers.follower_id, updated_at = NOW()
+        FROM authors
+        LEFT JOIN top_followers ON top_followers.author_id = authors.author_id
+        WHERE ua.user_id = authors.author_id
+          AND ua.most_active_follower_id IS DISTINCT FROM top_followers.follower_id
+    '''
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [list(author_ids)])
+        return cursor.rowcount
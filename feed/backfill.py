@@ -0,0 +1,161 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from feed.models import Like, Comment, Share, PostDailyMetrics
+from feed.rollups import rebuild_rollups
+from accounts.partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+# Days rebuilt per partition; each partition is one unit of parallel work
+BACKFILL_PARTITION_DAYS = getattr(settings, 'BACKFILL_PARTITION_DAYS', 30)
+
+BACKFILL_WORKERS = getattr(settings, 'BACKFILL_WORKERS', 4)
+
+# Engagement model -> (metric column, column holding the post id)
+BACKFILL_SOURCES = (
+    (Like, 'likes', 'post_id'),
+    (Comment, 'comments', 'post_id'),
+    (Share, 'shares', 'original_post_id'),
+)
+
+
+def engagement_start_date():
+    '''
+    Returns the (UTC) day of the oldest like, comment or share, or None.
+    '''
+    oldest = [
+        model.objects.aggregate(oldest=Min('created_at'))['oldest']
+        for model, _, _ in BACKFILL_SOURCES
+    ]
+    oldest = [value for value in oldest if value is not None]
+    if not oldest:
+        return None
+    return min(oldest).astimezone(dt_timezone.utc).date()
+
+
+def date_partitions(start_date, end_date, partition_days=BACKFILL_PARTITION_DAYS):
+    '''
+    Splits [start_date, end_date] into half-open [from, to) day ranges.
+    '''
+    partitions = []
+    day = start_date
+    while day <= end_date:
+        upper = min(day + timedelta(days=partition_days), end_date + timedelta(days=1))
+        partitions.append((day, upper))
+        day = upper
+    return partitions
+
+
+def rebuild_daily_metrics(date_from, date_to):
+    '''
+    Rebuilds PostDailyMetrics for days in [date_from, date_to) from the
+    engagement timestamps: per-day counts are upserted and rows for days
+    without any remaining engagement are removed, so reruns converge on the
+    same result. Returns (rows_written, rows_removed).
+    '''
+    table = PostDailyMetrics._meta.db_table
+    columns = [column for _, column, _ in BACKFILL_SOURCES]
+
+    engagement = ' UNION ALL '.join(
+        f'''
+        SELECT {post_column} AS post_id,
+               date_trunc('day', created_at AT TIME ZONE 'UTC')::date AS day,
+               {', '.join('COUNT(*)' if c == column else '0' for c in columns)}
+        FROM {model._meta.db_table}
+        WHERE created_at >= %(start)s AND created_at < %(end)s
+        GROUP BY 1, 2
+        '''
+        for model, column, post_column in BACKFILL_SOURCES
+    )
+
+    totals = f'''
+        SELECT post_id, day, {', '.join(f'SUM({c})::int AS {c}' for c in columns)}
+        FROM ({engagement}) AS e(post_id, day, {', '.join(columns)})
+        GROUP BY post_id, day
+    '''
+
+    upsert_sql = f'''
+        INSERT INTO {table} (post_id, date, {', '.join(columns)})
+        SELECT post_id, day, {', '.join(columns)} FROM ({totals}) AS totals
+        ON CONFLICT (post_id, date) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in columns)}
+        WHERE ({', '.join(f'{table}.{c}' for c in columns)})
+              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in columns)})
+    '''
+
+    cleanup_sql = f'''
+        DELETE FROM {table} m
+        WHERE m.date >= %(date_from)s AND m.date < %(date_to)s
+          AND NOT EXISTS (
+              SELECT 1 FROM ({totals}) AS totals
+              WHERE totals.post_id = m.post_id AND totals.day = m.date
+          )
+    '''
+
+    params = {
+        'start': _utc_midnight(date_from),
+        'end': _utc_midnight(date_to),
+        'date_from': date_from,
+        'date_to': date_to,
+    }
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(upsert_sql, params)
+        written = cursor.rowcount
+        cursor.execute(cleanup_sql, params)
+        removed = cursor.rowcount
+
+    return written, removed
+
+
+def backfill_post_daily_metrics(start_date=None, end_date=None, workers=BACKFILL_WORKERS, partition_days=BACKFILL_PARTITION_DAYS):
+    '''
+    Rebuilds PostDailyMetrics between start_date and end_date (inclusive,
+    defaulting to the oldest engagement and today), running date partitions
+    across a pool of worker processes, then rebuilds the rollups over the range.
+    '''
+    started = time.monotonic()
+    start_date = start_date or engagement_start_date()
+    end_date = end_date or timezone.now().date()
+    result = {'partitions': 0, 'rows_written': 0, 'rows_removed': 0, 'rollup_rows_written': 0}
+
+    if start_date is None or start_date > end_date:
+        result['duration_seconds'] = round(time.monotonic() - started, 2)
+        return result
+
+    # Historical days may predate the oldest monthly table partition
+    ensure_partitions(PostDailyMetrics, start_date, end_date)
+    partitions = date_partitions(start_date, end_date, partition_days)
+
+    if workers <= 1 or len(partitions) <= 1:
+        outcomes = [rebuild_daily_metrics(date_from, date_to) for date_from, date_to in partitions]
+    else:
+        # Forked workers must not share the parent's database sockets
+        connections.close_all()
+        outcomes = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {pool.submit(rebuild_daily_metrics, date_from, date_to): (date_from, date_to) for date_from, date_to in partitions}
+            for future in as_completed(futures):
+                outcomes.append(future.result())
+                logger.debug('Rebuilt daily metrics %s to %s', *futures[future])
+
+    result['partitions'] = len(partitions)
+    result['rows_written'] = sum(written for written, _ in outcomes)
+    result['rows_removed'] = sum(removed for _, removed in outcomes)
+    result['rollup_rows_written'] = rebuild_rollups(start_date, end_date + timedelta(days=1))
+    result['duration_seconds'] = round(time.monotonic() - started, 2)
+    logger.info('PostDailyMetrics backfill %s to %s: %s', start_date, end_date, result)
+    return result
+
+
+def _utc_midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
@@ -0,0 +1,126 @@
+import math
+
+from graphql import parse, GraphQLError
+from graphql.language import OperationType, FieldNode, FragmentSpreadNode, InlineFragmentNode, VariableNode, IntValueNode, FragmentDefinitionNode, OperationDefinitionNode
+
+#-----------------------------
+# Operation cost (RATE LIMITING)
+#-----------------------------
+
+# Cost charged for each mutation field. Writes that fan out into analytics
+# and metrics updates are more expensive than simple toggles.
+MUTATION_COSTS = {
+    'createPost': 10,
+    'editPost': 5,
+    'deletePost': 10,
+    'addComment': 5,
+    'editComment': 3,
+    'deleteComment': 5,
+    'likePost': 2,
+    'unlikePost': 2,
+    'bookmarkPost': 1,
+    'unbookmarkPost': 1,
+    'followUser': 3,
+    'unfollowUser': 3,
+    'sharePost': 5,
+}
+DEFAULT_MUTATION_COST = 5
+
+# Paginated query fields and the page size used when `first` is omitted
+PAGINATED_QUERIES = {
+    'allPosts': 10,
+    'myFeed': 15,  # `first` followed posts plus 5 suggested posts
+}
+
+# Every PAGE_UNIT requested rows cost one extra point
+PAGE_UNIT = 10
+
+# List fields without pagination arguments
+UNBOUNDED_QUERIES = {
+    'myBookmarks': 5,
+    'postShares': 5,
+    'postMetrics': 3,
+    'authorMetrics': 3,
+}
+DEFAULT_QUERY_COST = 1
+
+
+def operation_cost(query, variables=None, operation_name=None):
+    '''
+    Computes the cost of a GraphQL request from its document:
+    - Mutations are charged per mutation field from MUTATION_COSTS
+    - Queries are charged by the page size they request
+    Unparseable documents cost the minimum; the view reports the syntax error.
+    '''
+    if not query:
+        return DEFAULT_QUERY_COST
+
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return DEFAULT_QUERY_COST
+
+    operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+    fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+
+    if operation_name:
+        operations = [op for op in operations if op.name and op.name.value == operation_name]
+    if len(operations) != 1:
+        return DEFAULT_QUERY_COST
+
+    operation = operations[0]
+    variables = variables or {}
+
+    cost = 0
+    for field in _root_fields(operation.selection_set, fragments):
+        if operation.operation == OperationType.MUTATION:
+            cost += MUTATION_COSTS.get(field.name.value, DEFAULT_MUTATION_COST)
+        else:
+            cost += _query_field_cost(field, variables)
+
+    return max(cost, DEFAULT_QUERY_COST)
+
+
+def _root_fields(selection_set, fragments, seen=None):
+    '''Flattens top-level fields, expanding fragments used at the root.'''
+    seen = seen or set()
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _root_fields(selection.selection_set, fragments, seen)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in fragments and name not in seen:
+                seen.add(name)
+                yield from _root_fields(fragments[name].selection_set, fragments, seen)
+
+
+def _query_field_cost(field, variables):
+    name = field.name.value
+
+    if name in PAGINATED_QUERIES:
+        page_size = _int_argument(field, 'first', variables)
+        if page_size is None:
+            page_size = PAGINATED_QUERIES[name]
+        return DEFAULT_QUERY_COST + math.ceil(max(page_size, 0) / PAGE_UNIT)
+
+    return UNBOUNDED_QUERIES.get(name, DEFAULT_QUERY_COST)
+
+
+def _int_argument(field, name, variables):
+    for argument in field.arguments or ():
+        if argument.name.value != name:
+            continue
+
+        value = argument.value
+        if isinstance(value, VariableNode):
+            value = variables.get(value.name.value)
+        elif isinstance(value, IntValueNode):
+            value = value.value
+
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return None
@@ -3,6 +3,8 @@ from graphql import GraphQLError
 from django.utils import timezone
 
 from feed.models import Post, Comment, Like, Bookmark, Follow, Share, UserAnalytics, PostDailyMetrics
+from feed.analytics import mark_most_liked_dirty, mark_most_active_dirty, record_affinity
+from feed.rollups import mark_metrics_dirty
 from .types import PostType, CommentType
 
 #-----------------------------
@@ -26,6 +28,9 @@ class CreatePost(graphene.Mutation):
         analytics.total_posts += 1
         analytics.save()
 
+        # A new post can become the most liked one while likes are tied
+        mark_most_liked_dirty(user.id)
+
         return CreatePost(post=post)
     
 
@@ -72,6 +77,7 @@ class DeletePost(graphene.Mutation):
         likes_count = post.likes.count()
         comments_count = post.comments.count()
         shares_count = post.shares.count()
+        metric_days = list(post.daily_metrics.values_list('date', flat=True))
 
         # Delete the post
         post.delete()
@@ -83,6 +89,10 @@ class DeletePost(graphene.Mutation):
         analytics.total_comments_recieved = max(0, analytics.total_comments_recieved - comments_count)
         analytics.total_shares_recieved = max(0, analytics.total_shares_recieved - shares_count)
         analytics.save()
+
+        mark_most_liked_dirty(user.id)
+        # The post's own rollups cascade; the author's need rebuilding
+        mark_metrics_dirty(user.id, post_id, *metric_days)
         
         return DeletePost(ok=True)
     
@@ -110,9 +120,12 @@ class AddComment(graphene.Mutation):
         analytics.total_comments_recieved += 1
         analytics.save()
 
+        record_affinity(post.author_id, user.id, 'comments')
+
         metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=timezone.now().date())
         metric.comments += 1
         metric.save()
+        mark_metrics_dirty(post.author_id, post.id, metric.date)
 
         return AddComment(comment=comment)
     
@@ -162,9 +175,12 @@ class DeleteComment(graphene.Mutation):
         analytics.total_comments_recieved = max(0, analytics.total_comments_recieved - 1)
         analytics.save()
 
-        metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=timezone.now().date())
+        record_affinity(post.author_id, user.id, 'comments', -1)
+
+        metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=comment.created_at.date())
         metric.comments = max(0, metric.comments - 1)
         metric.save()
+        mark_metrics_dirty(post.author_id, post.id, metric.date)
         
         return DeleteComment(ok=True)
 
@@ -196,6 +212,10 @@ class LikePost(graphene.Mutation):
             metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=timezone.now().date())
             metric.likes += 1
             metric.save()
+            mark_metrics_dirty(post.author_id, post.id, metric.date)
+
+            mark_most_liked_dirty(creator.id)
+            record_affinity(creator.id, user.id, 'likes')
 
         return LikePost(ok=True)
     
@@ -211,7 +231,8 @@ class UnlikePost(graphene.Mutation):
         if not user.is_authenticated:
             raise GraphQLError('Authentication required')
 
-        deleted, _ = Like.objects.filter(user=user, post_id=post_id).delete()
+        like = Like.objects.filter(user=user, post_id=post_id).first()
+        deleted = like.delete()[0] if like else 0
 
         if deleted:
             post = Post.objects.get(id=post_id)
@@ -219,9 +240,14 @@ class UnlikePost(graphene.Mutation):
             analytics.total_likes_recieved -= 1
             analytics.save()
 
-            metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=timezone.now().date())
+            # Count the removal against the day the like was made
+            metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=like.created_at.date())
             metric.likes = max(0, metric.likes - 1)
             metric.save()
+            mark_metrics_dirty(post.author_id, post.id, metric.date)
+
+            mark_most_liked_dirty(post.author_id)
+            record_affinity(post.author_id, user.id, 'likes', -1)
             
         return UnlikePost(ok=True)
     
@@ -276,6 +302,9 @@ class FollowUser(graphene.Mutation):
             raise GraphQLError('You cannot follow yourself')
         
         Follow.objects.get_or_create(follower=user, following_id=user_id)
+
+        # Only followers are eligible as most active follower
+        mark_most_active_dirty(user_id)
         return FollowUser(ok=True)
     
 
@@ -291,6 +320,8 @@ class UnfollowUser(graphene.Mutation):
             raise GraphQLError('Authentication required')
         
         Follow.objects.filter(follower=user, following_id=user_id).delete()
+
+        mark_most_active_dirty(user_id)
         return UnfollowUser(ok=True)
     
 
@@ -320,6 +351,9 @@ class SharePost(graphene.Mutation):
             metric, _ = PostDailyMetrics.objects.get_or_create(post=post, date=timezone.now().date())
             metric.shares += 1
             metric.save()
+            mark_metrics_dirty(post.author_id, post.id, metric.date)
+
+            record_affinity(post.author_id, user.id, 'shares')
 
         return SharePost(ok=True)
 
@@ -2,8 +2,9 @@ import graphene
 from graphql import GraphQLError
 from django.db.models import Count
 
-from feed.models import Post, Bookmark, Follow, Share, UserAnalytics, PostDailyMetrics
-from .types import PostType, ShareType, UserAnalyticsType, PostDailyMetricsType
+from feed.models import Post, Bookmark, Follow, Share, UserAnalytics
+from feed.rollups import ROLLUP_MODELS, period_start
+from .types import PostType, ShareType, UserAnalyticsType, MetricsBucketType, MetricsGranularity
 
 #------------------------------
 # Queries (READ DATA)
@@ -35,8 +36,19 @@ class Query(graphene.ObjectType):
     my_analytics = graphene.Field(UserAnalyticsType)
 
     post_metrics = graphene.List(
-        PostDailyMetricsType,
-        post_id=graphene.ID(required=True)
+        MetricsBucketType,
+        post_id=graphene.ID(required=True),
+        date_from=graphene.Date(name='from'),
+        date_to=graphene.Date(name='to'),
+        granularity=MetricsGranularity(default_value=MetricsGranularity.DAY.value),
+    )
+
+    author_metrics = graphene.List(
+        MetricsBucketType,
+        author_id=graphene.ID(),
+        date_from=graphene.Date(name='from'),
+        date_to=graphene.Date(name='to'),
+        granularity=MetricsGranularity(default_value=MetricsGranularity.DAY.value),
     )
 
     # --------- Resolver -----------
@@ -131,5 +143,35 @@ class Query(graphene.ObjectType):
         analytics, _ = UserAnalytics.objects.get_or_create(user=user)
         return analytics
     
-    def resolve_post_metrics(self, info, post_id):
-        return PostDailyMetrics.objects.filter(post_id=post_id).order_by('-date')
\ No newline at end of file
+    def resolve_post_metrics(self, info, post_id, date_from=None, date_to=None, granularity='day'):
+        return _metrics_range('post', {'post_id': post_id}, date_from, date_to, granularity)
+
+    def resolve_author_metrics(self, info, author_id=None, date_from=None, date_to=None, granularity='day'):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise GraphQLError('Authentication required')
+        if author_id is None:
+            author_id = user.id
+        elif str(author_id) != str(user.id) and not user.is_platform_admin:
+            # Another author's engagement is for platform admins only
+            raise GraphQLError('Not authorized to view these metrics')
+
+        return _metrics_range('author', {'author_id': author_id}, date_from, date_to, granularity)
+
+
+def _metrics_range(owner, lookup, date_from, date_to, granularity):
+    '''
+    Reads one owner's metrics from the rollup matching `granularity`,
+    newest period first, limited to periods overlapping [from, to].
+    '''
+    granularity = getattr(granularity, 'value', granularity)
+    if date_from and date_to and date_from > date_to:
+        raise GraphQLError('`from` must not be after `to`')
+
+    qs = ROLLUP_MODELS[(owner, granularity)].objects.filter(**lookup)
+    if date_from:
+        qs = qs.filter(date__gte=period_start(date_from, granularity))
+    if date_to:
+        qs = qs.filter(date__lte=date_to)
+
+    return qs.order_by('-date')
\ No newline at end of file
@@ -1,6 +1,6 @@
 import graphene
 from graphene_django import DjangoObjectType
-from feed.models import Post, Comment, Like, Bookmark, Follow, Share, UserAnalytics, PostDailyMetrics
+from feed.models import Post, Comment, Like, Bookmark, Follow, Share, UserAnalytics
 
 #---------------------------
 # GRAPHQL TYPES
@@ -102,7 +102,17 @@ class UserAnalyticsType(DjangoObjectType):
         )
 
 
-class PostDailyMetricsType(DjangoObjectType):
-    class Meta:
-        model = PostDailyMetrics
-        fields = ('date', 'likes', 'comments', 'shares')
\ No newline at end of file
+class MetricsGranularity(graphene.Enum):
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
+
+class MetricsBucketType(graphene.ObjectType):
+    '''
+    Engagement for one day, week or month; `date` is the first day of the period.
+    '''
+    date = graphene.Date()
+    likes = graphene.Int()
+    comments = graphene.Int()
+    shares = graphene.Int()
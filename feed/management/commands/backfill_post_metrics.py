@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from feed.backfill import backfill_post_daily_metrics, BACKFILL_WORKERS, BACKFILL_PARTITION_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild PostDailyMetrics from like, comment and share timestamps (safe to rerun)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start_date', type=date.fromisoformat, help='First day (YYYY-MM-DD), defaults to the oldest engagement')
+        parser.add_argument('--to', dest='end_date', type=date.fromisoformat, help='Last day (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='Worker processes')
+        parser.add_argument('--partition-days', type=int, default=BACKFILL_PARTITION_DAYS, help='Days per partition')
+
+    def handle(self, *args, **options):
+        result = backfill_post_daily_metrics(
+            start_date=options['start_date'],
+            end_date=options['end_date'],
+            workers=options['workers'],
+            partition_days=options['partition_days'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {result['partitions']} partitions in {result['duration_seconds']}s: "
+            f"{result['rows_written']} rows written, {result['rows_removed']} rows removed, "
+            f"{result['rollup_rows_written']} rollup rows written"
+        ))
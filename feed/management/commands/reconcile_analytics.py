@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from feed.reconcile import reconcile_all, RECONCILE_WORKERS, RECONCILE_RANGE_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recompute UserAnalytics totals from posts, likes, comments and shares and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=RECONCILE_WORKERS, help='Worker processes')
+        parser.add_argument('--range-size', type=int, default=RECONCILE_RANGE_SIZE, help='Users per range')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing corrections')
+
+    def handle(self, *args, **options):
+        stats = reconcile_all(workers=options['workers'], range_size=options['range_size'], apply=not options['dry_run'])
+
+        self.stdout.write(
+            f"Checked {stats['rows_checked']} rows in {stats['ranges']} ranges "
+            f"({stats['duration_seconds']}s): {stats['rows_drifted']} drifted, {stats['rows_created']} missing"
+        )
+        for field, field_stats in stats['fields'].items():
+            if field_stats['rows']:
+                self.stdout.write(
+                    f"  {field}: {field_stats['rows']} rows, total drift {field_stats['total_drift']}, "
+                    f"max {field_stats['max_drift']}"
+                )
+
+        if options['dry_run']:
+            self.stdout.write('Dry run, no rows were changed')
+        else:
+            self.stdout.write(self.style.SUCCESS('Reconciliation complete'))
@@ -1,16 +1,35 @@
-from rest_framework_simplejwt.authentication import JWTAuthentication
+import logging
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from accounts.authentication import CachedJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
 
 class GraphQLJWTMiddleware:
+    '''
+    Authenticates GraphQL requests from the JWT `Authorization` header.
+    Other routes are left to DRF's own authentication classes, so each
+    token is validated once per request.
+    '''
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.authenticator = CachedJWTAuthentication()
+        self.graphql_path = getattr(settings, 'GRAPHQL_PATH', '/graphql/')
 
     def __call__(self, request):
-        auth = JWTAuthentication()
-        try:
-            user, token = auth.authenticate(request)
-            if user:
-                request.user = user
-        except:
-            pass
+        if request.path.startswith(self.graphql_path):
+            try:
+                result = self.authenticator.authenticate(request)
+            except AuthenticationFailed as exc:
+                # Invalid or expired tokens fall back to an anonymous request
+                logger.debug('GraphQL JWT rejected: %s', exc)
+                result = None
+
+            if result is not None:
+                request.user, request.auth = result
 
         return self.get_response(request)
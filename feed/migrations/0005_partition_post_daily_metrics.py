@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:32
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+from django.db.migrations.exceptions import IrreversibleError
+
+from accounts.migrations._partitioning import convert_to_partitioned
+
+
+def partition_tables(apps, schema_editor):
+    convert_to_partitioned(schema_editor, apps.get_model('feed', 'PostDailyMetrics'), 'date')
+
+
+def keep_partitioned(apps, schema_editor):
+    raise IrreversibleError('feed.0005 cannot be unapplied: PostDailyMetrics stays partitioned')
+
+
+class Migration(migrations.Migration):
+    '''
+    Partitions PostDailyMetrics by month. Not atomic, so rows are copied in
+    committed batches while the table stays in use; it is locked only for
+    the final swap, which copies again the rows written meanwhile. A failed
+    run leaves a *_partitioned shadow table, a *_changes log and its
+    trigger to drop by hand before retrying.
+    '''
+    atomic = False
+
+    dependencies = [
+        ('feed', '0004_metric_rollups'),
+        ('accounts', '0006_partition_activity_and_sessions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postdailymetrics',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['date'], name='feed_postda_date_dc1472_brin'),
+        ),
+        migrations.RunPython(partition_tables, keep_partitioned, elidable=False),
+    ]
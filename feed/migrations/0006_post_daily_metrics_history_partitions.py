@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Min
+from django.utils import timezone
+
+from accounts.migrations._partitioning import create_partitions
+
+
+def create_history_partitions(apps, schema_editor):
+    # Unliking or deleting a comment charges the day the like or comment was
+    # made, so every month since the oldest engagement needs a partition
+    oldest = [
+        apps.get_model('feed', name).objects.aggregate(oldest=Min('created_at'))['oldest']
+        for name in ('Like', 'Comment', 'Share')
+    ]
+    oldest = [value for value in oldest if value is not None]
+    if not oldest:
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        create_partitions(cursor, apps.get_model('feed', 'PostDailyMetrics'), 'date', min(oldest), timezone.now().date())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_partition_post_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_history_partitions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0006_post_daily_metrics_history_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AffinityFlush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_id', models.CharField(max_length=32, unique=True)),
+                ('applied_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
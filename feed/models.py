@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex
 
 User = settings.AUTH_USER_MODEL
 
@@ -140,5 +141,108 @@ class PostDailyMetrics(models.Model):
     class Meta:
         unique_together = ('post', 'date')
         indexes = [
-            models.Index(fields=['post', 'date'])
-        ]
\ No newline at end of file
+            models.Index(fields=['post', 'date']),
+            # Partitioned monthly by date (accounts/partitions.py)
+            BrinIndex(fields=['date']),
+        ]
+
+
+class MetricsRollup(models.Model):
+    '''
+    Engagement summed over a period starting at `date` (the day, the Monday
+    of the week or the first of the month). Rebuilt from PostDailyMetrics by
+    the rollup job, never written by the mutations.
+    '''
+    date = models.DateField()
+    likes = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+    shares = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class PostWeeklyMetrics(MetricsRollup):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='weekly_metrics')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'date'], name='unique_post_weekly_metrics')
+        ]
+
+
+class PostMonthlyMetrics(MetricsRollup):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='monthly_metrics')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'date'], name='unique_post_monthly_metrics')
+        ]
+
+
+class AuthorDailyMetrics(MetricsRollup):
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'date'], name='unique_author_daily_metrics')
+        ]
+
+
+class AuthorWeeklyMetrics(MetricsRollup):
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'date'], name='unique_author_weekly_metrics')
+        ]
+
+
+class AuthorMonthlyMetrics(MetricsRollup):
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'date'], name='unique_author_monthly_metrics')
+        ]
+
+
+class FollowerAffinity(models.Model):
+    '''
+    Running count of one user's engagement with another user's posts.
+    Maintained incrementally from the engagement mutations.
+    '''
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    likes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    shares = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'follower'],
+                name='unique_author_follower_affinity'
+            )
+        ]
+        indexes = [
+            # Top-1 follower per author is read straight off this index
+            models.Index(fields=['author', '-score'], name='feed_affinity_author_score'),
+        ]
+
+    def __str__(self):
+        return f'{self.follower} -> {self.author} ({self.score})'
+
+
+class AffinityFlush(models.Model):
+    '''
+    A buffered affinity snapshot already written to FollowerAffinity.
+    Recorded in the same transaction as the upserts, so a snapshot left in
+    Redis by a flush that died after committing is never applied twice.
+    '''
+    snapshot_id = models.CharField(max_length=32, unique=True)
+    applied_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,158 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import Count, Min, Max
+
+from feed.models import Post, Like, Comment, Share, UserAnalytics
+
+logger = logging.getLogger(__name__)
+
+# UserAnalytics field -> (model, lookup from that model to the author's id)
+RECONCILED_TOTALS = {
+    'total_posts': (Post, 'author_id'),
+    'total_likes_recieved': (Like, 'post__author_id'),
+    'total_comments_recieved': (Comment, 'post__author_id'),
+    'total_shares_recieved': (Share, 'original_post__author_id'),
+}
+
+# Users per reconciliation range; each range is one unit of parallel work
+RECONCILE_RANGE_SIZE = getattr(settings, 'RECONCILE_RANGE_SIZE', 50000)
+
+RECONCILE_UPDATE_BATCH_SIZE = 1000
+
+RECONCILE_WORKERS = getattr(settings, 'RECONCILE_WORKERS', 4)
+
+
+def user_id_ranges(range_size=RECONCILE_RANGE_SIZE):
+    '''
+    Splits the user id space into half-open [start, end) ranges.
+    '''
+    bounds = get_user_model().objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+
+    return [
+        (start, min(start + range_size, bounds['high'] + 1))
+        for start in range(bounds['low'], bounds['high'] + 1, range_size)
+    ]
+
+
+def empty_drift_stats():
+    return {
+        'ranges': 0,
+        'rows_checked': 0,
+        'rows_drifted': 0,
+        'rows_created': 0,
+        'fields': {field: {'rows': 0, 'total_drift': 0, 'max_drift': 0} for field in RECONCILED_TOTALS},
+    }
+
+
+def merge_drift_stats(results):
+    merged = empty_drift_stats()
+    for stats in results:
+        for key in ('ranges', 'rows_checked', 'rows_drifted', 'rows_created'):
+            merged[key] += stats[key]
+        for field, field_stats in stats['fields'].items():
+            merged['fields'][field]['rows'] += field_stats['rows']
+            merged['fields'][field]['total_drift'] += field_stats['total_drift']
+            merged['fields'][field]['max_drift'] = max(merged['fields'][field]['max_drift'], field_stats['max_drift'])
+    return merged
+
+
+def reconcile_user_range(start, end, apply=True):
+    '''
+    Recomputes the true UserAnalytics totals for users with start <= id < end
+    from grouped aggregates over Post, Like, Comment and Share, and writes
+    corrections for the rows that differ with bulk_update.
+    Returns drift statistics for the range.
+    '''
+    true_totals = {}
+    for field, (model, author_lookup) in RECONCILED_TOTALS.items():
+        rows = (
+            model.objects
+            .filter(**{f'{author_lookup}__gte': start, f'{author_lookup}__lt': end})
+            .order_by()
+            .values(author_lookup)
+            .annotate(total=Count('id'))
+            .values_list(author_lookup, 'total')
+        )
+        true_totals[field] = dict(rows)
+
+    stats = empty_drift_stats()
+    stats['ranges'] = 1
+    drifted = []
+
+    analytics_rows = UserAnalytics.objects.filter(user_id__gte=start, user_id__lt=end).only('id', 'user_id', *RECONCILED_TOTALS)
+    seen_users = set()
+
+    for analytics in analytics_rows.iterator(chunk_size=2000):
+        seen_users.add(analytics.user_id)
+        stats['rows_checked'] += 1
+        changed = False
+
+        for field in RECONCILED_TOTALS:
+            actual = true_totals[field].get(analytics.user_id, 0)
+            drift = abs(getattr(analytics, field) - actual)
+            if drift:
+                field_stats = stats['fields'][field]
+                field_stats['rows'] += 1
+                field_stats['total_drift'] += drift
+                field_stats['max_drift'] = max(field_stats['max_drift'], drift)
+                setattr(analytics, field, actual)
+                changed = True
+
+        if changed:
+            drifted.append(analytics)
+
+    # Users whose analytics row was never created (e.g. signals skipped by bulk inserts)
+    missing_users = (
+        get_user_model().objects
+        .filter(id__gte=start, id__lt=end)
+        .exclude(id__in=seen_users)
+        .values_list('id', flat=True)
+    )
+    missing = [
+        UserAnalytics(user_id=user_id, **{field: true_totals[field].get(user_id, 0) for field in RECONCILED_TOTALS})
+        for user_id in missing_users
+    ]
+
+    stats['rows_drifted'] = len(drifted)
+    stats['rows_created'] = len(missing)
+
+    if apply and (drifted or missing):
+        with transaction.atomic():
+            UserAnalytics.objects.bulk_update(drifted, list(RECONCILED_TOTALS), batch_size=RECONCILE_UPDATE_BATCH_SIZE)
+            UserAnalytics.objects.bulk_create(missing, batch_size=RECONCILE_UPDATE_BATCH_SIZE, ignore_conflicts=True)
+
+    return stats
+
+
+def reconcile_all(workers=RECONCILE_WORKERS, range_size=RECONCILE_RANGE_SIZE, apply=True):
+    '''
+    Reconciles every user range across a pool of worker processes and
+    returns the merged drift statistics.
+    '''
+    started = time.monotonic()
+    ranges = user_id_ranges(range_size)
+    results = []
+
+    if workers <= 1 or len(ranges) <= 1:
+        results = [reconcile_user_range(start, end, apply) for start, end in ranges]
+    else:
+        # Forked workers must not share the parent's database sockets
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {pool.submit(reconcile_user_range, start, end, apply): (start, end) for start, end in ranges}
+            for future in as_completed(futures):
+                stats = future.result()
+                results.append(stats)
+                logger.debug('Reconciled users %s-%s: %s rows drifted', *futures[future], stats['rows_drifted'])
+
+    stats = merge_drift_stats(results)
+    stats['duration_seconds'] = round(time.monotonic() - started, 2)
+    return stats
@@ -0,0 +1,149 @@
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django_redis import get_redis_connection
+
+from accounts.breaker import best_effort
+from feed.analytics import claim_dirty, ack_dirty
+from feed.models import (
+    Post, PostDailyMetrics, PostWeeklyMetrics, PostMonthlyMetrics,
+    AuthorDailyMetrics, AuthorWeeklyMetrics, AuthorMonthlyMetrics,
+)
+
+# (author, post, day) triples whose PostDailyMetrics row changed since the last rollup
+ROLLUP_DIRTY_KEY = 'analytics:dirty:metric_rollups'
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Rollup model -> (owner column, source, period). Author days are built
+# before author weeks and months, which are summed from them.
+ROLLUPS = (
+    (PostWeeklyMetrics, 'post_id', 'post_daily', 'week'),
+    (PostMonthlyMetrics, 'post_id', 'post_daily', 'month'),
+    (AuthorDailyMetrics, 'author_id', 'post_daily', 'day'),
+    (AuthorWeeklyMetrics, 'author_id', 'author_daily', 'week'),
+    (AuthorMonthlyMetrics, 'author_id', 'author_daily', 'month'),
+)
+
+# Model read for each (owner, granularity) by the GraphQL queries
+ROLLUP_MODELS = {
+    ('post', 'day'): PostDailyMetrics,
+    ('post', 'week'): PostWeeklyMetrics,
+    ('post', 'month'): PostMonthlyMetrics,
+    ('author', 'day'): AuthorDailyMetrics,
+    ('author', 'week'): AuthorWeeklyMetrics,
+    ('author', 'month'): AuthorMonthlyMetrics,
+}
+
+
+def period_start(day, period):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+@best_effort
+def mark_metrics_dirty(author_id, post_id, *days):
+    if not days:
+        return
+    redis = get_redis_connection('default')
+    redis.sadd(ROLLUP_DIRTY_KEY, *(f'{author_id}:{post_id}:{day.isoformat()}' for day in days))
+
+
+def claim_metrics_dirty(count):
+    return [member.decode() for member in claim_dirty(ROLLUP_DIRTY_KEY, count)]
+
+
+def ack_metrics_dirty(entries):
+    ack_dirty(ROLLUP_DIRTY_KEY, entries)
+
+
+def _source_sql(source, owner):
+    daily = PostDailyMetrics._meta.db_table
+    if source == 'author_daily':
+        return f'SELECT author_id AS owner, date, likes, comments, shares FROM {AuthorDailyMetrics._meta.db_table}'
+    if owner == 'author_id':
+        return (
+            f'SELECT p.author_id AS owner, d.date, d.likes, d.comments, d.shares '
+            f'FROM {daily} d JOIN {Post._meta.db_table} p ON p.id = d.post_id'
+        )
+    return f'SELECT post_id AS owner, date, likes, comments, shares FROM {daily}'
+
+
+def _rollup_sql(model, owner, source, period, keys_sql):
+    table = model._meta.db_table
+    owner_table = model._meta.get_field(owner.removesuffix('_id')).related_model._meta.db_table
+    columns = ('likes', 'comments', 'shares')
+
+    return f'''
+        INSERT INTO {table} ({owner}, date, likes, comments, shares)
+        SELECT k.owner, k.period, {', '.join(f'COALESCE(SUM(s.{c}), 0)' for c in columns)}
+        FROM ({keys_sql}) AS k(owner, period)
+        -- Skip posts and users deleted since the change was recorded
+        JOIN {owner_table} o ON o.id = k.owner
+        LEFT JOIN ({_source_sql(source, owner)}) AS s
+          ON s.owner = k.owner
+         AND s.date >= k.period AND s.date < (k.period + interval '1 {period}')::date
+        GROUP BY k.owner, k.period
+        ON CONFLICT ({owner}, date) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in columns)}
+        WHERE ({', '.join(f'{table}.{c}' for c in columns)})
+              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in columns)})
+    '''
+
+
+def apply_rollups(entries):
+    '''
+    Rebuilds every rollup row covering the given dirty '<author>:<post>:<day>'
+    entries from the daily rows. Returns the number of rollup rows written.
+    '''
+    triples = set()
+    for entry in entries:
+        author_id, post_id, day = entry.split(':')
+        triples.add((int(author_id), int(post_id), date.fromisoformat(day)))
+
+    if not triples:
+        return 0
+
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, owner, source, period in ROLLUPS:
+            keys = list({
+                (author_id if owner == 'author_id' else post_id, period_start(day, period))
+                for author_id, post_id, day in triples
+            })
+            keys_sql = 'SELECT DISTINCT * FROM unnest(%s::bigint[], %s::date[])'
+            cursor.execute(
+                _rollup_sql(model, owner, source, period, keys_sql),
+                [[owner_id for owner_id, _ in keys], [day for _, day in keys]],
+            )
+            written += cursor.rowcount
+
+    return written
+
+
+def rebuild_rollups(date_from, date_to):
+    '''
+    Rebuilds every rollup period overlapping [date_from, date_to), e.g. after
+    a PostDailyMetrics backfill. Returns the number of rollup rows written.
+    '''
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, owner, source, period in ROLLUPS:
+            period_from = period_start(date_from, period)
+            keys_sql = f'''
+                SELECT owner, date_trunc('{period}', date)::date FROM ({_source_sql(source, owner)}) AS s
+                WHERE date >= %(date_from)s AND date < %(date_to)s
+                UNION
+                SELECT {owner}, date FROM {model._meta.db_table}
+                WHERE date >= %(date_from)s AND date < %(date_to)s
+            '''
+            cursor.execute(
+                _rollup_sql(model, owner, source, period, keys_sql),
+                {'date_from': period_from, 'date_to': date_to},
+            )
+            written += cursor.rowcount
+
+    return written
@@ -0,0 +1,162 @@
+import logging
+
+from celery import shared_task, chord
+
+from feed.models import UserAnalytics
+from feed.analytics import (
+    MOST_LIKED_DIRTY_KEY, MOST_ACTIVE_DIRTY_KEY, recover_dirty, flush_affinity,
+    claim_most_liked_dirty, ack_most_liked_dirty, recompute_most_liked_posts,
+    claim_most_active_dirty, ack_most_active_dirty, recompute_most_active_followers,
+)
+from feed.reconcile import user_id_ranges, reconcile_user_range, merge_drift_stats
+from feed.rollups import ROLLUP_DIRTY_KEY, claim_metrics_dirty, ack_metrics_dirty, apply_rollups
+from accounts.locks import LeaseLock, LockLost, single_flight, renew_lock, release_lock
+
+logger = logging.getLogger(__name__)
+
+# Authors recomputed per statement
+MOST_LIKED_BATCH_SIZE = 1000
+MOST_ACTIVE_BATCH_SIZE = 1000
+ROLLUP_BATCH_SIZE = 5000
+
+# Held from dispatch until the chord callback runs, so reconciliations never
+# overlap; every range renews it, and a crashed chord frees it in one lease
+RECONCILE_LOCK = 'feed.tasks.reconcile_user_analytics'
+RECONCILE_LEASE = 30 * 60
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+@single_flight(lease=60)
+def update_most_liked_posts(self, full=False):
+    '''
+    Recomputes UserAnalytics.most_liked_post for authors whose likes changed
+    since the last run (the dirty set maintained by the like mutations).
+    Pass full=True to recompute every author, e.g. after a backfill.
+    '''
+    updated = 0
+    authors = 0
+
+    if full:
+        last_id = 0
+        while True:
+            author_ids = list(
+                UserAnalytics.objects.filter(user_id__gt=last_id)
+                .order_by('user_id')
+                .values_list('user_id', flat=True)[:MOST_LIKED_BATCH_SIZE]
+            )
+            if not author_ids:
+                break
+            updated += recompute_most_liked_posts(author_ids)
+            authors += len(author_ids)
+            last_id = author_ids[-1]
+    else:
+        # A batch stays claimed until recomputed; the retry of a failed run recovers it
+        recover_dirty(MOST_LIKED_DIRTY_KEY)
+        while True:
+            author_ids = claim_most_liked_dirty(MOST_LIKED_BATCH_SIZE)
+            if not author_ids:
+                break
+            updated += recompute_most_liked_posts(author_ids)
+            ack_most_liked_dirty(author_ids)
+            authors += len(author_ids)
+
+    logger.info('Most liked posts: %s authors checked, %s rows updated', authors, updated)
+    return {'authors': authors, 'updated': updated}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+@single_flight(lease=60)
+def update_most_active_followers(self):
+    '''
+    Flushes buffered follower-affinity increments, then sets
+    UserAnalytics.most_active_follower for every author whose
+    affinities or followers changed since the last run.
+    '''
+    pairs = flush_affinity()
+
+    updated = 0
+    authors = 0
+    recover_dirty(MOST_ACTIVE_DIRTY_KEY)
+    while True:
+        author_ids = claim_most_active_dirty(MOST_ACTIVE_BATCH_SIZE)
+        if not author_ids:
+            break
+        updated += recompute_most_active_followers(author_ids)
+        ack_most_active_dirty(author_ids)
+        authors += len(author_ids)
+
+    logger.info('Most active followers: %s affinity pairs flushed, %s authors checked, %s rows updated', pairs, authors, updated)
+    return {'pairs_flushed': pairs, 'authors': authors, 'updated': updated}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+@single_flight(lease=60)
+def update_metric_rollups(self):
+    '''
+    Rebuilds the weekly/monthly post rollups and the author rollups for
+    every post-day whose PostDailyMetrics row changed since the last run.
+    '''
+    entries = 0
+    written = 0
+    recover_dirty(ROLLUP_DIRTY_KEY)
+    while True:
+        batch = claim_metrics_dirty(ROLLUP_BATCH_SIZE)
+        if not batch:
+            break
+        written += apply_rollups(batch)
+        ack_metrics_dirty(batch)
+        entries += len(batch)
+
+    logger.info('Metric rollups: %s post-days rolled up, %s rows written', entries, written)
+    return {'post_days': entries, 'written': written}
+
+
+@shared_task
+def reconcile_user_analytics(apply=True):
+    '''
+    Recomputes UserAnalytics totals from the engagement tables. Each user-id
+    range runs as its own subtask so the work spreads across the worker pool;
+    the drift statistics are merged and logged once every range finishes.
+    The run holds RECONCILE_LOCK until then, so an overlapping invocation is
+    skipped instead of racing its updates.
+    '''
+    ranges = user_id_ranges()
+    if not ranges:
+        return None
+
+    lock = LeaseLock(RECONCILE_LOCK, RECONCILE_LEASE)
+    if not lock.acquire(heartbeat=False):
+        logger.warning('%s is already running; skipping this invocation', RECONCILE_LOCK)
+        return {'skipped': 'locked'}
+
+    try:
+        chord(reconcile_user_analytics_range.s(start, end, apply, lock.token) for start, end in ranges)(
+            summarize_reconciliation.s(lock.token).on_error(release_reconciliation_lock.si(lock.token))
+        )
+    except Exception:
+        lock.release()
+        raise
+    return len(ranges)
+
+
+@shared_task(autoretry_for=(Exception,), dont_autoretry_for=(LockLost,), retry_backoff=30, retry_kwargs={'max_retries': 3})
+def reconcile_user_analytics_range(start, end, apply=True, lock_token=None):
+    if lock_token is not None and not renew_lock(RECONCILE_LOCK, lock_token, RECONCILE_LEASE):
+        # The lease ran out and another reconciliation may be updating these rows
+        raise LockLost(f'Lock {RECONCILE_LOCK} expired before range [{start}, {end}) ran')
+    return reconcile_user_range(start, end, apply)
+
+
+@shared_task
+def summarize_reconciliation(results, lock_token=None):
+    if lock_token is not None:
+        release_lock(RECONCILE_LOCK, lock_token)
+    stats = merge_drift_stats(results)
+    logger.info('User analytics reconciliation: %s', stats)
+    return stats
+
+
+@shared_task
+def release_reconciliation_lock(lock_token):
+    # Error callback of the reconciliation chord
+    release_lock(RECONCILE_LOCK, lock_token)
@@ -1,3 +1,59 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from accounts.locks import LOCK_KEY, LockLost
+from accounts.models import User
+from accounts.tests import RedisTestCase
+from feed.analytics import DIRTY_PROCESSING_KEY, MOST_ACTIVE_DIRTY_KEY, mark_most_active_dirty
+from feed.tasks import (
+    RECONCILE_LOCK, reconcile_user_analytics, reconcile_user_analytics_range, summarize_reconciliation,
+    update_most_active_followers,
+)
+
+
+class ReconcileLockTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(email='author@example.com', password='x', username='author', name='Author')
+        self.lock_key = LOCK_KEY.format(name=RECONCILE_LOCK)
+
+    @mock.patch('feed.tasks.chord')
+    def test_lock_is_held_until_the_chord_finishes(self, chord):
+        self.assertEqual(reconcile_user_analytics(), 1)
+        token = chord.return_value.call_args.args[0].args[0]
+
+        # The ranges are still running: a new run must not start
+        self.assertEqual(self.redis.get(self.lock_key).decode(), token)
+        self.assertEqual(reconcile_user_analytics(), {'skipped': 'locked'})
+
+        summarize_reconciliation([], token)
+        self.assertIsNone(self.redis.get(self.lock_key))
+
+    @mock.patch('feed.tasks.chord', side_effect=ConnectionError)
+    def test_lock_is_released_when_dispatch_fails(self, chord):
+        with self.assertRaises(ConnectionError):
+            reconcile_user_analytics()
+        self.assertIsNone(self.redis.get(self.lock_key))
+
+    def test_range_refuses_to_run_after_the_lease_lapsed(self):
+        with self.assertRaises(LockLost):
+            reconcile_user_analytics_range(1, 2, True, 'expired-token')
+
+
+class DirtyDrainTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.processing_key = DIRTY_PROCESSING_KEY.format(key=MOST_ACTIVE_DIRTY_KEY)
+        mark_most_active_dirty(1, 2, 3)
+
+    def test_ids_of_a_failed_run_are_recomputed_by_the_next(self):
+        with mock.patch('feed.tasks.recompute_most_active_followers', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                update_most_active_followers()
+        self.assertEqual(self.redis.smembers(self.processing_key), {b'1', b'2', b'3'})
+
+        with mock.patch('feed.tasks.recompute_most_active_followers', return_value=3) as recompute:
+            result = update_most_active_followers()
+
+        self.assertEqual(sorted(recompute.call_args.args[0]), [1, 2, 3])
+        self.assertEqual(result['authors'], 3)
+        self.assertFalse(self.redis.exists(MOST_ACTIVE_DIRTY_KEY, self.processing_key))
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from accounts.breaker import CircuitOpenError
+from accounts.utils import get_client_ip
+
+logger = logging.getLogger(__name__)
+
+# Budgets are expressed in cost points per period, e.g. '600/min'
+DEFAULT_GRAPHQL_COST_RATES = {
+    'user': '600/min',   # per authenticated user
+    'ip': '1200/min',    # per IP for authenticated traffic (shared NATs)
+    'anon': '300/min',   # per IP for anonymous traffic
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Per-process window counters used while Redis is unreachable
+LOCAL_MAX_KEYS = 10000
+_local_counts = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class GraphQLCostThrottle:
+    '''
+    Fixed-window cost buckets for the GraphQL endpoint.
+    Each operation is charged its computed cost against:
+    - a per-user and a per-IP bucket for authenticated requests
+    - a per-IP bucket for anonymous requests
+    '''
+    cache_format = 'graphql_cost:{scope}:{ident}:{window}'
+
+    def __init__(self, request):
+        self.request = request
+        self.rates = {**DEFAULT_GRAPHQL_COST_RATES, **getattr(settings, 'GRAPHQL_COST_RATES', {})}
+
+    def get_buckets(self):
+        ip = get_client_ip(self.request)
+        user = getattr(self.request, 'user', None)
+
+        if user is not None and user.is_authenticated:
+            return [('user', user.pk), ('ip', ip)]
+        return [('anon', ip)]
+
+    def consume(self, cost):
+        '''
+        Charges `cost` against every bucket in one pipelined round trip, or
+        against per-process counters while Redis is unavailable.
+        Returns (allowed, limit, remaining, reset) for the most restrictive bucket.
+        '''
+        now = int(time.time())
+        buckets = []
+        for scope, ident in self.get_buckets():
+            limit, duration = parse_rate(self.rates[scope])
+            key = self.cache_format.format(scope=scope, ident=ident, window=now // duration)
+            buckets.append((key, limit, duration))
+
+        try:
+            used_counts = self._charge_redis(buckets, cost)
+        except RedisError as exc:
+            # An open breaker has already been logged
+            if not isinstance(exc, CircuitOpenError):
+                logger.warning('Charging GraphQL cost in-process, Redis is unavailable', exc_info=True)
+            used_counts = self._charge_local(buckets, cost)
+
+        allowed = True
+        headers = None
+        for (_, limit, duration), used in zip(buckets, used_counts):
+            remaining = max(0, limit - int(used))
+            reset = duration - (now % duration)
+
+            if int(used) > limit:
+                allowed = False
+            if headers is None or remaining < headers[1]:
+                headers = (limit, remaining, reset)
+
+        return (allowed,) + headers
+
+    def _charge_redis(self, buckets, cost):
+        pipe = get_redis_connection('default').pipeline()
+        for key, _, duration in buckets:
+            pipe.incrby(key, cost)
+            pipe.expire(key, duration)
+        return pipe.execute()[::2]
+
+    def _charge_local(self, buckets, cost):
+        used_counts = []
+        with _local_lock:
+            for key, _, _ in buckets:
+                _local_counts[key] = _local_counts.get(key, 0) + cost
+                _local_counts.move_to_end(key)
+                used_counts.append(_local_counts[key])
+            # Keys embed their window, so old windows age out of the LRU
+            while len(_local_counts) > LOCAL_MAX_KEYS:
+                _local_counts.popitem(last=False)
+        return used_counts
@@ -1,7 +1,61 @@
 from django.shortcuts import render
+from django.http import HttpResponse
+from graphene_django.views import GraphQLView, HttpError
+from graphql import GraphQLError, OperationType, get_operation_ast, parse
+
+from Qela.db_router import use_replica
+
+from feed.graphql.cost import operation_cost
+from feed.throttles import GraphQLCostThrottle
 
 def custom_404_view(request, exception):
     return render(request, 'pages/404.html', status=404)
 
 def custom_500_view(request):
-    return render(request, 'pages/500.html', status=500)
\ No newline at end of file
+    return render(request, 'pages/500.html', status=500)
+
+
+def is_query_operation(query, operation_name):
+    try:
+        operation = get_operation_ast(parse(query), operation_name)
+    except GraphQLError:
+        return False
+    return operation is not None and operation.operation == OperationType.QUERY
+
+
+class RateLimitedGraphQLView(GraphQLView):
+    '''
+    GraphQL endpoint that charges every operation its computed cost
+    against Redis-backed per-user and per-IP budgets before executing it.
+    Query operations read from a replica; mutations use the primary.
+    '''
+    throttle_class = GraphQLCostThrottle
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+
+        for header, value in getattr(request, '_ratelimit_headers', {}).items():
+            response[header] = value
+        return response
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if query:
+            cost = operation_cost(query, variables, operation_name)
+            allowed, limit, remaining, reset = self.throttle_class(request).consume(cost)
+
+            request._ratelimit_headers = {
+                'RateLimit-Limit': str(limit),
+                'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(reset),
+            }
+
+            if not allowed:
+                response = HttpResponse(status=429)
+                response['Retry-After'] = str(reset)
+                raise HttpError(response, 'Rate limit exceeded. Try again in {} second(s).'.format(reset))
+
+        if query and is_query_operation(query, operation_name):
+            with use_replica():
+                return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+        return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)